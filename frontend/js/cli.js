@@ -47,18 +47,25 @@ if (!print_help) {
                       base_uri);
     } else {
         const command = process.argv[ind];
-        main.find_files(command, process.argv.slice(ind+1), function (argv) {
-            main.callGeneric(command, argv,
-                             function (res) {
-                                 if (res['ec'] !== 0) {
-                                     console.log('job_status: "' + res['status'] + '"');
-                                 }
-                                 if (res['output'].length > 0) {
-                                     console.log(res['output'].trim());
-                                 }
-                                 process.exitCode = res['ec'];
-                             },
-                             base_uri);
+        const print_result = (function (res) {
+            if (res['ec'] !== 0) {
+                console.log('job_status: "' + res['status'] + '"');
+            }
+            if (res['output'].length > 0) {
+                console.log(res['output'].trim());
+            }
+            process.exitCode = res['ec'];
         });
+        const send_json = (function () {
+            main.find_files(command, process.argv.slice(ind+1), function (argv) {
+                main.callGeneric(command, argv, print_result, base_uri);
+            });
+        });
+        if (main.fileIndices(command, process.argv.slice(ind+1)).length > 0) {
+            main.callGenericMultipart(command, process.argv.slice(ind+1),
+                                      print_result, base_uri, send_json);
+        } else {
+            send_json();
+        }
     }
 }
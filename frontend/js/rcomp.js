@@ -113,6 +113,65 @@ exports.find_files = (function (command, argv, callback, index, options) {
 });
 
 
+// fileIndices( command, argv )
+//
+// return array of indices of elements of argv that are file names.
+// This function is entirely similar to file_indices() in the Python
+// client.
+exports.fileIndices = (function (command, argv) {
+    var indices = [];
+    if (command === 'ltl2ba') {
+        for (var index = 0; index + 1 < argv.length; index++) {
+            if (argv[index] === '-F') {
+                indices.push(index + 1);
+            }
+        }
+    } else if (command === 'gr1c') {
+        var all_files = false;
+        for (var index = 0; index < argv.length; index++) {
+            if (argv[index] === '--') {
+                all_files = true;
+            } else if (all_files || argv[index][0] !== '-') {
+                indices.push(index);
+            }
+        }
+    }
+    return indices;
+});
+
+
+// readFileParts( argv, indices, codec, callback, parts )
+//
+// Read and compress files named in argv at the given indices, and
+// pass an array of Buffer objects to callback in the same order.
+//
+// `parts` is used internally for recursion, so should not be given.
+function readFileParts( argv, indices, codec, callback, parts ) {
+    if (parts === undefined) {
+        parts = [];
+    }
+    if (parts.length == indices.length) {
+        callback(parts);
+        return;
+    }
+    fs.readFile(argv[indices[parts.length]], (err, data) => {
+        if (err) throw err;
+        var done = (function (err, data) {
+            if (err) throw err;
+            parts.push(data);
+            readFileParts(argv, indices, codec, callback, parts);
+        });
+        if (codec === 'gzip') {
+            zlib.gzip(data, done);
+        } else if (codec === 'none') {
+            done(null, data);
+        } else {  // codec === 'zlib'
+            zlib.deflate(data, done);
+        }
+    });
+}
+
+
 // getIndex( result_function, base_uri )
 //
 // result_function is a function that is called with the JSON body of
@@ -165,6 +224,88 @@ exports.getServerVersion = (function (result_function, base_uri) {
     req.end();
 });
 
+// pollStatus( job_id, result_function, base_uri )
+//
+// Request status of job until it is done. Servers that support
+// long-polling hold each request until the job is done or the `wait`
+// duration (seconds) elapses, so there is no need to poll quickly.
+//
+// This function is intended for the internal implementation of this
+// client library, and the API for it may change without warning.
+function pollStatus( job_id, result_function, base_uri ) {
+    var reqf = createProtoRequest( {path: '/status/'+job_id+'?wait=30&output=inline'}, base_uri );
+    var data = '';
+    var req = reqf((res) => {
+        res.on('data', (chunk) => {
+            data += chunk;
+        });
+        res.on('end', () => {
+            var msg = JSON.parse(data);
+            if (msg['done']) {
+                result_function(msg);
+            } else {
+                setTimeout(pollStatus, 300, job_id, result_function, base_uri);
+            }
+        });
+    });
+    req.on('error', (err) => {
+        console.error(err);
+    });
+    req.end();
+}
+
+
+// waitForJob( job_id, result_function, base_uri )
+//
+// Follow the stream of server-sent events about the job until it is
+// done, and then call result_function with the final status. If the
+// server does not provide the stream, or it ends early, then fall back
+// to pollStatus().
+//
+// This function is intended for the internal implementation of this
+// client library, and the API for it may change without warning.
+function waitForJob( job_id, result_function, base_uri ) {
+    var reqf = createProtoRequest( {path: '/status/'+job_id+'/events?output=inline'}, base_uri );
+    var finished = false;
+    var fallback = (function () {
+        if (!finished) {
+            finished = true;
+            pollStatus(job_id, result_function, base_uri);
+        }
+    });
+    var req = reqf((res) => {
+        if (res.statusCode !== 200
+            || !String(res.headers['content-type']).startsWith('text/event-stream')) {
+            res.resume();
+            fallback();
+            return;
+        }
+        res.setEncoding('utf8');
+        var buffer = '';
+        res.on('data', (chunk) => {
+            buffer += chunk;
+            var end = buffer.indexOf('\n\n');
+            while (end !== -1) {
+                var lines = buffer.slice(0, end).split('\n');
+                buffer = buffer.slice(end + 2);
+                for (var ii = 0; ii < lines.length; ii++) {
+                    if (lines[ii].startsWith('data:')) {
+                        var msg = JSON.parse(lines[ii].slice('data:'.length));
+                        if (msg['done'] && !finished) {
+                            finished = true;
+                            result_function(msg);
+                        }
+                    }
+                }
+                end = buffer.indexOf('\n\n');
+            }
+        });
+        res.on('end', fallback);
+    });
+    req.on('error', fallback);
+    req.end();
+}
+
 // callGeneric( cmd, argv, result_function, base_uri )
 //
 // cmd is the remote program name, e.g., `ltl2ba`.
@@ -198,34 +339,12 @@ exports.callGeneric = (function (cmd, argv, result_function, base_uri) {
         });
         res.on('end', () => {
             var msg = JSON.parse(data);
-            if (msg['done']) {
+            // Outputs of jobs that are done at once, e.g., cached
+            // results, are only sent when asked for.
+            if (msg['done'] && msg['output'] !== undefined) {
                 result_function(msg);
             } else {
-                var timeout = undefined;
-                timeout = setInterval((job_id) => {
-
-                    var reqf = createProtoRequest( {path: '/status/'+job_id}, base_uri );
-                    var data = '';
-                    var req = reqf((res) => {
-                        res.on('data', (chunk) => {
-                            data += chunk;
-                        });
-                        res.on('end', () => {
-                            var msg = JSON.parse(data);
-                            if (msg['done']) {
-                                clearInterval(timeout);
-                                result_function(msg);
-                            }
-                        });
-                    });
-                    req.on('error', (err) => {
-                        console.error(err);
-                    });
-                    req.end();
-
-                                     },
-                                      300,
-                                      msg['id']);
+                waitForJob(msg['id'], result_function, base_uri);
             }
         });
     });
@@ -235,3 +354,77 @@ exports.callGeneric = (function (cmd, argv, result_function, base_uri) {
     req.write(body);
     req.end();
 });
+
+
+// callGenericMultipart( cmd, argv, result_function, base_uri, fallback, codec )
+//
+// Like callGeneric(), except that argv contains names of local files,
+// which are sent as binary parts of a multipart request instead of
+// being encoded in JSON.
+//
+// fallback (optional) is a function that is called with no arguments
+// if the server does not support multipart requests, e.g., to try
+// find_files() and callGeneric() instead.
+//
+// codec (optional) is the compression of file data, one of 'zlib'
+// (default), 'gzip', or 'none'.
+exports.callGenericMultipart = (function (cmd, argv, result_function, base_uri, fallback, codec) {
+    if (codec === undefined) {
+        codec = 'zlib';
+    }
+    var indices = exports.fileIndices(cmd, argv);
+    readFileParts(argv, indices, codec, (parts) => {
+        var boundary = 'rcomp' + String(Math.random()).slice(2);
+        var chunks = [
+            Buffer.from('--' + boundary + '\r\n'
+                        + 'Content-Disposition: form-data; name="job"\r\n'
+                        + 'Content-Type: application/json\r\n\r\n'
+                        + JSON.stringify({argv: argv, codec: codec}) + '\r\n')
+        ];
+        for (var ii = 0; ii < parts.length; ii++) {
+            chunks.push(Buffer.from('--' + boundary + '\r\n'
+                                    + 'Content-Disposition: form-data; name="file"; filename="file'
+                                    + String(ii) + '"\r\n'
+                                    + 'Content-Type: application/octet-stream\r\n\r\n'));
+            chunks.push(parts[ii]);
+            chunks.push(Buffer.from('\r\n'));
+        }
+        chunks.push(Buffer.from('--' + boundary + '--\r\n'));
+        var body = Buffer.concat(chunks);
+        var options = {
+            path: '/'+cmd,
+            method: 'POST',
+            headers: {
+                'Content-Type': 'multipart/form-data; boundary=' + boundary,
+                'Content-Length': body.length
+            }
+        };
+        var reqf = createProtoRequest( options, base_uri );
+        var data = '';
+        var req = reqf((res) => {
+            res.on('data', (chunk) => {
+                data += chunk;
+            });
+            res.on('end', () => {
+                if (res.statusCode === 500 && fallback) {
+                    // Server predates multipart requests
+                    fallback();
+                    return;
+                }
+                var msg = JSON.parse(data);
+                if (res.statusCode !== 200) {
+                    console.error(msg);
+                } else if (msg['done'] && msg['output'] !== undefined) {
+                    result_function(msg);
+                } else {
+                    waitForJob(msg['id'], result_function, base_uri);
+                }
+            });
+        });
+        req.on('error', (err) => {
+            console.error(err);
+        });
+        req.write(body);
+        req.end();
+    });
+});
@@ -2,3 +2,6 @@ try:
     from ._version import version as __version__
 except ImportError:
     __version__ = '0.0.0-dev0+Unknown'
+
+from .client import Client, AsyncClient, Result, RcompError, ServerBusy
+from .memo import Memo
@@ -0,0 +1,81 @@
+"""running many jobs that are described in a manifest
+
+A manifest is a JSON file with a list of jobs, or an object with field
+`jobs` that is such a list. Each job is an object with fields
+`command` and `argv`, and optionally `timeout`, `priority`, and
+`output`, e.g.,
+
+    {"jobs": [{"command": "gr1c", "argv": ["-r", "a.spc"], "output": "a.out"},
+              {"command": "gr1c", "argv": ["-r", "b.spc"]}]}
+
+Relative paths of files in `argv` are relative to the directory of the
+manifest. The output of each job is written to the file `output`, or
+if it is not given, to a file named after the position of the job in
+the manifest, e.g., `0.out`. If the job has output on stderr, it is
+written to the same path with `.stderr` appended.
+"""
+import collections
+import json
+import os.path
+import sys
+
+from .client import file_indices
+
+
+def load_manifest(path):
+    with open(path) as fp:
+        manifest = json.load(fp)
+    if isinstance(manifest, dict):
+        manifest = manifest['jobs']
+    return manifest
+
+
+def run_manifest(client, manifest_path, output_dir=None, max_running=8, chunk_size=50):
+    """run all jobs of manifest with `client` and write their outputs.
+
+    return list with exit code of each job, where None indicates
+    that the job was rejected or lost.
+    """
+    manifest = load_manifest(manifest_path)
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    if output_dir is None:
+        output_dir = base_dir
+    jobs = []
+    for job in manifest:
+        job = dict(job, argv=list(job.get('argv', [])))
+        for ii in file_indices(job['command'], job['argv']):
+            job['argv'][ii] = os.path.join(base_dir, job['argv'][ii])
+        jobs.append(job)
+
+    def write_result(index, result):
+        path = os.path.join(output_dir, manifest[index].get('output', '{}.out'.format(index)))
+        with open(path, 'w') as fp:
+            fp.write(result.output)
+        if len(result.stderr) > 0:
+            with open(path + '.stderr', 'w') as fp:
+                fp.write(result.stderr)
+        if client.verbose or not result.ok:
+            print('job {} ({}): {}'.format(index, result.id, result.status))
+
+    results = client.gather(jobs, max_running=max_running, chunk_size=chunk_size,
+                            callback=write_result)
+    exitcodes = []
+    for index, result in enumerate(results):
+        if hasattr(result, 'ec'):
+            exitcodes.append(result.ec)
+        else:
+            print('job {} failed: {}'.format(index, result))
+            exitcodes.append(None)
+    return exitcodes
+
+
+def print_summary(exitcodes, fp=None):
+    if fp is None:
+        fp = sys.stdout
+    counts = collections.Counter(exitcodes)
+    fp.write('{} jobs\n'.format(len(exitcodes)))
+    for ec, count in sorted(counts.items(), key=lambda item: (item[0] is None, item[0] or 0)):
+        if ec is None:
+            fp.write('\tnot completed: {}\n'.format(count))
+        else:
+            fp.write('\texit code {}: {}\n'.format(ec, count))
@@ -4,86 +4,58 @@ For local development, use the `-s` switch to direct this client at
 the localhost. E.g.,
 
     rcomp -s http://127.0.0.1:8000
+
+The CLI is a thin layer over rcomp.Client.
 """
 import argparse
 import sys
-import time
-import json
 import os.path
 import os
-import base64
-import zlib
+import time
 
 import requests
 
 from . import __version__
+from .client import Client, RcompError, ServerBusy, CODECS
+from .jobcache import JobCache
+from .memo import Memo
 
+def print_result(msg):
+    """print output of job that is done and return its exit code"""
+    job_output = msg['output'].strip()
+    if msg['ec'] != 0:
+        print('job_status: "{}"'.format(msg['status']))
+    if len(job_output) > 0:
+        print(job_output)
+    if len(msg.get('stderr', '')) > 0:
+        sys.stderr.write(msg['stderr'])
+    return msg['ec']
 
-def get(uri, verbose=False):
-    if verbose:
-        print('> GET {}'.format(uri))
-    res = requests.get(uri)
-    if verbose:
-        print_httpresponse(res)
-    return res
-
-def post(uri, payload=None, verbose=False):
-    """Wrapper for requests.post()
-
-    If given, payload should be a `dict` object. Internally it is
-    translated to JSON before calling requests.post().
-    """
-    if verbose:
-        print('> POST {}'.format(uri))
-        if payload is not None:
-            print('> {}'.format(payload))
-    if payload is None:
-        res = requests.post(uri)
-    else:
-        res = requests.post(uri, json=payload)
-    if verbose:
-        print_httpresponse(res)
-    return res
-
-def print_httpresponse(res, prefix='< '):
-    print('{PREFIX}{STATUS_CODE} {REASON}'.format(PREFIX=prefix, STATUS_CODE=res.status_code, REASON=res.reason))
-    for hname, value in res.headers.items():
-        print('{PREFIX}{HNAME}: {VALUE}'.format(PREFIX=prefix, HNAME=hname, VALUE=value))
-    if len(res.text) > 0:
-        print('{PREFIX}{TEXT}'.format(PREFIX=prefix, TEXT=res.text))
-
-
-def find_files(command, argv):
-    """Find files for given command.
-
-    return copy of argv where file names are replaced with
-    zlib-compressed file data.
-    """
-    if command == 'ltl2ba':
-        start = 0
-        while True:
-            try:
-                start = argv.index('-F', start) + 1
-            except ValueError:
-                break
-            with open(argv[start], 'rb') as fp:
-                argv[start] = str(base64.b64encode(zlib.compress(fp.read())),
-                                  encoding='utf-8')
-        return argv
-    elif command == 'gr1c':
-        all_files = False
-        for ii in range(len(argv)):
-            if argv[ii] == '--':
-                all_files = True
-            elif all_files or argv[ii][0] != '-':
-                with open(argv[ii], 'rb') as fp:
-                    argv[ii] = str(base64.b64encode(zlib.compress(fp.read())),
-                                   encoding='utf-8')
-        return argv
-    else:
-        # Do nothing for unrecognized commands and those that do not
-        # require treatment of file data.
-        return argv
+def print_trace(client, job_id):
+    """print timeline of events of job to stderr, as for `--trace`"""
+    try:
+        timeline = client.trace(job_id)
+    except RcompError:
+        sys.stderr.write('No trace of job {} at {}\n'.format(job_id, client.base_uri))
+        return
+    if len(timeline['events']) == 0:
+        sys.stderr.write('No trace of job {}\n'.format(job_id))
+        return
+    sys.stderr.write('trace of job {}:\n'.format(job_id))
+    for event in timeline['events']:
+        details = ' '.join('{}={}'.format(k, v) for k, v in sorted(event.items())
+                           if k not in ('event', 't', 'elapsed'))
+        line = '  +{:.6f}s\t{}'.format(event['elapsed'], event['event'])
+        if len(details) > 0:
+            line += '\t' + details
+        sys.stderr.write(line + '\n')
+    for phase, duration in timeline['phases'].items():
+        sys.stderr.write('  {}: {:.6f}s\n'.format(phase, duration))
+
+def write_output(data):
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    stdout.write(data)
+    stdout.flush()
 
 
 def main(argv=None):
@@ -110,6 +82,20 @@ def main(argv=None):
     parser.add_argument('--continue', metavar='JOBID',
                         dest='job_id', default=False, nargs='?',
                         help='')
+    parser.add_argument('--all', action='store_true',
+                        dest='continue_all', default=False,
+                        help=('with `--continue`, get results of all pending'
+                              ' jobs in the local rcomp cache at once.'))
+    parser.add_argument('--cancel', metavar='JOBID',
+                        dest='cancel_id', default=None,
+                        help=('cancel remote job, killing it if it is running.'
+                              ' Jobs that wait for results are cancelled'
+                              ' when interrupted, e.g., by Ctrl-C.'))
+    parser.add_argument('--trace', action='store_true',
+                        dest='trace', default=False,
+                        help=('print timeline of the job on the server, e.g.,'
+                              ' time spent in staging of files and peak memory'
+                              ' of the process, to stderr once it is done'))
     parser.add_argument('-t', '--timeout', metavar='T',
                         dest='timeout', type=int,
                         help=('maximum duration (seconds) of remote job;'
@@ -121,9 +107,61 @@ def main(argv=None):
                         help=('path to cache file; default is .rcompcache'
                               ' in the directory from which `rcomp` client'
                               ' is called.'))
+    parser.add_argument('--priority', metavar='N', type=int,
+                        dest='priority', default=None,
+                        help=('priority of the job relative to other jobs'
+                              ' of the same client; greater values start'
+                              ' first; default is 0.'))
+    parser.add_argument('--api-key', metavar='KEY',
+                        dest='api_key', default=os.environ.get('RCOMP_API_KEY'),
+                        help=('key that identifies this client to the server;'
+                              ' default is the environment variable'
+                              ' RCOMP_API_KEY, if set.'))
+    parser.add_argument('--upload', choices=['multipart', 'json'],
+                        dest='upload', default='multipart',
+                        help=('how files are sent: as binary parts of a'
+                              ' multipart request (default), or encoded in'
+                              ' JSON, which is supported by all servers.'))
+    parser.add_argument('--codec', choices=CODECS,
+                        dest='codec', default='zlib',
+                        help=('compression of files that are sent as'
+                              ' multipart; default is zlib.'))
+    parser.add_argument('-j', '--jobs', metavar='N', type=int,
+                        dest='max_running', default=8,
+                        help=('with `rcomp batch MANIFEST`, maximum number'
+                              ' of jobs that are running at once;'
+                              ' default is 8.'))
+    parser.add_argument('--chunk-size', metavar='N', type=int,
+                        dest='chunk_size', default=50,
+                        help=('with `rcomp batch MANIFEST`, maximum number'
+                              ' of jobs per request; default is 50.'))
+    parser.add_argument('--output-dir', metavar='DIR',
+                        dest='output_dir', default=None,
+                        help=('with `rcomp batch MANIFEST`, directory in'
+                              ' which outputs of jobs are written; default'
+                              ' is the directory of the manifest.'))
+    parser.add_argument('--memo', action='store_true',
+                        dest='memo', default=False,
+                        help=('return the stored result if an identical job'
+                              ' (same command, arguments, file contents, and'
+                              ' server version) ran before, without contacting'
+                              ' the server; otherwise, store the result.'
+                              ' `rcomp memo` lists stored results, and'
+                              ' `rcomp memo purge` removes them.'))
+    parser.add_argument('--memo-path', metavar='PATH',
+                        dest='memo_path', default=None,
+                        help=('path of the store of results for `--memo`;'
+                              ' default is rcomp/memo.sqlite in the user'
+                              ' cache directory (e.g., ~/.cache).'))
+    parser.add_argument('--memo-max-bytes', metavar='N', type=int,
+                        dest='memo_max_bytes', default=64*2**20,
+                        help=('maximum total size of results stored for'
+                              ' `--memo`, beyond which least recently used'
+                              ' results are removed; default is 64 MiB.'))
     parser.add_argument('--print-cache', action='store_true',
                         dest='print_cache', default=False,
-                        help='print known jobs from the local rcomp cache.')
+                        help=('print known jobs from the local rcomp cache,'
+                              ' without contacting the server.'))
     parser.add_argument('COMMAND', nargs='?')
     parser.add_argument('ARGV', nargs=argparse.REMAINDER)
 
@@ -151,125 +189,256 @@ def main(argv=None):
         rcompcache_path = args.cachepath
     rcompcache_path = os.path.join(os.path.abspath(os.getcwd()), rcompcache_path)
 
+    memo = None
+    if args.memo or args.COMMAND == 'memo':
+        memo = Memo(args.memo_path, max_bytes=args.memo_max_bytes)
+    client = Client(base_uri, codec=args.codec, upload=args.upload, verbose=args.verbose,
+                    api_key=args.api_key, memo=memo)
+    try:
+        return run_command(client, args, rcompcache_path)
+    except requests.RequestException:
+        print('Error occurred while communicating with server!')
+        sys.exit(1)
+    finally:
+        client.close()
+        if memo is not None:
+            memo.close()
+
+
+def run_command(client, args, rcompcache_path):
+    base_uri = client.base_uri
+
     if args.print_cache:
+        jobs = []
         if os.path.exists(rcompcache_path):
-            with open(rcompcache_path) as fp:
-                rcompcache = json.load(fp)
-        else:
-            rcompcache = dict()
-        if len(rcompcache) == 0:
+            with JobCache(rcompcache_path) as rcompcache:
+                jobs = rcompcache.jobs()
+        if len(jobs) == 0:
             print('The local cache is empty.')
         else:
-            for k, v in rcompcache.items():
-                print('job: {}'.format(k))
-                print('\tcommand: {}'.format(v['cmd']))
-                print('\tstart time: {}'.format(v['stime']))
+            for job in jobs:
+                print('job: {}'.format(job['id']))
+                print('\tcommand: {}'.format(job['cmd']))
+                print('\tstart time: {}'.format(job['stime']))
+                if job['done']:
+                    print('\tdone, exit code: {}'.format(job['ec']))
+                else:
+                    print('\tpending')
         return 0
 
-    if (args.COMMAND is None) and (args.job_id is False):
-        res = get(base_uri+'/', verbose=args.verbose)
-        if res.ok:
-            index = json.loads(res.text)
-            assert 'commands' in index
-            print('The following commands are available at {}'
-                  .format(base_uri))
-            for cmd in index['commands'].values():
-                print('{NAME}\t\t{SUMMARY}'
-                      .format(NAME=cmd['name'], SUMMARY=cmd['summary']))
+    if args.COMMAND is None and args.job_id is False and args.cancel_id is None:
+        try:
+            index = client.index()
+        except RcompError:
+            return 0
+        assert 'commands' in index
+        print('The following commands are available at {}'
+              .format(base_uri))
+        for cmd in index['commands'].values():
+            print('{NAME}\t\t{SUMMARY}'
+                  .format(NAME=cmd['name'], SUMMARY=cmd['summary']))
 
     elif args.COMMAND == 'version':
-        res = get(base_uri+'/' + args.COMMAND, verbose=args.verbose)
-        if res.ok:
-            print(res.text)
+        try:
+            print(client.version())
+        except RcompError:
+            pass
 
-    else:
-        if (args.job_id is not False) or args.nonblocking:
-            if os.path.exists(rcompcache_path):
-                with open(rcompcache_path) as fp:
-                    rcompcache = json.load(fp)
-            else:
-                rcompcache = dict()
-        if args.job_id is False:
-            if args.ARGV is None:
-                argv = []
-            else:
-                argv = args.ARGV
-            payload = {'argv': find_files(args.COMMAND, argv)}
-            if args.timeout is not None:
-                payload['timeout'] = args.timeout
-            res = post(base_uri+'/' + args.COMMAND, payload, verbose=args.verbose)
-            if not res.ok:
-                if res.status_code == 404:
-                    print('`{}` is not known by the server at {}'.format(
-                        args.COMMAND,
-                        base_uri
-                    ))
-                else:  # Details not known, so print generic message
-                    print('Error occurred while sending initial request to the server!')
-                sys.exit(1)
-            msg = json.loads(res.text)
-            if not msg['done'] and args.nonblocking:
-                assert msg['id'] not in rcompcache
-                rcompcache[msg['id']] = {
-                    'cmd': msg['cmd'],
-                    'stime': msg['stime'],
-                    'done': False
-                }
-                with open(rcompcache_path, 'w') as fp:
-                    json.dump(rcompcache, fp)
-                print('id: {}'.format(msg['id']))
-                sys.exit(0)
+    elif args.COMMAND == 'memo':
+        return inspect_memo(client.memo, args.ARGV)
 
+    elif args.COMMAND == 'batch':
+        from .batch import run_manifest, print_summary
+        if len(args.ARGV) != 1:
+            print('Usage: rcomp batch MANIFEST')
+            return 1
+        exitcodes = run_manifest(client, args.ARGV[0],
+                                 output_dir=args.output_dir,
+                                 max_running=args.max_running,
+                                 chunk_size=args.chunk_size)
+        print_summary(exitcodes)
+        return (0 if all(ec == 0 for ec in exitcodes) else 1)
+
+    elif args.cancel_id is not None:
+        with JobCache(rcompcache_path) as rcompcache:
+            return cancel_job(client, args.cancel_id, rcompcache)
+
+    elif args.job_id is not False:
+        with JobCache(rcompcache_path) as rcompcache:
+            return continue_jobs(client, args, rcompcache)
+
+    else:
+        if args.ARGV is None:
+            argv = []
         else:
-            if args.job_id is None:
-                earliest_job = None
-                if len(rcompcache) == 0:
-                    print('Error: `--continue` switch used but no jobs are known')
-                    sys.exit(1)
-                for k, v in rcompcache.items():
-                    if (earliest_job is None) or (v['stime'] < rcompcache[earliest_job]['stime']):
-                        earliest_job = k
-                job_id = earliest_job
-            else:
-                job_id = args.job_id
-            res = get(base_uri+'/status/' + job_id, verbose=args.verbose)
-            if not res.ok:
-                if res.status_code == 404:
-                    print('Job {} is not known at {}'.format(job_id, base_uri))
-                else:
-                    print('Error occurred while communicating with server!')
-                sys.exit(1)
-            msg = json.loads(res.text)
-            if msg['done']:
-                rcompcache.pop(job_id)
-                with open(rcompcache_path, 'w') as fp:
-                    json.dump(rcompcache, fp)
-                job_output = msg['output'].strip()
-                if msg['ec'] != 0:
-                    print('job_status: "{}"'.format(msg['status']))
-                if len(job_output) > 0:
-                    print(job_output)
-                return msg['ec']  # use exitcode of remote job as that of this client
-            else:
-                print('id: {}'.format(msg['id']))
+            argv = args.ARGV
+        memo_key = None
+        if client.memo is not None:
+            memo_key = client.memo.key(client, args.COMMAND, argv)
+            msg = client.memo.get(memo_key)
+            if msg is not None:
+                if args.trace:
+                    sys.stderr.write('No trace: result is from the memo at {}\n'.format(
+                        client.memo.path))
+                return print_result(msg)
+        try:
+            msg = client.submit(args.COMMAND, argv, timeout=args.timeout,
+                                priority=args.priority)
+        except ServerBusy as err:
+            print('The server at {} is busy; try again in {} seconds'.format(
+                base_uri,
+                (err.retry_after if err.retry_after is not None else 'a few')
+            ))
+            sys.exit(1)
+        except RcompError as err:
+            if err.status_code == 404:
+                print('`{}` is not known by the server at {}'.format(
+                    args.COMMAND,
+                    base_uri
+                ))
+            elif err.status_code == 415:
+                print('Codec {} is not supported by the server at {}'.format(
+                    args.codec,
+                    base_uri
+                ))
+            else:  # Details not known, so print generic message
+                print('Error occurred while sending initial request to the server!')
+            sys.exit(1)
+        if msg['done']:
+            if memo_key is not None:
+                client.memo.put(memo_key, args.COMMAND, msg)
+            exitcode = print_result(msg)
+            if args.trace:
+                print_trace(client, msg['id'])
+            return exitcode
+        if args.nonblocking:
+            with JobCache(rcompcache_path) as rcompcache:
+                rcompcache.add(msg)
+            print('id: {}'.format(msg['id']))
             sys.exit(0)
 
-        while not msg['done']:
-            time.sleep(0.1)
-            res = get(base_uri+'/status/' + msg['id'], verbose=args.verbose)
-            if not res.ok:
-                print('Error occurred while communicating with server!')
-                sys.exit(1)
-            msg = json.loads(res.text)
+        # Output is printed while the job runs.
+        try:
+            msg = client.wait(msg['id'], on_output=write_output)
+        except KeyboardInterrupt:
+            try:
+                client.cancel(msg['id'])
+            except (RcompError, requests.RequestException):
+                print('\nFailed to cancel job {}'.format(msg['id']))
+            else:
+                print('\nCancelled job {}'.format(msg['id']))
+            return 130
+        if memo_key is not None:
+            client.memo.put(memo_key, args.COMMAND, msg)
         if msg['ec'] != 0:
             print('job_status: "{}"'.format(msg['status']))
-        job_output = msg['output'].strip()
-        if len(job_output) > 0:
-            print(job_output)
+        if len(msg.get('stderr', '')) > 0:
+            sys.stderr.write(msg['stderr'])
+        if args.trace:
+            print_trace(client, msg['id'])
         return msg['ec']  # use exitcode of remote job as that of this client
 
     return 0
 
 
+def inspect_memo(memo, argv):
+    """print results stored for `--memo`, or remove them if argv is ['purge']"""
+    if argv == ['purge']:
+        print('Removed {} stored results'.format(memo.purge()))
+        return 0
+    elif len(argv) > 0:
+        print('Usage: rcomp memo [purge]')
+        return 1
+    stats = memo.stats()
+    print('{} stored results, {} of at most {} bytes, in {}'.format(
+        stats['results'], stats['bytes'], stats['max_bytes'], stats['path']))
+    for entry in memo.entries():
+        print('{}\t{}\t{} bytes\tlast used {}'.format(
+            entry['key'][:16], entry['command'], entry['size'],
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['used']))))
+    return 0
+
+
+def cancel_job(client, job_id, rcompcache):
+    """cancel job, as for `--cancel`"""
+    try:
+        msg = client.cancel(job_id)
+    except RcompError as err:
+        if err.status_code == 404:
+            print('Job {} is not known at {}'.format(job_id, client.base_uri))
+            rcompcache.forget(job_id)
+        elif err.status_code == 409:
+            print('Job {} cannot be cancelled because other jobs wait for'
+                  ' its result'.format(job_id))
+        else:
+            print('Error occurred while communicating with server!')
+        return 1
+    if msg['done']:
+        rcompcache.finish(msg)
+        print('job_status: "{}"'.format(msg['status']))
+    else:
+        print('Job {} is being cancelled'.format(job_id))
+    return 0
+
+
+def continue_jobs(client, args, rcompcache):
+    """get results of jobs in the local cache, as for `--continue`"""
+    base_uri = client.base_uri
+    if args.continue_all:
+        job_ids = rcompcache.pending()
+        if len(job_ids) == 0:
+            print('Error: `--continue` switch used but no jobs are pending')
+            sys.exit(1)
+        try:
+            statuses = client.statuses(job_ids)
+        except RcompError:
+            print('Error occurred while communicating with server!')
+            sys.exit(1)
+        exitcode = 0
+        for job_id in job_ids:
+            msg = statuses.get(job_id)
+            if msg is None:
+                print('Job {} is not known at {}'.format(job_id, base_uri))
+                rcompcache.forget(job_id)
+                exitcode = 1
+            elif msg['done']:
+                rcompcache.finish(msg)
+                print('job: {}'.format(job_id))
+                if print_result(msg) != 0:
+                    exitcode = 1
+            else:
+                print('id: {}'.format(job_id))
+        return exitcode
+
+    if args.job_id is None:
+        job_ids = rcompcache.pending(limit=1)
+        if len(job_ids) == 0:
+            print('Error: `--continue` switch used but no jobs are pending')
+            sys.exit(1)
+        job_id = job_ids[0]
+    else:
+        job_id = args.job_id
+        msg = rcompcache.result(job_id)
+        if msg is not None:
+            return print_result(msg)
+    try:
+        msg = client.status(job_id)
+    except RcompError as err:
+        if err.status_code == 404:
+            print('Job {} is not known at {}'.format(job_id, base_uri))
+            rcompcache.forget(job_id)
+        else:
+            print('Error occurred while communicating with server!')
+        sys.exit(1)
+    if msg['done']:
+        rcompcache.finish(msg)
+        exitcode = print_result(msg)  # use exitcode of remote job as that of this client
+        if args.trace:
+            print_trace(client, job_id)
+        return exitcode
+    print('id: {}'.format(msg['id']))
+    sys.exit(0)
+
+
 if __name__ == '__main__':
     sys.exit(main(sys.argv))
@@ -0,0 +1,909 @@
+"""client library
+
+Client sends requests over one keep-alive session of the package
+`requests`. AsyncClient has the same methods as coroutines and is
+only available if the package `aiohttp` is installed. E.g.,
+
+    with rcomp.Client('http://127.0.0.1:8080') as client:
+        result = client.run('gr1c', ['-r', 'spec.spc'])
+        print(result.output)
+"""
+import asyncio
+import base64
+import collections
+import concurrent.futures
+import gzip
+import hashlib
+import json
+import os.path
+import time
+import zlib
+
+import requests
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+DEFAULT_URI = 'https://api.fmtools.org'
+
+CODECS = ['zlib', 'gzip', 'none']
+if zstandard is not None:
+    CODECS.append('zstd')
+
+# Maximum number of requests to download output of a job, each of
+# which resumes where the previous one was interrupted
+OUTPUT_ATTEMPTS = 5
+
+
+class RcompError(Exception):
+    """raised if the server rejects a request.
+
+    `status_code` is the HTTP status code of the response, if any.
+    """
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ServerBusy(RcompError):
+    """raised if the server cannot queue more jobs.
+
+    `retry_after` is the number of seconds after which the server
+    suggests to try again.
+    """
+    def __init__(self, message, retry_after=None):
+        super().__init__(message, status_code=429)
+        self.retry_after = retry_after
+
+
+class Result(collections.namedtuple('Result', ['id', 'cmd', 'status', 'ec', 'output',
+                                               'stderr', 'cache', 'winner'],
+                                    defaults=[None])):
+    """outcome of a job that is done.
+
+    `winner` is the index of the variant that won, if the job was a race.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_status(cls, msg):
+        return cls(id=msg['id'],
+                   cmd=msg['cmd'],
+                   status=msg['status'],
+                   ec=msg['ec'],
+                   output=msg['output'],
+                   stderr=msg.get('stderr', ''),
+                   cache=msg.get('cache'),
+                   winner=msg.get('winner'))
+
+    @property
+    def ok(self):
+        return self.ec == 0
+
+
+def print_httpresponse(res, prefix='< '):
+    print('{PREFIX}{STATUS_CODE} {REASON}'.format(PREFIX=prefix, STATUS_CODE=res.status_code, REASON=res.reason))
+    for hname, value in res.headers.items():
+        print('{PREFIX}{HNAME}: {VALUE}'.format(PREFIX=prefix, HNAME=hname, VALUE=value))
+    if len(res.text) > 0:
+        print('{PREFIX}{TEXT}'.format(PREFIX=prefix, TEXT=res.text))
+
+
+def file_indices(command, argv):
+    """Find indices of elements of argv that are file names.
+
+    Unrecognized commands and those that do not require treatment of
+    file data have none.
+    """
+    indices = []
+    if command == 'ltl2ba':
+        start = 0
+        while True:
+            try:
+                start = argv.index('-F', start) + 1
+            except ValueError:
+                break
+            if start < len(argv):
+                indices.append(start)
+    elif command == 'gr1c':
+        all_files = False
+        for ii in range(len(argv)):
+            if argv[ii] == '--':
+                all_files = True
+            elif all_files or argv[ii][0] != '-':
+                indices.append(ii)
+    return indices
+
+
+def find_files(command, argv):
+    """Find files for given command.
+
+    return copy of argv where file names are replaced with
+    zlib-compressed file data.
+    """
+    for ii in file_indices(command, argv):
+        argv[ii] = encode_file(argv[ii])
+    return argv
+
+
+def encode_file(path):
+    """return zlib-compressed data of file at `path`, encoded as in argv"""
+    with open(path, 'rb') as fp:
+        return str(base64.b64encode(zlib.compress(fp.read())), encoding='utf-8')
+
+
+def compress(data, codec):
+    if codec == 'zlib':
+        return zlib.compress(data)
+    elif codec == 'gzip':
+        return gzip.compress(data)
+    elif codec == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    else:  # codec == 'none'
+        return data
+
+
+def read_compressed(path, codec):
+    with open(path, 'rb') as fp:
+        return compress(fp.read(), codec)
+
+
+def needs_output(msg):
+    """return whether status `msg` of a job that is done lacks its output,
+    which servers send separately (cf. Client.fetch_output()).
+    """
+    return msg['done'] and 'output' not in msg and 'output_digest' in msg
+
+
+def check_output(msg, output):
+    """put `output` (`bytes`) in status `msg` if it matches the digest"""
+    if len(output) != msg['output_size'] or hashlib.sha256(output).hexdigest() != msg['output_digest']:
+        raise RcompError('output of job {} does not match its digest'.format(msg['id']))
+    msg['output'] = str(output, encoding='utf-8')
+    return msg
+
+
+def raise_for_response(status_code, reason, headers, text):
+    """raise RcompError or ServerBusy if response is not successful"""
+    if status_code < 400:
+        return
+    try:
+        message = json.loads(text)['err']
+    except (ValueError, KeyError, TypeError):
+        message = '{} {}'.format(status_code, reason)
+    if status_code == 429:
+        try:
+            retry_after = int(headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            retry_after = None
+        raise ServerBusy(message, retry_after=retry_after)
+    raise RcompError(message, status_code=status_code)
+
+
+class Client:
+    def __init__(self, base_uri=None, codec='zlib', upload='multipart', verbose=False,
+                 api_key=None, memo=None):
+        """
+        `codec` is the compression of files that are sent as binary
+        parts of multipart requests. If `upload` is 'json', then files
+        are instead encoded in JSON, which is supported by all servers.
+
+        if `api_key` is given, then it is sent with each request, and
+        the server uses it to share capacity fairly among clients.
+
+        if `memo` is a Memo object, then run() returns stored results
+        of identical jobs without contacting the server.
+
+        if `verbose`, then print outgoing and incoming messages.
+        """
+        if base_uri is None:
+            base_uri = DEFAULT_URI
+        self.base_uri = base_uri
+        self.codec = codec
+        self.upload = upload
+        self.verbose = verbose
+        self.memo = memo
+        self.session = requests.Session()
+        if api_key is not None:
+            self.session.headers['X-Rcomp-Key'] = api_key
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def get(self, path, **kwargs):
+        uri = self.base_uri + path
+        if self.verbose:
+            print('> GET {}'.format(uri))
+        res = self.session.get(uri, **kwargs)
+        if self.verbose and not kwargs.get('stream'):
+            print_httpresponse(res)
+        return res
+
+    def post(self, path, payload=None, **kwargs):
+        """Wrapper for Session.post()
+
+        If given, payload should be a `dict` object. Internally it is
+        translated to JSON.
+        """
+        uri = self.base_uri + path
+        if self.verbose:
+            print('> POST {}'.format(uri))
+            if payload is not None:
+                print('> {}'.format(payload))
+        if payload is not None:
+            kwargs['json'] = payload
+        res = self.session.post(uri, **kwargs)
+        if self.verbose:
+            print_httpresponse(res)
+        return res
+
+    def delete(self, path, **kwargs):
+        uri = self.base_uri + path
+        if self.verbose:
+            print('> DELETE {}'.format(uri))
+        res = self.session.delete(uri, **kwargs)
+        if self.verbose:
+            print_httpresponse(res)
+        return res
+
+    def check(self, res):
+        raise_for_response(res.status_code, res.reason, res.headers, res.text)
+        return res
+
+    def index(self):
+        return self.check(self.get('/')).json()
+
+    def version(self):
+        return self.check(self.get('/version')).text
+
+    def post_files(self, command, argv, timeout=None, priority=None, variants=None):
+        """Send job with files as separate binary parts of multipart request.
+
+        Unlike find_files() and post(), file data are not encoded in JSON.
+        """
+        job = {'argv': argv, 'codec': self.codec}
+        if timeout is not None:
+            job['timeout'] = timeout
+        if priority is not None:
+            job['priority'] = priority
+        if variants is not None:
+            job['variants'] = variants
+        parts = [('job', (None, json.dumps(job), 'application/json'))]
+        for ii in file_indices(command, argv):
+            parts.append(('file', (os.path.basename(argv[ii]),
+                                   read_compressed(argv[ii], self.codec),
+                                   'application/octet-stream')))
+        if self.verbose:
+            print('> ({} file parts, codec {})'.format(len(parts)-1, self.codec))
+        return self.post('/' + command, files=parts)
+
+    def submit(self, command, argv=None, timeout=None, priority=None, variants=None):
+        """submit job and return its status as `dict`.
+
+        elements of `argv` that are files are paths of local files.
+        `priority` orders jobs of this client that wait to start,
+        where greater values start first (default 0).
+
+        if `variants` is given, then it is a list of lists of options,
+        e.g., [['-r'], ['-a']], and the server runs `command` once for
+        each, with the options before `argv`, and keeps the result of
+        the first that succeeds. The index of that variant is the field
+        `winner` of the final status.
+
+        raise ServerBusy if the server cannot queue the job, and
+        RcompError if the server rejects it for other reasons.
+        """
+        if argv is None:
+            argv = []
+        res = None
+        if self.upload == 'multipart' and len(file_indices(command, argv)) > 0:
+            res = self.post_files(command, list(argv), timeout=timeout, priority=priority,
+                                  variants=variants)
+            if res.status_code == 500:
+                # Server predates multipart requests, so try JSON.
+                res = None
+        if res is None:
+            payload = {'argv': find_files(command, list(argv))}
+            if timeout is not None:
+                payload['timeout'] = timeout
+            if priority is not None:
+                payload['priority'] = priority
+            if variants is not None:
+                payload['variants'] = variants
+            res = self.post('/' + command, payload)
+        msg = self.check(res).json()
+        return self.fetch_output(msg)
+
+    def status(self, job_id, wait=None, output=True):
+        """return status of job as `dict`.
+
+        if `wait` is given, then servers that support long-polling
+        respond when the job is done or after `wait` seconds.
+
+        if `output`, then the status of a job that is done has its
+        output, which is downloaded separately if the server only sends
+        its size and digest (cf. fetch_output()).
+        """
+        path = '/status/' + job_id
+        if wait is not None:
+            path += '?wait={}'.format(wait)
+        msg = self.check(self.get(path)).json()
+        if output:
+            msg = self.fetch_output(msg)
+        return msg
+
+    def fetch_output(self, msg, received=b''):
+        """add output to status `msg` of job if it lacks it, and return `msg`.
+
+        `received` is the start of the output if the caller already has
+        it, e.g., from follow_output(). Only the rest is downloaded, and
+        interrupted downloads are resumed from the last byte received.
+        raise RcompError if the output cannot be downloaded.
+        """
+        if not needs_output(msg):
+            return msg
+        output = bytearray(received[:msg['output_size']])
+        etag = '"{}"'.format(msg['output_digest'])
+        for attempt in range(OUTPUT_ATTEMPTS):
+            if len(output) == msg['output_size']:
+                break
+            headers = dict()
+            if len(output) > 0:
+                # Otherwise, the whole output is requested, which
+                # servers can compress.
+                headers = {'Range': 'bytes={}-'.format(len(output)), 'If-Range': etag}
+            try:
+                res = self.get('/status/' + msg['id'] + '/output', headers=headers,
+                               stream=True, timeout=(10, 60))
+            except requests.RequestException:
+                continue
+            with res:
+                if res.status_code == 200:
+                    # The whole output, e.g., if it changed
+                    output = bytearray()
+                elif res.status_code != 206:
+                    self.check(res)
+                    continue
+                try:
+                    for chunk in res.iter_content(chunk_size=None):
+                        output += chunk
+                except requests.RequestException:
+                    pass
+        return check_output(msg, bytes(output))
+
+    def cancel(self, job_id):
+        """cancel job and return its status as `dict`.
+
+        the job is done with status `cancelled` unless it was already
+        done. raise RcompError with status code 409 if other jobs are
+        attached to the job (cf. `cache` in statuses).
+        """
+        return self.check(self.delete('/status/' + job_id)).json()
+
+    def trace(self, job_id):
+        """return timeline of job as `dict` with fields `events` and `phases`.
+
+        each event has fields `event`, `t` (seconds since the epoch),
+        `elapsed` (seconds since the first event), and details, e.g.,
+        `pid` of the subprocess. `phases` maps names of phases, e.g.,
+        `running`, to their durations (seconds).
+        """
+        return self.check(self.get('/status/' + job_id + '/trace')).json()
+
+    def statuses(self, job_ids):
+        """return `dict` that maps job IDs to statuses, or None if unknown.
+
+        all statuses are obtained from one request. If the server does not
+        support that, then the status of each job is requested separately.
+        """
+        res = self.post('/status', {'ids': list(job_ids)})
+        if res.status_code not in (404, 405):
+            return {job_id: msg if msg is None else self.fetch_output(msg)
+                    for job_id, msg in self.check(res).json()['jobs'].items()}
+        statuses = dict()
+        for job_id in job_ids:
+            try:
+                statuses[job_id] = self.status(job_id)
+            except RcompError as err:
+                if err.status_code != 404:
+                    raise
+                statuses[job_id] = None
+        return statuses
+
+    def follow_output(self, job_id, on_output, offset=0):
+        """pass output of job to `on_output` as it arrives, until the job is done.
+
+        return offset (in bytes) after the last byte of output that was
+        passed, or None if the server does not stream output.
+        """
+        try:
+            # Jobs can be silent for long durations, so no read timeout
+            res = self.get('/status/' + job_id + '/output?offset={}'.format(offset),
+                           stream=True, timeout=(10, None))
+        except requests.RequestException:
+            return None
+        with res:
+            if not res.ok:
+                return None
+            try:
+                for chunk in res.iter_content(chunk_size=None):
+                    on_output(chunk)
+                    offset += len(chunk)
+            except requests.RequestException:
+                pass
+        return offset
+
+    def wait_events(self, job_id):
+        """Wait for job to finish by following server-sent events.
+
+        return final status message of the job, or None if the server does
+        not provide a stream of events or the stream ends before the job
+        is done. In the latter cases, callers should poll instead.
+        """
+        try:
+            res = self.get('/status/' + job_id + '/events', stream=True, timeout=(10, 60))
+        except requests.RequestException:
+            return None
+        with res:
+            if (not res.ok
+                or not res.headers.get('Content-Type', '').startswith('text/event-stream')):
+                return None
+            try:
+                for line in res.iter_lines(decode_unicode=True):
+                    if self.verbose and len(line) > 0:
+                        print('< {}'.format(line))
+                    if line.startswith('data:'):
+                        msg = json.loads(line[len('data:'):])
+                        if msg['done']:
+                            break
+                else:
+                    return None
+            except requests.RequestException:
+                return None
+        return self.fetch_output(msg)
+
+    def wait(self, job_id, on_output=None):
+        """wait until job is done and return its final status as `dict`.
+
+        if `on_output` is given, then it is called with each piece of
+        output (`bytes`) as it arrives, or with all output at the end
+        if the server does not stream output.
+        """
+        msg = None
+        offset = None
+        received = bytearray()
+        if on_output is not None:
+            def keep(chunk):
+                received.extend(chunk)
+                on_output(chunk)
+            offset = self.follow_output(job_id, keep)
+        if offset is None:
+            msg = self.wait_events(job_id)
+        while msg is None or not msg['done']:
+            if msg is not None:
+                time.sleep(0.1)
+            # Servers that support long-polling hold the request until
+            # the job is done or `wait` elapses.
+            msg = self.status(job_id, wait=30, output=False)
+        # Output that was streamed is not downloaded again.
+        msg = self.fetch_output(msg, received=bytes(received))
+        if on_output is not None:
+            # Output that arrived after the stream ended, if any
+            rest = msg['output'].encode('utf-8')[(offset or 0):]
+            if len(rest) > 0:
+                on_output(rest)
+        return msg
+
+    def run(self, command, argv=None, timeout=None, on_output=None, priority=None,
+            variants=None):
+        """submit job, wait until it is done, and return its Result.
+
+        results of races among `variants` are not memoized.
+        """
+        key = None
+        if self.memo is not None and variants is None:
+            key = self.memo.key(self, command, argv or [])
+            msg = self.memo.get(key)
+            if msg is not None:
+                if on_output is not None and len(msg['output']) > 0:
+                    on_output(msg['output'].encode('utf-8'))
+                return Result.from_status(msg)
+        msg = self.submit(command, argv, timeout=timeout, priority=priority,
+                          variants=variants)
+        if not msg['done']:
+            msg = self.wait(msg['id'], on_output=on_output)
+        elif on_output is not None and len(msg['output']) > 0:
+            on_output(msg['output'].encode('utf-8'))
+        if key is not None:
+            self.memo.put(key, command, msg)
+        return Result.from_status(msg)
+
+    def submit_pipeline(self, steps, timeout=None, priority=None):
+        """submit pipeline and return its status as `dict`.
+
+        `steps` is a list of `dict` with fields `name`, `command`,
+        `argv`, and optionally `timeout`. Elements of argv that are
+        files are paths of local files, or {'step': NAME} for the
+        output of the earlier step NAME, which stays on the server.
+        The field `steps` of the status maps names of steps to IDs of
+        their jobs (cf. pipeline_steps()).
+        """
+        payload = {'steps': [prepare_step(step) for step in steps]}
+        if timeout is not None:
+            payload['timeout'] = timeout
+        if priority is not None:
+            payload['priority'] = priority
+        return self.check(self.post('/pipeline', payload)).json()
+
+    def pipeline_steps(self, job_id):
+        """return `dict` that maps names of steps of pipeline to their statuses"""
+        return self.check(self.get('/status/' + job_id + '/steps')).json()['steps']
+
+    def submit_batch(self, jobs):
+        """submit jobs as from prepare_job() in one request.
+
+        return list of statuses as `dict`, where jobs that were rejected
+        have only field `err`.
+        """
+        res = self.post('/batch', {'jobs': jobs})
+        if res.status_code not in (404, 405):
+            return self.check(res).json()['jobs']
+        # Server does not support batches, so submit each job.
+        resp = []
+        for job in jobs:
+            payload = {'argv': job['argv']}
+            for field in ('timeout', 'priority'):
+                if field in job:
+                    payload[field] = job[field]
+            try:
+                resp.append(self.check(self.post('/' + job['command'], payload)).json())
+            except ServerBusy:
+                resp.append({'err': 'job queue is full'})
+            except RcompError as err:
+                resp.append({'err': str(err)})
+        return resp
+
+    def gather(self, jobs, max_running=8, chunk_size=50, poll_interval=0.5, callback=None):
+        """run many jobs and return list of their results in order.
+
+        each job is a `dict` with fields `command` and `argv`, and
+        optionally `timeout` and `priority`. Files are encoded in
+        parallel threads.
+
+        at most `max_running` jobs are submitted and not yet done at
+        any time. Jobs are submitted in requests of at most
+        `chunk_size` jobs, and statuses of running jobs are requested
+        together every `poll_interval` seconds.
+
+        each element of the returned list is a Result, or an RcompError
+        if the job was rejected or lost. If `callback` is given, then it
+        is called with the index and Result of each job when it is done.
+        """
+        with concurrent.futures.ThreadPoolExecutor() as pool:
+            prepared = list(pool.map(prepare_job, jobs))
+
+        results = [None]*len(jobs)
+        pending = collections.deque(range(len(jobs)))
+        running = dict()
+
+        def finish(index, msg):
+            results[index] = Result.from_status(self.fetch_output(msg))
+            if callback is not None:
+                callback(index, results[index])
+
+        while len(pending) > 0 or len(running) > 0:
+            progressed = False
+            n = min(max_running - len(running), chunk_size, len(pending))
+            if n > 0:
+                chunk = [pending.popleft() for ii in range(n)]
+                for index, msg in zip(chunk, self.submit_batch([prepared[index] for index in chunk])):
+                    if 'err' in msg:
+                        if msg['err'] == 'job queue is full':
+                            pending.append(index)
+                            continue
+                        results[index] = RcompError(msg['err'])
+                    elif msg['done']:
+                        finish(index, msg)
+                    else:
+                        running[msg['id']] = index
+                    progressed = True
+
+            if len(running) > 0:
+                for job_id, msg in self.statuses(list(running)).items():
+                    if msg is None:
+                        results[running.pop(job_id)] = RcompError(
+                            'job {} is not known by the server'.format(job_id),
+                            status_code=404)
+                        progressed = True
+                    elif msg['done']:
+                        finish(running.pop(job_id), msg)
+                        progressed = True
+
+            if not progressed or len(running) > 0:
+                time.sleep(poll_interval)
+        return results
+
+
+def prepare_job(job):
+    """return job as sent in batches, i.e., with encoded files"""
+    prepared = {'command': job['command'],
+                'argv': find_files(job['command'], list(job.get('argv', [])))}
+    for field in ('timeout', 'priority'):
+        if job.get(field) is not None:
+            prepared[field] = job[field]
+    return prepared
+
+
+def prepare_step(step):
+    """return step of pipeline as sent to the server, i.e., with encoded
+    files, except for outputs of earlier steps.
+    """
+    argv = list(step.get('argv', []))
+    outputs = [ii for ii, arg in enumerate(argv) if isinstance(arg, dict)]
+    placeholders = [('step-output' if ii in outputs else arg) for ii, arg in enumerate(argv)]
+    for ii in file_indices(step['command'], placeholders):
+        if ii not in outputs:
+            argv[ii] = encode_file(argv[ii])
+    prepared = {'name': step['name'], 'command': step['command'], 'argv': argv}
+    if step.get('timeout') is not None:
+        prepared['timeout'] = step['timeout']
+    return prepared
+
+
+class AsyncClient:
+    def __init__(self, base_uri=None, codec='zlib', upload='multipart', limit=16, verbose=False,
+                 api_key=None):
+        """
+        arguments are as for Client. `limit` is the maximum number of
+        connections that are open at once.
+
+        the connection pool is created when the first request is sent,
+        so objects can be created outside of a running event loop.
+        """
+        if aiohttp is None:
+            raise ImportError('AsyncClient requires the package aiohttp')
+        if base_uri is None:
+            base_uri = DEFAULT_URI
+        self.base_uri = base_uri
+        self.codec = codec
+        self.upload = upload
+        self.limit = limit
+        self.verbose = verbose
+        self.api_key = api_key
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            headers = dict()
+            if self.api_key is not None:
+                headers['X-Rcomp-Key'] = self.api_key
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit),
+                headers=headers)
+        return self._session
+
+    async def request(self, method, path, **kwargs):
+        """return triple of status code, headers, and body text"""
+        uri = self.base_uri + path
+        if self.verbose:
+            print('> {} {}'.format(method, uri))
+            if 'json' in kwargs:
+                print('> {}'.format(kwargs['json']))
+        async with self.session.request(method, uri, **kwargs) as res:
+            text = await res.text()
+            if self.verbose:
+                print('< {} {}'.format(res.status, res.reason))
+                if len(text) > 0:
+                    print('< {}'.format(text))
+            raise_for_response(res.status, res.reason, res.headers, text)
+            return res.status, res.headers, text
+
+    async def index(self):
+        return json.loads((await self.request('GET', '/'))[2])
+
+    async def version(self):
+        return (await self.request('GET', '/version'))[2]
+
+    async def submit(self, command, argv=None, timeout=None, priority=None, variants=None):
+        """as Client.submit(). Files are read and compressed in threads."""
+        if argv is None:
+            argv = []
+        loop = asyncio.get_running_loop()
+        indices = file_indices(command, argv)
+        if self.upload == 'multipart' and len(indices) > 0:
+            job = {'argv': list(argv), 'codec': self.codec}
+            if timeout is not None:
+                job['timeout'] = timeout
+            if priority is not None:
+                job['priority'] = priority
+            if variants is not None:
+                job['variants'] = variants
+            data = aiohttp.FormData()
+            data.add_field('job', json.dumps(job), content_type='application/json')
+            contents = await asyncio.gather(*[
+                loop.run_in_executor(None, read_compressed, argv[ii], self.codec)
+                for ii in indices
+            ])
+            for ii, content in zip(indices, contents):
+                data.add_field('file', content,
+                               filename=os.path.basename(argv[ii]),
+                               content_type='application/octet-stream')
+            try:
+                msg = json.loads((await self.request('POST', '/' + command, data=data))[2])
+            except RcompError as err:
+                if err.status_code != 500:
+                    raise
+                # Server predates multipart requests, so try JSON.
+            else:
+                return await self.fetch_output(msg)
+        payload = {'argv': await loop.run_in_executor(None, find_files, command, list(argv))}
+        if timeout is not None:
+            payload['timeout'] = timeout
+        if priority is not None:
+            payload['priority'] = priority
+        if variants is not None:
+            payload['variants'] = variants
+        msg = json.loads((await self.request('POST', '/' + command, json=payload))[2])
+        return await self.fetch_output(msg)
+
+    async def status(self, job_id, wait=None, output=True):
+        path = '/status/' + job_id
+        if wait is not None:
+            path += '?wait={}'.format(wait)
+        msg = json.loads((await self.request('GET', path))[2])
+        if output:
+            msg = await self.fetch_output(msg)
+        return msg
+
+    async def fetch_output(self, msg, received=b''):
+        """as Client.fetch_output()"""
+        if not needs_output(msg):
+            return msg
+        uri = self.base_uri + '/status/' + msg['id'] + '/output'
+        output = bytearray(received[:msg['output_size']])
+        etag = '"{}"'.format(msg['output_digest'])
+        for attempt in range(OUTPUT_ATTEMPTS):
+            if len(output) == msg['output_size']:
+                break
+            if self.verbose:
+                print('> GET {} (from byte {})'.format(uri, len(output)))
+            headers = dict()
+            if len(output) > 0:
+                # Otherwise, the whole output is requested, which
+                # servers can compress.
+                headers = {'Range': 'bytes={}-'.format(len(output)), 'If-Range': etag}
+            try:
+                async with self.session.get(uri, headers=headers) as res:
+                    if res.status == 200:
+                        # The whole output, e.g., if it changed
+                        output = bytearray()
+                    elif res.status != 206:
+                        raise_for_response(res.status, res.reason, res.headers,
+                                           await res.text())
+                        continue
+                    async for chunk in res.content.iter_any():
+                        output += chunk
+            except aiohttp.ClientError:
+                continue
+        return check_output(msg, bytes(output))
+
+    async def cancel(self, job_id):
+        return json.loads((await self.request('DELETE', '/status/' + job_id))[2])
+
+    async def trace(self, job_id):
+        return json.loads((await self.request('GET', '/status/' + job_id + '/trace'))[2])
+
+    async def statuses(self, job_ids):
+        try:
+            jobs = json.loads((await self.request('POST', '/status',
+                                                  json={'ids': list(job_ids)}))[2])['jobs']
+        except RcompError as err:
+            if err.status_code not in (404, 405):
+                raise
+        else:
+            return {job_id: msg if msg is None else await self.fetch_output(msg)
+                    for job_id, msg in jobs.items()}
+        statuses = dict()
+        for job_id in job_ids:
+            try:
+                statuses[job_id] = await self.status(job_id)
+            except RcompError as err:
+                if err.status_code != 404:
+                    raise
+                statuses[job_id] = None
+        return statuses
+
+    async def follow_output(self, job_id, on_output, offset=0):
+        """as Client.follow_output()"""
+        uri = self.base_uri + '/status/' + job_id + '/output?offset={}'.format(offset)
+        if self.verbose:
+            print('> GET {}'.format(uri))
+        try:
+            async with self.session.get(uri, timeout=aiohttp.ClientTimeout(total=None)) as res:
+                if res.status >= 400:
+                    return None
+                async for chunk in res.content.iter_any():
+                    on_output(chunk)
+                    offset += len(chunk)
+        except aiohttp.ClientError:
+            if offset == 0:
+                return None
+        return offset
+
+    async def wait(self, job_id, on_output=None):
+        """as Client.wait(), but by long-polling instead of events"""
+        offset = None
+        received = bytearray()
+        if on_output is not None:
+            def keep(chunk):
+                received.extend(chunk)
+                on_output(chunk)
+            offset = await self.follow_output(job_id, keep)
+        msg = await self.status(job_id, wait=30, output=False)
+        while not msg['done']:
+            await asyncio.sleep(0.1)
+            msg = await self.status(job_id, wait=30, output=False)
+        msg = await self.fetch_output(msg, received=bytes(received))
+        if on_output is not None:
+            rest = msg['output'].encode('utf-8')[(offset or 0):]
+            if len(rest) > 0:
+                on_output(rest)
+        return msg
+
+    async def run(self, command, argv=None, timeout=None, on_output=None, priority=None,
+                  variants=None):
+        """as Client.run(). If the server is busy, submission is retried."""
+        while True:
+            try:
+                msg = await self.submit(command, argv, timeout=timeout, priority=priority,
+                                        variants=variants)
+                break
+            except ServerBusy as err:
+                await asyncio.sleep(err.retry_after or 1)
+        if not msg['done']:
+            msg = await self.wait(msg['id'], on_output=on_output)
+        elif on_output is not None and len(msg['output']) > 0:
+            on_output(msg['output'].encode('utf-8'))
+        return Result.from_status(msg)
+
+    async def gather(self, jobs, max_running=8, callback=None):
+        """as Client.gather(), but each job is run with run()"""
+        semaphore = asyncio.Semaphore(max_running)
+
+        async def run_one(index, job):
+            async with semaphore:
+                try:
+                    result = await self.run(job['command'], job.get('argv'),
+                                            timeout=job.get('timeout'),
+                                            priority=job.get('priority'))
+                except RcompError as err:
+                    return err
+            if callback is not None:
+                callback(index, result)
+            return result
+
+        return await asyncio.gather(*[run_one(index, job) for index, job in enumerate(jobs)])
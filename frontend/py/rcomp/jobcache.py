@@ -0,0 +1,133 @@
+"""local cache of jobs that were submitted by the CLI
+
+The cache is an SQLite database (by default, the file .rcompcache in
+the working directory) in WAL mode, so several `rcomp` processes can
+use it at once. Jobs are pending until they are done, at which time
+their final status, including output, is kept, so it can be printed
+again without contacting the server.
+
+Caches from older versions of this client, which are JSON files, are
+migrated when they are opened.
+"""
+import json
+import os
+import sqlite3
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    cmd TEXT,
+    stime TEXT,
+    done INTEGER NOT NULL DEFAULT 0,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_done_stime ON jobs (done, stime);
+"""
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+def is_legacy(path):
+    """return whether `path` is a cache in the old JSON format"""
+    try:
+        with open(path, 'rb') as fp:
+            header = fp.read(len(SQLITE_HEADER))
+    except FileNotFoundError:
+        return False
+    return len(header) > 0 and header != SQLITE_HEADER
+
+
+class JobCache:
+    def __init__(self, path, timeout=30):
+        """open cache at `path`, creating it if it does not exist.
+
+        `timeout` is the duration (seconds) for which to wait if
+        another process is writing to the cache.
+        """
+        self.path = path
+        legacy = None
+        if is_legacy(path):
+            # Only one process succeeds to move the old cache aside,
+            # and it imports the jobs.
+            legacy = path + '.json'
+            try:
+                os.rename(path, legacy)
+            except FileNotFoundError:
+                legacy = None
+        self._db = sqlite3.connect(path, timeout=timeout)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+        if legacy is not None:
+            self._migrate(legacy)
+
+    def _migrate(self, legacy):
+        with open(legacy) as fp:
+            jobs = json.load(fp)
+        with self._db:
+            self._db.executemany(
+                'INSERT OR IGNORE INTO jobs (id, cmd, stime) VALUES (?, ?, ?)',
+                [(job_id, job.get('cmd'), job.get('stime')) for job_id, job in jobs.items()]
+            )
+        os.unlink(legacy)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+
+    def add(self, msg):
+        """add pending job with status `msg` as received from the server"""
+        with self._db:
+            self._db.execute('INSERT INTO jobs (id, cmd, stime) VALUES (?, ?, ?)',
+                             (msg['id'], msg['cmd'], msg['stime']))
+
+    def finish(self, msg):
+        """keep final status `msg` of job that is done"""
+        with self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO jobs (id, cmd, stime, done, result) VALUES (?, ?, ?, 1, ?)',
+                (msg['id'], msg.get('cmd'), msg.get('stime'), json.dumps(msg))
+            )
+
+    def forget(self, job_id):
+        with self._db:
+            self._db.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def result(self, job_id):
+        """return final status of job, or None if it is not done or not known"""
+        row = self._db.execute('SELECT result FROM jobs WHERE id = ? AND done = 1',
+                               (job_id,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row['result'])
+
+    def pending(self, limit=None):
+        """return IDs of pending jobs in order of start time"""
+        query = 'SELECT id FROM jobs WHERE done = 0 ORDER BY stime'
+        if limit is not None:
+            return [row['id'] for row in self._db.execute(query + ' LIMIT ?', (limit,))]
+        return [row['id'] for row in self._db.execute(query)]
+
+    def jobs(self):
+        """return list of all jobs in order of start time.
+
+        each job is a `dict` with fields `id`, `cmd`, `stime`, `done`,
+        and, if it is done, `ec`.
+        """
+        jobs = []
+        for row in self._db.execute('SELECT id, cmd, stime, done, result FROM jobs ORDER BY stime'):
+            job = {'id': row['id'], 'cmd': row['cmd'], 'stime': row['stime'],
+                   'done': bool(row['done'])}
+            if job['done']:
+                job['ec'] = json.loads(row['result']).get('ec')
+            jobs.append(job)
+        return jobs
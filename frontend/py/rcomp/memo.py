@@ -0,0 +1,162 @@
+"""memoization of results of jobs on the client
+
+Results of jobs are stored in a local SQLite database, keyed by the
+command, argv, contents of files in argv, and versions of the server
+and of the tool that implements the command. Running the same job
+again returns the stored result without contacting the server, e.g.,
+
+    client = rcomp.Client(memo=rcomp.Memo())
+    result = client.run('ltl2ba', ['-F', 'spec.ltl'])
+
+Versions are obtained from the server at most once per `version_ttl`
+seconds, so the first job after that involves a request. The total
+size of stored results is bounded, and least recently used results are
+evicted first. Only results of jobs that ran to completion are stored,
+i.e., not those that were killed after their timeout.
+"""
+import hashlib
+import json
+import os
+import os.path
+import sqlite3
+import time
+
+from .client import file_indices
+
+
+def default_path():
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'rcomp', 'memo.sqlite')
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    command TEXT,
+    result TEXT,
+    size INTEGER,
+    created REAL,
+    used REAL
+);
+CREATE INDEX IF NOT EXISTS results_used ON results (used);
+CREATE TABLE IF NOT EXISTS servers (
+    base_uri TEXT PRIMARY KEY,
+    version TEXT,
+    tools TEXT,
+    checked REAL
+);
+"""
+
+MEMOIZABLE = ('success', 'error (nonzero exitcode)')
+
+
+def job_key(command, argv, versions):
+    """return key of job, where files in argv are identified by contents"""
+    indices = file_indices(command, argv)
+    parts = []
+    for ii, arg in enumerate(argv):
+        if ii in indices:
+            h = hashlib.sha256()
+            with open(arg, 'rb') as fp:
+                for chunk in iter(lambda: fp.read(65536), b''):
+                    h.update(chunk)
+            parts.append(['file', h.hexdigest()])
+        else:
+            parts.append(['arg', arg])
+    return hashlib.sha256(json.dumps([command, parts, versions]).encode('utf-8')).hexdigest()
+
+
+class Memo:
+    def __init__(self, path=None, max_bytes=64*2**20, version_ttl=3600, timeout=30):
+        """store of results at `path` (default from default_path()).
+
+        `max_bytes` bounds the total size of stored results.
+        """
+        if path is None:
+            path = default_path()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.version_ttl = version_ttl
+        self._db = sqlite3.connect(path, timeout=timeout)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def versions(self, client, command):
+        """return versions of server and tool of `command` at `client`"""
+        row = self._db.execute('SELECT version, tools, checked FROM servers WHERE base_uri = ?',
+                               (client.base_uri,)).fetchone()
+        if row is None or time.time() - row['checked'] > self.version_ttl:
+            version = client.version()
+            # Servers that do not report versions of tools have none.
+            tools = client.index().get('tools', {})
+            with self._db:
+                self._db.execute('INSERT OR REPLACE INTO servers VALUES (?, ?, ?, ?)',
+                                 (client.base_uri, version, json.dumps(tools), time.time()))
+        else:
+            version = row['version']
+            tools = json.loads(row['tools'])
+        return [version, tools.get(command)]
+
+    def key(self, client, command, argv):
+        return job_key(command, list(argv), self.versions(client, command))
+
+    def get(self, key):
+        """return stored final status of job as `dict`, or None"""
+        row = self._db.execute('SELECT result FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        with self._db:
+            self._db.execute('UPDATE results SET used = ? WHERE key = ?', (time.time(), key))
+        return dict(json.loads(row['result']), cache='memo')
+
+    def put(self, key, command, msg):
+        """store final status `msg` of job, if it ran to completion.
+
+        return whether it was stored.
+        """
+        if msg.get('status') not in MEMOIZABLE:
+            return False
+        result = json.dumps(msg)
+        if len(result) > self.max_bytes:
+            return False
+        now = time.time()
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                             (key, command, result, len(result), now, now))
+            total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+            while total > self.max_bytes:
+                row = self._db.execute('SELECT key, size FROM results ORDER BY used LIMIT 1').fetchone()
+                self._db.execute('DELETE FROM results WHERE key = ?', (row['key'],))
+                total -= row['size']
+        return True
+
+    def stats(self):
+        row = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        return {'path': self.path, 'results': row[0], 'bytes': row[1],
+                'max_bytes': self.max_bytes}
+
+    def entries(self):
+        """return list of stored results, most recently used first"""
+        return [dict(row) for row in self._db.execute(
+            'SELECT key, command, size, created, used FROM results ORDER BY used DESC')]
+
+    def purge(self):
+        """remove all stored results and versions, and return number of results removed"""
+        with self._db:
+            n = self._db.execute('DELETE FROM results').rowcount
+            self._db.execute('DELETE FROM servers')
+        self._db.execute('VACUUM')
+        return n
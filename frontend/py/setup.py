@@ -29,6 +29,7 @@ setup(name='rcomp',
       long_description=long_description,
       packages=['rcomp'],
       install_requires=['requests'],
+      extras_require={'async': ['aiohttp']},
       entry_points={'console_scripts': ['rcomp = rcomp.cli:main']},
       classifiers=['Programming Language :: Python :: 2',
                    'Programming Language :: Python :: 2.7',
@@ -0,0 +1,59 @@
+"""Fixtures of tests of rcomp
+
+The client is tested against rcompserv as run by the harness of
+server/bench/bench.py, i.e., with fake `gr1c` and `ltl2ba` executables
+and jobs in the Redis stand-in of `fakeredis`. The server runs in a
+thread with its own event loop, because Client blocks.
+"""
+import asyncio
+import os.path
+import sys
+import threading
+
+import pytest
+from aiohttp import web
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'server')
+sys.path.insert(0, os.path.join(SERVER_DIR, 'bench'))
+import bench
+
+
+@pytest.fixture(scope='session', autouse=True)
+def fake_tools():
+    return bench.install_fake_tools(runtime=0, output_bytes=64)
+
+
+@pytest.fixture
+def serve():
+    """return function that starts a bench.InMemoryServer, to which
+    keyword arguments are passed, and returns a pair of it and its base
+    URI. Servers are stopped after the test, once their jobs are done.
+    """
+    started = []
+
+    def start(**kwargs):
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+
+        async def setup():
+            server = bench.InMemoryServer(**kwargs)
+            runner = web.AppRunner(server.app)
+            await runner.setup()
+            await web.TCPSite(runner, '127.0.0.1', 0).start()
+            return server, runner
+        server, runner = asyncio.run_coroutine_threadsafe(setup(), loop).result()
+        started.append((loop, thread, server, runner))
+        return server, 'http://127.0.0.1:{}'.format(runner.addresses[0][1])
+
+    yield start
+    for loop, thread, server, runner in started:
+        async def cleanup():
+            await asyncio.wait_for(server.scheduler.join(), 30)
+            await runner.cleanup()
+        try:
+            asyncio.run_coroutine_threadsafe(cleanup(), loop).result()
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
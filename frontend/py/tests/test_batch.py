@@ -0,0 +1,31 @@
+import io
+import json
+
+import rcomp
+from rcomp.batch import print_summary, run_manifest
+
+
+def test_run_manifest(serve, tmp_path):
+    server, uri = serve(max_jobs=2, max_queue=2)
+    (tmp_path / 'a.spc').write_text('a')
+    (tmp_path / 'b.spc').write_text('b')
+    manifest = tmp_path / 'jobs.json'
+    manifest.write_text(json.dumps({'jobs': [
+        {'command': 'gr1c', 'argv': ['-r', 'a.spc'], 'output': 'a.out'},
+        {'command': 'gr1c', 'argv': ['-r', 'b.spc']},
+        {'command': 'ltl2ba', 'argv': ['-f', '<>p']},
+        {'command': 'nope', 'argv': []},
+    ]}))
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    with rcomp.Client(uri) as client:
+        exitcodes = run_manifest(client, str(manifest), output_dir=str(output_dir),
+                                 chunk_size=2)
+    assert exitcodes == [0, 0, 0, None]
+    assert (output_dir / 'a.out').read_text() == 'x'*64 + '\n'
+    assert (output_dir / '1.out').read_text() == 'x'*64 + '\n'
+    assert (output_dir / '2.out').read_text().startswith('never {')
+
+    fp = io.StringIO()
+    print_summary(exitcodes, fp=fp)
+    assert fp.getvalue() == '4 jobs\n\texit code 0: 3\n\tnot completed: 1\n'
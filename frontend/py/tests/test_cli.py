@@ -0,0 +1,20 @@
+import pytest
+
+from rcomp import cli
+
+
+def test_run(serve, tmp_path, capsys):
+    server, uri = serve()
+    spec = tmp_path / 'spec.spc'
+    spec.write_text('spec')
+    assert cli.main(['-s', uri, 'gr1c', '-r', str(spec)]) == 0
+    assert capsys.readouterr().out == 'x'*64 + '\n'
+
+    assert cli.main(['-s', uri]) == 0
+    out = capsys.readouterr().out
+    assert 'gr1c' in out and 'ltl2ba' in out
+
+    with pytest.raises(SystemExit) as exit:
+        cli.main(['-s', uri, 'nope'])
+    assert exit.value.code == 1
+    assert capsys.readouterr().out.startswith('`nope` is not known by the server')
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+import rcomp
+from rcomp.client import CODECS
+
+
+OUTPUT = 'x'*64 + '\n'
+
+
+@pytest.fixture
+def spec(tmp_path):
+    path = tmp_path / 'spec.spc'
+    path.write_text('spec')
+    return str(path)
+
+
+@pytest.mark.parametrize('upload, codec', [('json', 'zlib')]
+                         + [('multipart', codec) for codec in CODECS])
+def test_run(serve, spec, upload, codec):
+    server, uri = serve()
+    with rcomp.Client(uri, upload=upload, codec=codec) as client:
+        received = []
+        result = client.run('gr1c', ['-r', spec], on_output=received.append)
+        assert result.ok and result.status == 'success'
+        assert result.output == OUTPUT
+        assert b''.join(received) == OUTPUT.encode('utf-8')
+        assert result.cmd.startswith('gr1c -r ')
+        # Identical jobs are served from the cache of the server.
+        assert client.run('gr1c', ['-r', spec]).cache == 'hit'
+
+
+def test_submit_status(serve, spec, monkeypatch):
+    monkeypatch.setenv('RCOMP_BENCH_RUNTIME', '0.5')
+    server, uri = serve(max_jobs=1, max_queue=1)
+    with rcomp.Client(uri, api_key='key') as client:
+        msg = client.submit('ltl2ba', ['-f', '[]<>p'], priority=1)
+        assert not msg['done']
+        queued = client.submit('gr1c', ['-r', spec])
+        with pytest.raises(rcomp.ServerBusy) as err:
+            client.submit('ltl2ba', ['-f', '<>q'])
+        assert err.value.status_code == 429
+        assert err.value.retry_after == 5
+
+        msg = client.wait(msg['id'])
+        assert msg['done'] and msg['output'].startswith('never {')
+        statuses = client.statuses([msg['id'], queued['id'], 'nope'])
+        assert statuses['nope'] is None
+        assert statuses[msg['id']]['client'] == statuses[queued['id']]['client']
+        assert client.status(queued['id'], wait=10)['output'] == OUTPUT
+        assert client.trace(msg['id'])['phases']['running'] >= 0
+
+        with pytest.raises(rcomp.RcompError) as err:
+            client.status('nope')
+        assert err.value.status_code == 404
+        with pytest.raises(rcomp.RcompError) as err:
+            client.submit('ltl2ba', ['-f', '<>q'], variants=[['-d']])
+        assert str(err.value).startswith('variants must be a list')
+        assert err.value.status_code == 400
+
+
+def test_cancel(serve, spec, monkeypatch):
+    server, uri = serve()
+    monkeypatch.setenv('RCOMP_BENCH_RUNTIME', '10')
+    with rcomp.Client(uri) as client:
+        msg = client.submit('gr1c', ['-r', spec])
+        msg = client.cancel(msg['id'])
+        assert msg['done'] and msg['status'] == 'cancelled'
+
+
+def test_fetch_output(serve, monkeypatch):
+    monkeypatch.setenv('RCOMP_BENCH_OUTPUT_BYTES', '200000')
+    server, uri = serve()
+    with rcomp.Client(uri) as client:
+        msg = client.submit('ltl2ba', ['-f', '[]<>p'])
+        msg = client.status(msg['id'], wait=10, output=False)
+        # Large outputs are sent separately from statuses.
+        assert 'output' not in msg
+        output = client.fetch_output(dict(msg))['output']
+        assert len(output) == msg['output_size']
+        # Downloads resume after output that was received.
+        resumed = client.fetch_output(dict(msg), received=output[:1000].encode('utf-8'))
+        assert resumed['output'] == output
+        with pytest.raises(rcomp.RcompError):
+            client.fetch_output(dict(msg, output_digest='0'*64))
+
+
+def test_gather(serve, spec):
+    server, uri = serve(max_jobs=2, max_queue=2)
+    jobs = [{'command': 'ltl2ba', 'argv': ['-f', '<>p{}'.format(ii)]} for ii in range(6)]
+    jobs.append({'command': 'gr1c', 'argv': ['-r', spec]})
+    jobs.append({'command': 'nope', 'argv': []})
+    done = []
+    with rcomp.Client(uri) as client:
+        results = client.gather(jobs, max_running=4, chunk_size=3, poll_interval=0.05,
+                                callback=lambda index, result: done.append(index))
+    assert all(result.ok for result in results[:7])
+    assert results[6].output == OUTPUT
+    assert isinstance(results[7], rcomp.RcompError)
+    assert sorted(done) == list(range(7))
+
+
+def test_async_client(serve, spec):
+    server, uri = serve(max_jobs=2, max_queue=2, retry_after=1)
+
+    async def main():
+        async with rcomp.AsyncClient(uri) as client:
+            assert len(await client.version()) > 0
+            result = await client.run('gr1c', ['-r', spec])
+            assert result.ok and result.output == OUTPUT
+            jobs = [{'command': 'ltl2ba', 'argv': ['-f', '<>q{}'.format(ii)]}
+                    for ii in range(6)]
+            # Jobs that the server cannot queue are submitted again.
+            results = await client.gather(jobs, max_running=6)
+            assert all(result.ok for result in results)
+            statuses = await client.statuses([result.id for result in results] + ['nope'])
+            assert statuses['nope'] is None
+            with pytest.raises(rcomp.RcompError):
+                await client.status('nope')
+    asyncio.run(main())
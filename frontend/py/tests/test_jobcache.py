@@ -0,0 +1,80 @@
+import json
+import sqlite3
+import time
+
+import pytest
+
+from rcomp import cli
+from rcomp.jobcache import JobCache, is_legacy
+
+
+def status(job_id, stime, **fields):
+    return dict({'id': job_id, 'cmd': 'gr1c -r spec', 'stime': stime, 'done': False},
+                **fields)
+
+
+def test_job_cache(tmp_path):
+    path = str(tmp_path / '.rcompcache')
+    with JobCache(path) as cache:
+        cache.add(status('b', '2024-01-02'))
+        cache.add(status('a', '2024-01-01'))
+        cache.add(status('c', '2024-01-03'))
+        assert len(cache) == 3
+        assert cache.pending() == ['a', 'b', 'c']
+        assert cache.pending(limit=1) == ['a']
+        assert cache.result('a') is None
+
+        done = status('a', '2024-01-01', done=True, ec=0, output='x')
+        cache.finish(done)
+        cache.forget('c')
+        assert cache.pending() == ['b']
+        assert cache.result('a') == done
+        assert [(job['id'], job['done'], job.get('ec')) for job in cache.jobs()] == [
+            ('a', True, 0), ('b', False, None)]
+    assert not is_legacy(path)
+
+    # Other processes share the cache.
+    with JobCache(path) as other:
+        assert other.result('a') == done
+        assert sqlite3.connect(path).execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+
+def test_legacy(tmp_path):
+    path = str(tmp_path / '.rcompcache')
+    with open(path, 'w') as fp:
+        json.dump({'a': {'cmd': 'gr1c -r spec', 'stime': '2024-01-01'}}, fp)
+    assert is_legacy(path)
+    with JobCache(path) as cache:
+        assert cache.pending() == ['a']
+    assert not is_legacy(path)
+    assert not (tmp_path / '.rcompcache.json').exists()
+
+
+def test_no_block(serve, tmp_path, monkeypatch, capsys):
+    server, uri = serve()
+    monkeypatch.setenv('RCOMP_BENCH_RUNTIME', '0.5')
+    cache_path = str(tmp_path / '.rcompcache')
+    job_ids = []
+    for formula in ('<>p', '<>q'):
+        with pytest.raises(SystemExit) as exit:
+            cli.main(['-s', uri, '--cache-path', cache_path, '--no-block',
+                      'ltl2ba', '-f', formula])
+        assert exit.value.code == 0
+        job_ids.append(capsys.readouterr().out.split()[-1])
+    with JobCache(cache_path) as cache:
+        assert cache.pending() == job_ids
+
+    deadline = time.monotonic() + 10
+    while server.scheduler.running() > 0:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert cli.main(['-s', uri, '--cache-path', cache_path, '--continue', '--all']) == 0
+    out = capsys.readouterr().out
+    assert all('job: ' + job_id in out for job_id in job_ids)
+    with JobCache(cache_path) as cache:
+        assert cache.pending() == []
+        assert cache.result(job_ids[0])['output'].startswith('never {')
+    # Results that are kept are printed without contacting the server.
+    assert cli.main(['-s', 'http://127.0.0.1:1', '--cache-path', cache_path,
+                     '--continue', job_ids[1]]) == 0
+    assert capsys.readouterr().out.startswith('never {')
@@ -0,0 +1,69 @@
+import json
+import os
+import time
+
+import rcomp
+from rcomp.memo import job_key
+
+
+def test_job_key(tmp_path):
+    a = tmp_path / 'a.spc'
+    a.write_text('spec')
+    b = tmp_path / 'b.spc'
+    b.write_text('spec')
+    # Files are identified by contents, not by paths.
+    assert job_key('gr1c', ['-r', str(a)], ['1', None]) == job_key('gr1c', ['-r', str(b)], ['1', None])
+    assert job_key('gr1c', ['-r', str(a)], ['1', None]) != job_key('gr1c', ['-r', str(a)], ['2', None])
+    b.write_text('other spec')
+    assert job_key('gr1c', ['-r', str(a)], ['1', None]) != job_key('gr1c', ['-r', str(b)], ['1', None])
+
+
+def test_memo(serve, tmp_path):
+    server, uri = serve()
+    memo = rcomp.Memo(str(tmp_path / 'memo.sqlite'))
+    with rcomp.Client(uri, memo=memo) as client:
+        result = client.run('ltl2ba', ['-f', '[]<>p'])
+        assert result.ok and result.cache == 'miss'
+
+        received = []
+        again = client.run('ltl2ba', ['-f', '[]<>p'], on_output=received.append)
+        assert again.cache == 'memo'
+        assert again.id == result.id and again.output == result.output
+        assert b''.join(received) == result.output.encode('utf-8')
+        assert memo.stats()['results'] == 1
+
+        # Races are not memoized.
+        client.run('ltl2ba', ['-f', '<>q'], variants=[['-d'], ['-l']])
+        assert memo.stats()['results'] == 1
+    assert memo.purge() == 1
+    assert memo.entries() == []
+    memo.close()
+
+
+def test_memo_versions(serve, tmp_path):
+    server, uri = serve()
+    with rcomp.Memo(str(tmp_path / 'memo.sqlite'), version_ttl=0) as memo:
+        with rcomp.Client(uri, memo=memo) as client:
+            key = memo.key(client, 'gr1c', ['-V'])
+            assert memo.versions(client, 'gr1c')[1] == server.tool_versions['gr1c']
+            # Results are not reused once the tool is upgraded.
+            server.tool_versions['gr1c'] = 'gr1c 0.0.1'
+            assert memo.key(client, 'gr1c', ['-V']) != key
+
+
+def test_memo_bound(tmp_path):
+    msg = {'id': 'a', 'status': 'success', 'ec': 0, 'output': 'x'*100}
+    # Two results fit.
+    max_bytes = len(json.dumps(msg))*5//2
+    with rcomp.Memo(str(tmp_path / 'memo.sqlite'), max_bytes=max_bytes) as memo:
+        assert memo.put('a', 'gr1c', msg)
+        assert memo.put('b', 'gr1c', dict(msg, id='b'))
+        time.sleep(0.01)
+        memo.get('a')
+        # The least recently used result is evicted.
+        assert memo.put('c', 'gr1c', dict(msg, id='c'))
+        assert memo.get('b') is None
+        assert memo.get('a')['id'] == 'a'
+        assert not memo.put('d', 'gr1c', dict(msg, status='error (timeout)'))
+        assert not memo.put('e', 'gr1c', dict(msg, output='x'*max_bytes))
+    assert os.path.exists(str(tmp_path / 'memo.sqlite'))
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+"""Load generation and benchmarks of rcompserv
+
+The server is started in this process, with fake `gr1c` and `ltl2ba`
+executables on PATH whose runtime and output size are configurable.
+Jobs are stored in the Redis server given by --redis, or, if it is
+not given, in an in-memory stand-in from the package `fakeredis`
+(which needs the package `lupa` for Lua scripts). E.g.,
+
+    python bench.py --duration 20 --concurrency 32 \\
+        --mix gr1c=1,ltl2ba=1,trivial=2,status=4 -o before.json
+    python bench.py compare before.json after.json
+
+Client and server share the event loop, so latencies include time
+spent by the client. This is appropriate for comparing commits, not
+for estimating capacity of a deployment.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import os.path
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from rcompserv.serv import Server
+
+
+FAKE_GR1C = """#!/bin/sh
+if [ "$1" = "-V" ]; then echo "gr1c 0.0.0"; exit 0; fi
+sleep ${RCOMP_BENCH_RUNTIME:-0}
+head -c ${RCOMP_BENCH_OUTPUT_BYTES:-64} /dev/zero | tr '\\0' 'x'
+echo
+"""
+
+FAKE_LTL2BA = """#!/bin/sh
+sleep ${RCOMP_BENCH_RUNTIME:-0}
+echo 'never { /* fake */'
+head -c ${RCOMP_BENCH_OUTPUT_BYTES:-64} /dev/zero | tr '\\0' 'x'
+echo
+echo '}'
+"""
+
+OPERATIONS = ('gr1c', 'ltl2ba', 'trivial', 'status')
+
+
+def install_fake_tools(runtime, output_bytes):
+    """write fake executables to a temporary directory and put it first on PATH"""
+    bin_dir = tempfile.mkdtemp(prefix='rcomp-bench-')
+    for name, script in (('gr1c', FAKE_GR1C), ('ltl2ba', FAKE_LTL2BA)):
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as fp:
+            fp.write(script)
+        os.chmod(path, 0o755)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+    os.environ['RCOMP_BENCH_RUNTIME'] = str(runtime)
+    os.environ['RCOMP_BENCH_OUTPUT_BYTES'] = str(output_bytes)
+    return bin_dir
+
+
+class InMemoryServer(Server):
+    """Server with jobs in the Redis stand-in of fakeredis"""
+    async def start_redis(self, app):
+        import fakeredis
+        app['redis'] = fakeredis.FakeAsyncRedis()
+
+    async def stop_redis(self, app):
+        await app['redis'].aclose()
+
+
+def parse_mix(mix):
+    weights = dict()
+    for item in mix.split(','):
+        name, sep, weight = item.partition('=')
+        if name not in OPERATIONS or len(sep) == 0:
+            raise ValueError('malformed mix: {}'.format(mix))
+        weights[name] = float(weight)
+    return weights
+
+
+def percentiles(samples, ps=(50, 95, 99)):
+    """return `dict` of percentiles (nearest rank) of samples in ms"""
+    if len(samples) == 0:
+        return {'p{}'.format(p): None for p in ps}
+    samples = sorted(samples)
+    return {'p{}'.format(p): 1000*samples[min(len(samples)-1, int(len(samples)*p/100))]
+            for p in ps}
+
+
+async def measure_lag(lags, interval=0.01):
+    """record how late the event loop wakes up from sleep"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(max(0, loop.time() - start - interval))
+
+
+class Load:
+    def __init__(self, base_uri, weights, input_bytes, seed=0):
+        self.base_uri = base_uri
+        self.operations = list(weights)
+        self.weights = [weights[name] for name in self.operations]
+        self.spec = str(base64.b64encode(zlib.compress(b'x'*input_bytes)), encoding='utf-8')
+        self.random = random.Random(seed)
+        self.job_ids = []
+        self.latencies = {name: [] for name in self.operations}
+        self.statuses = dict()
+
+    def request(self, name):
+        if name == 'gr1c':
+            return 'POST', '/gr1c', {'argv': ['-r', self.spec]}
+        elif name == 'ltl2ba':
+            return 'POST', '/ltl2ba', {'argv': ['-f', '[]<>p{}'.format(self.random.randrange(1000))]}
+        elif name == 'trivial':
+            return 'GET', '/trivial', None
+        else:  # name == 'status'
+            if len(self.job_ids) == 0:
+                return 'GET', '/trivial', None
+            return 'GET', '/status/' + self.random.choice(self.job_ids), None
+
+    async def client(self, session, deadline, remaining):
+        loop = asyncio.get_running_loop()
+        while loop.time() < deadline and remaining[0] != 0:
+            remaining[0] -= 1
+            name = self.random.choices(self.operations, weights=self.weights)[0]
+            method, path, payload = self.request(name)
+            start = loop.time()
+            async with session.request(method, self.base_uri + path, json=payload) as res:
+                body = await res.read()
+            self.latencies[name].append(loop.time() - start)
+            self.statuses[res.status] = self.statuses.get(res.status, 0) + 1
+            if res.status == 200 and name in ('gr1c', 'ltl2ba'):
+                self.job_ids.append(json.loads(body)['id'])
+
+
+async def run(args):
+    install_fake_tools(args.runtime, args.output_bytes)
+    kwargs = dict(max_jobs=args.max_jobs,
+                  max_queue=(args.max_queue if args.max_queue > 0 else None))
+    if args.no_cache:
+        kwargs['result_cache'] = False
+    if args.redis_url is None:
+        server = InMemoryServer(**kwargs)
+    else:
+        server = Server(redis_url=args.redis_url, **kwargs)
+    runner = web.AppRunner(server.app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', args.port)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    load = Load('http://127.0.0.1:{}'.format(port), parse_mix(args.mix),
+                args.input_bytes, seed=args.seed)
+    lags = []
+    lag_monitor = asyncio.ensure_future(measure_lag(lags))
+    loop = asyncio.get_running_loop()
+    remaining = [args.requests if args.requests > 0 else -1]
+    try:
+        async with aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=args.concurrency)) as session:
+            start = loop.time()
+            await asyncio.gather(*[load.client(session, start + args.duration, remaining)
+                                   for ii in range(args.concurrency)])
+            elapsed = loop.time() - start
+        await server.scheduler.join()
+    finally:
+        lag_monitor.cancel()
+        await runner.cleanup()
+
+    all_latencies = [t for samples in load.latencies.values() for t in samples]
+    return {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {k: v for k, v in vars(args).items() if k != 'output'},
+        'requests': len(all_latencies),
+        'duration': elapsed,
+        'requests_per_second': len(all_latencies) / elapsed,
+        'status_codes': {str(k): v for k, v in sorted(load.statuses.items())},
+        'latency_ms': dict(
+            {'all': percentiles(all_latencies)},
+            **{name: percentiles(samples) for name, samples in load.latencies.items()}
+        ),
+        'loop_lag_ms': dict(percentiles(lags), max=1000*max(lags, default=0)),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       universal_newlines=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(paths):
+    """print main numbers of results side by side"""
+    results = []
+    for path in paths:
+        with open(path) as fp:
+            results.append(json.load(fp))
+    rows = [('commit', lambda r: r['commit']),
+            ('requests/s', lambda r: '{:.1f}'.format(r['requests_per_second'])),
+            ('p50 ms', lambda r: '{:.2f}'.format(r['latency_ms']['all']['p50'])),
+            ('p95 ms', lambda r: '{:.2f}'.format(r['latency_ms']['all']['p95'])),
+            ('p99 ms', lambda r: '{:.2f}'.format(r['latency_ms']['all']['p99'])),
+            ('loop lag p99 ms', lambda r: '{:.2f}'.format(r['loop_lag_ms']['p99'])),
+            ('peak RSS KiB', lambda r: str(r['peak_rss_kb']))]
+    print('\t'.join(['']+paths))
+    for label, value in rows:
+        print('\t'.join([label]+[str(value(r)) for r in results]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='bench.py')
+    parser.add_argument('--redis', metavar='URL', dest='redis_url',
+                        help=('URL of Redis server; default is an in-memory'
+                              ' stand-in (requires fakeredis and lupa).'))
+    parser.add_argument('--port', type=int, default=0,
+                        help='port of the server; default is any free port.')
+    parser.add_argument('-d', '--duration', metavar='T', type=float, default=10,
+                        help='duration (seconds) of load; default is 10.')
+    parser.add_argument('-n', '--requests', metavar='N', type=int, default=0,
+                        help='stop after N requests; default is no limit.')
+    parser.add_argument('-c', '--concurrency', metavar='N', type=int, default=16,
+                        help='number of requests in flight; default is 16.')
+    parser.add_argument('--mix', default='gr1c=1,ltl2ba=1,trivial=2,status=4',
+                        help=('relative weights of kinds of requests;'
+                              ' default is gr1c=1,ltl2ba=1,trivial=2,status=4.'))
+    parser.add_argument('--runtime', metavar='T', type=float, default=0.05,
+                        help='runtime (seconds) of fake tools; default is 0.05.')
+    parser.add_argument('--output-bytes', metavar='N', type=int, default=1024,
+                        help='size of output of fake tools; default is 1024.')
+    parser.add_argument('--input-bytes', metavar='N', type=int, default=4096,
+                        help='size of input files of gr1c jobs; default is 4096.')
+    parser.add_argument('--max-jobs', metavar='N', type=int,
+                        help='as for rcompserv; default is the number of CPUs.')
+    parser.add_argument('--max-queue', metavar='N', type=int, default=0,
+                        help=('as for rcompserv, where 0 (default) means'
+                              ' unbounded.'))
+    parser.add_argument('--no-cache', action='store_true', default=False,
+                        help='do not cache results of jobs.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of random choices of requests.')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='write results as JSON to FILE.')
+    parser.add_argument('compare', nargs='*', metavar='RESULTS',
+                        help=('with first argument "compare", print results'
+                              ' from the given JSON files side by side.'))
+    args = parser.parse_args(argv)
+
+    if len(args.compare) > 0:
+        if args.compare[0] != 'compare' or len(args.compare) < 2:
+            parser.error('usage: bench.py compare RESULTS [RESULTS ...]')
+        compare(args.compare[1:])
+        return 0
+
+    del args.compare
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -20,4 +20,4 @@ sudo systemctl stop redis
 python3 -m virtualenv -p python3 PY
 source PY/bin/activate
 pip install -U pip
-pip install gunicorn aiohttp redis
+pip install gunicorn aiohttp "redis>=5.0.1"
@@ -2,7 +2,12 @@ import argparse
 import sys
 
 from . import __version__
+from . import prefork
+from . import staging
+from .resultcache import ResultCache
+from .retention import Retention
 from .serv import Server
+from .worker import Worker
 
 
 def main(argv=None):
@@ -20,6 +25,120 @@ def main(argv=None):
                         type=int,
                         default=8080,
                         help='port on which to listen; default is 8080')
+    parser.add_argument('--unix', metavar='PATH',
+                        dest='unix_path',
+                        help=('listen on Unix socket at PATH instead of'
+                              ' the TCP port, e.g., behind nginx.'))
+    parser.add_argument('-w', '--workers', metavar='N',
+                        dest='workers', type=int, default=1,
+                        help=('number of server processes, which share the'
+                              ' port or Unix socket; crashed processes are'
+                              ' restarted; limits such as --max-jobs apply'
+                              ' to each process; default is 1.'
+                              ' only used in serve mode.'))
+    parser.add_argument('--redis', metavar='URL',
+                        dest='redis_url',
+                        help=('URL of Redis server used to store jobs,'
+                              ' e.g., redis://127.0.0.1:6379/0;'
+                              ' default is Redis on localhost.'))
+    parser.add_argument('--max-jobs', metavar='N',
+                        dest='max_jobs', type=int,
+                        help=('maximum number of jobs running at once;'
+                              ' default is the number of CPUs.'))
+    parser.add_argument('--max-command-jobs', metavar='COMMAND=N',
+                        dest='max_command_jobs', action='append',
+                        default=[],
+                        help=('maximum number of running jobs of COMMAND,'
+                              ' e.g., gr1c=2; this switch can be repeated.'))
+    parser.add_argument('--max-client-jobs', metavar='N',
+                        dest='max_client_jobs', type=int,
+                        help=('maximum number of running jobs of each client;'
+                              ' default is no limit other than --max-jobs.'))
+    parser.add_argument('--client-weight', metavar='KEY=W',
+                        dest='client_weights', action='append',
+                        default=[],
+                        help=('weight in fair queuing of the client with'
+                              ' API key KEY (default weight is 1), e.g.,'
+                              ' 0123abcd=4; this switch can be repeated.'))
+    parser.add_argument('--max-queue', metavar='N',
+                        dest='max_queue', type=int, default=64,
+                        help=('maximum number of jobs waiting to start;'
+                              ' if 0, then the queue is unbounded;'
+                              ' default is 64.'))
+    parser.add_argument('--cache-ttl', metavar='T',
+                        dest='cache_ttl', type=int, default=86400,
+                        help=('duration (seconds) for which cached results'
+                              ' are kept after last use; default is 86400.'))
+    parser.add_argument('--cache-max-bytes', metavar='N',
+                        dest='cache_max_bytes', type=int, default=64*2**20,
+                        help=('maximum total size of cached outputs;'
+                              ' if 0, then results are not cached;'
+                              ' default is 64 MiB.'))
+    parser.add_argument('--retention', metavar='T',
+                        dest='retention', type=int, default=7*86400,
+                        help=('duration (seconds) for which finished jobs'
+                              ' are kept after they finish or are last read;'
+                              ' if 0, then they are kept until evicted;'
+                              ' default is 604800 (one week).'))
+    parser.add_argument('--retention-max-bytes', metavar='N',
+                        dest='retention_max_bytes', type=int, default=256*2**20,
+                        help=('maximum total size of outputs of finished jobs,'
+                              ' beyond which the oldest jobs are evicted;'
+                              ' if 0, then there is no bound;'
+                              ' default is 256 MiB.'))
+    parser.add_argument('--compress-output', metavar='N',
+                        dest='compress_threshold', type=int, default=65536,
+                        help=('compress outputs of finished jobs that are'
+                              ' larger than N bytes; if 0, then outputs are'
+                              ' not compressed; default is 65536.'))
+    parser.add_argument('--input-memory-threshold', metavar='N',
+                        dest='input_memory_threshold', type=int,
+                        default=staging.MEMORY_THRESHOLD,
+                        help=('keep input files of jobs that are not larger'
+                              ' than N bytes in memory; if 0, then input'
+                              ' files are always written to disk;'
+                              ' default is 8 MiB.'))
+    parser.add_argument('--staging-dir', metavar='DIR',
+                        dest='staging_dir',
+                        help=('directory in which larger input files of jobs'
+                              ' are written, e.g., /dev/shm for tmpfs;'
+                              ' default is the system temporary directory.'))
+    parser.add_argument('--staging-threads', metavar='N',
+                        dest='staging_threads', type=int, default=4,
+                        help=('number of threads that decode and stage input'
+                              ' files of jobs; default is 4.'))
+    parser.add_argument('--max-input-bytes', metavar='N',
+                        dest='max_input_bytes', type=int, default=128*2**20,
+                        help=('reject jobs with an input file that is larger'
+                              ' than N bytes after decompression; if 0, then'
+                              ' there is no limit; default is 128 MiB.'))
+    parser.add_argument('--max-job-input-bytes', metavar='N',
+                        dest='max_job_input_bytes', type=int, default=256*2**20,
+                        help=('reject jobs whose input files are larger than'
+                              ' N bytes in total after decompression; if 0,'
+                              ' then there is no limit; default is 256 MiB.'))
+    parser.add_argument('--probe-interval', metavar='T',
+                        dest='probe_interval', type=int, default=300,
+                        help=('duration (seconds) between checks for tools'
+                              ' that were installed or changed; if 0, then'
+                              ' tools are only checked at startup;'
+                              ' default is 300.'))
+    parser.add_argument('--dispatch', choices=['local', 'queue'],
+                        dest='dispatch', default='local',
+                        help=('if "local" (default), then run jobs as'
+                              ' subprocesses of this server; if "queue",'
+                              ' then only append jobs to the Redis queue'
+                              ' for `rcompserv worker` processes.'))
+    parser.add_argument('--worker-id', metavar='ID',
+                        dest='worker_id',
+                        help=('name of this worker; default is formed from'
+                              ' hostname and process ID.'
+                              ' only used in worker mode.'))
+    parser.add_argument('MODE', nargs='?', choices=['serve', 'worker'],
+                        default='serve',
+                        help=('"serve" (default) to answer HTTP requests;'
+                              ' "worker" to take jobs from the Redis queue'
+                              ' and run them.'))
     if argv is None:
         args = parser.parse_args()
     else:
@@ -29,7 +148,89 @@ def main(argv=None):
         print('rcompserv '+__version__)
         return 0
 
-    Server(port=args.port, timeout_per_job=args.timeout).run()
+    max_jobs_per_command = dict()
+    for limit in args.max_command_jobs:
+        command, sep, n = limit.partition('=')
+        if len(sep) == 0 or not n.isdigit():
+            parser.error('malformed --max-command-jobs: {}'.format(limit))
+        max_jobs_per_command[command] = int(n)
+
+    client_weights = dict()
+    for weight in args.client_weights:
+        key, sep, w = weight.rpartition('=')
+        try:
+            client_weights[key] = float(w)
+        except ValueError:
+            sep = ''
+        if len(sep) == 0 or client_weights.get(key, 0) <= 0:
+            parser.error('malformed --client-weight: {}'.format(weight))
+
+    if args.cache_max_bytes > 0:
+        result_cache = ResultCache(ttl=args.cache_ttl,
+                                   max_bytes=args.cache_max_bytes)
+    else:
+        result_cache = False
+
+    retention = Retention(ttl=(args.retention if args.retention > 0 else None),
+                          max_bytes=(args.retention_max_bytes
+                                     if args.retention_max_bytes > 0 else None),
+                          compress_threshold=(args.compress_threshold
+                                              if args.compress_threshold > 0 else None))
+
+    probe_interval = args.probe_interval if args.probe_interval > 0 else None
+    input_memory_threshold = (args.input_memory_threshold
+                              if args.input_memory_threshold > 0 else None)
+    if args.staging_threads < 1:
+        parser.error('--staging-threads must be positive')
+    max_input_bytes = args.max_input_bytes if args.max_input_bytes > 0 else None
+    max_job_input_bytes = (args.max_job_input_bytes
+                           if args.max_job_input_bytes > 0 else None)
+
+    if args.MODE == 'worker':
+        Worker(worker_id=args.worker_id,
+               timeout_per_job=args.timeout,
+               result_cache=result_cache,
+               retention=retention,
+               redis_url=args.redis_url,
+               max_jobs=args.max_jobs,
+               max_jobs_per_command=max_jobs_per_command,
+               max_jobs_per_client=args.max_client_jobs,
+               client_weights=client_weights,
+               input_memory_threshold=input_memory_threshold,
+               staging_dir=args.staging_dir,
+               staging_threads=args.staging_threads,
+               max_input_bytes=max_input_bytes,
+               max_job_input_bytes=max_job_input_bytes,
+               probe_interval=probe_interval).run()
+        return 0
+
+    server = Server(port=args.port, timeout_per_job=args.timeout,
+                    redis_url=args.redis_url,
+                    max_jobs=args.max_jobs,
+                    max_jobs_per_command=max_jobs_per_command,
+                    max_jobs_per_client=args.max_client_jobs,
+                    client_weights=client_weights,
+                    max_queue=(args.max_queue if args.max_queue > 0 else None),
+                    dispatch=args.dispatch,
+                    result_cache=result_cache,
+                    retention=retention,
+                    input_memory_threshold=input_memory_threshold,
+                    staging_dir=args.staging_dir,
+                    staging_threads=args.staging_threads,
+                    max_input_bytes=max_input_bytes,
+                    max_job_input_bytes=max_job_input_bytes,
+                    probe_interval=probe_interval)
+    sock = None
+    if args.unix_path is not None:
+        sock = prefork.bind_unix(args.unix_path)
+    try:
+        if args.workers > 1:
+            prefork.run(server, args.workers, sock=sock)
+        else:
+            server.run(sock=sock)
+    finally:
+        if sock is not None:
+            prefork.unbind(sock)
     return 0
 
 
@@ -0,0 +1,189 @@
+"""Codecs for file data uploaded by clients and for responses
+
+The codec `zstd` is only available if the package `zstandard` is
+installed.
+
+Responses are compressed with the content coding that the client
+prefers among RESPONSE_ENCODINGS, as given in its header
+Accept-Encoding (cf. negotiate()).
+"""
+import gzip
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+SUPPORTED_CODECS = ['zlib', 'gzip', 'none']
+if zstandard is not None:
+    SUPPORTED_CODECS.append('zstd')
+
+RESPONSE_ENCODINGS = ['gzip']
+if zstandard is not None:
+    RESPONSE_ENCODINGS.insert(0, 'zstd')
+
+# Responses with smaller bodies are not compressed.
+MIN_RESPONSE_SIZE = 1024
+
+# Exceptions that indicate malformed compressed data
+ERRORS = (zlib.error,)
+if zstandard is not None:
+    ERRORS += (zstandard.ZstdError,)
+
+
+class _Identity:
+    def decompress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+class _Zstd:
+    def __init__(self):
+        """incremental zstd decompression in pieces of bounded size.
+
+        the decompression objects of zstandard inflate all data that
+        they are given at once, so data are instead written to a stream
+        writer, which passes pieces of at most
+        DECOMPRESSION_RECOMMENDED_OUTPUT_SIZE bytes to the function
+        given to decompress_to(). The stream writer does not tell where
+        the frame ends, so that is found from the headers of the frame
+        and its blocks (cf. RFC 8878), and `eof` is True once the whole
+        frame was given. Data after the frame are ignored.
+        """
+        self.eof = False
+        self._output = None
+        self._writer = zstandard.ZstdDecompressor().stream_writer(
+            self, write_size=zstandard.DECOMPRESSION_RECOMMENDED_OUTPUT_SIZE,
+            write_return_read=True)
+        self._state = 'frame'
+        self._checksum = False
+        self._pending = b''
+        self._skip = 0
+
+    def write(self, data):
+        # Called by the stream writer
+        self._output(data)
+        return len(data)
+
+    def decompress_to(self, data, output):
+        """decompress `data`, and call `output` with pieces of the result"""
+        self._output = output
+        self._writer.write(data[:self._scan(data)])
+
+    def flush(self):
+        return b''
+
+    def _need(self):
+        if self._state == 'frame':
+            if len(self._pending) < 5:
+                return 5
+            descriptor = self._pending[4]
+            single_segment = descriptor & 0x20
+            content_size = (1 if single_segment else 0, 2, 4, 8)[descriptor >> 6]
+            dictionary_id = (0, 1, 2, 4)[descriptor & 3]
+            return 5 + (0 if single_segment else 1) + dictionary_id + content_size
+        elif self._state == 'block':
+            return 3
+        else:  # self._state == 'checksum'
+            return 4
+
+    def _parse(self):
+        if self._state == 'frame':
+            if self._pending[:4] != b'\x28\xb5\x2f\xfd':
+                raise zstandard.ZstdError('not a zstd frame')
+            self._checksum = bool(self._pending[4] & 0x04)
+            self._state = 'block'
+        elif self._state == 'block':
+            header = int.from_bytes(self._pending, 'little')
+            block_type = (header >> 1) & 3
+            if block_type == 3:
+                raise zstandard.ZstdError('reserved zstd block type')
+            # RLE blocks have one byte.
+            self._skip = 1 if block_type == 1 else header >> 3
+            if header & 1:
+                self._state = 'checksum' if self._checksum else 'end'
+        else:  # self._state == 'checksum'
+            self._state = 'end'
+        self._pending = b''
+
+    def _scan(self, data):
+        """return number of bytes at the start of `data` that belong to the frame"""
+        pos = 0
+        while not self.eof:
+            if self._skip > 0:
+                if pos == len(data):
+                    break
+                n = min(self._skip, len(data) - pos)
+                self._skip -= n
+                pos += n
+            elif self._state == 'end':
+                self.eof = True
+            elif len(self._pending) < self._need():
+                if pos == len(data):
+                    break
+                n = min(self._need() - len(self._pending), len(data) - pos)
+                self._pending += data[pos:pos+n]
+                pos += n
+            else:
+                self._parse()
+        return pos
+
+
+def decompressor(codec):
+    """return object for incremental decompression of `codec` data.
+
+    The object has methods decompress(data) and flush() like those of
+    zlib.decompressobj(), except for zstd, whose object has method
+    decompress_to(data, output) instead (cf. _Zstd). Objects with
+    attribute `eof` report whether the compressed data were complete.
+
+    raise ValueError if the codec is not supported.
+    """
+    if codec not in SUPPORTED_CODECS:
+        raise ValueError('unsupported codec: {}'.format(codec))
+    if codec == 'zlib':
+        return zlib.decompressobj()
+    elif codec == 'gzip':
+        return zlib.decompressobj(wbits=31)
+    elif codec == 'zstd':
+        return _Zstd()
+    else:  # codec == 'none'
+        return _Identity()
+
+
+def negotiate(accept_encoding):
+    """return content coding for response given header Accept-Encoding.
+
+    among RESPONSE_ENCODINGS that the client accepts, the one with the
+    greatest quality value is chosen, and zstd before gzip for equal
+    values. return None if the response should not be compressed.
+    """
+    qualities = dict()
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        qualities[coding] = q
+    best = None
+    for encoding in RESPONSE_ENCODINGS:
+        q = qualities.get(encoding, qualities.get('*', 0.0))
+        if q > 0 and (best is None or q > best[0]):
+            best = (q, encoding)
+    return None if best is None else best[1]
+
+
+def compress(data, encoding):
+    """return `data` compressed with content coding `encoding`"""
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data, compresslevel=6)
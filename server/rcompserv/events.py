@@ -0,0 +1,149 @@
+"""Notifications about changes of jobs across processes
+
+Whenever the state of a job changes, or output is appended to it, a
+message is published on the Redis channel of that job. Each server
+process subscribes to the channel of a job only while it has local
+waiters for it, e.g., long-poll requests and streams of server-sent
+events, and forwards messages to them. Requests to cancel jobs are
+published on CANCEL_CHANNEL, to which all processes subscribe, since
+any of them can run the job.
+"""
+import asyncio
+import collections
+
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+
+CHANNEL_PREFIX = 'rcomp:job:'
+
+# Channel of IDs of jobs to cancel by the process that runs or queues them
+CANCEL_CHANNEL = 'rcomp:cancel'
+
+# Message published when output of a job was appended. All other
+# messages are the new state of the job.
+OUTPUT = 'output'
+
+# Maximum duration (seconds) of waiting for Redis to confirm a new
+# subscription, after which waiters continue without it
+SUBSCRIBE_TIMEOUT = 5
+
+
+def channel(job_id):
+    return CHANNEL_PREFIX + job_id
+
+async def wait_for_state(queue, timeout):
+    """wait for new state from queue returned by JobEvents.subscribe().
+
+    notifications about output are skipped.
+
+    raise asyncio.TimeoutError if no state is received before `timeout`.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        message = await asyncio.wait_for(queue.get(),
+                                         timeout=max(0, deadline - loop.time()))
+        if message != OUTPUT:
+            return message
+
+
+class JobEvents:
+    def __init__(self, retry_delay=1, on_cancel=None):
+        """
+        if `on_cancel` is given, then it is called with the job ID
+        whenever cancellation of a job is requested.
+        """
+        self._waiters = collections.defaultdict(set)
+        self._on_cancel = on_cancel
+        self._retry_delay = retry_delay
+        self._reader = None
+        self._pubsub = None
+        # Futures of channels whose subscription is not confirmed yet
+        self._subscribing = dict()
+
+    async def start(self, redis):
+        self._reader = asyncio.ensure_future(self._read(redis))
+
+    async def stop(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+            self._reader = None
+
+    async def _read(self, redis):
+        while True:
+            pubsub = redis.pubsub()
+            self._pubsub = pubsub
+            try:
+                # Channels of waiters are subscribed to again after
+                # the connection was lost.
+                await pubsub.subscribe(CANCEL_CHANNEL,
+                                       *[channel(job_id) for job_id in self._waiters])
+                async for message in pubsub.listen():
+                    name = str(message['channel'], encoding='utf-8')
+                    if message['type'] == 'subscribe':
+                        future = self._subscribing.pop(name, None)
+                        if future is not None and not future.done():
+                            future.set_result(None)
+                        continue
+                    if message['type'] != 'message':
+                        continue
+                    data = str(message['data'], encoding='utf-8')
+                    if name == CANCEL_CHANNEL:
+                        if self._on_cancel is not None:
+                            self._on_cancel(data)
+                        continue
+                    for queue in self._waiters.get(name[len(CHANNEL_PREFIX):], ()):
+                        queue.put_nowait(data)
+            except RedisConnectionError:
+                print('WARNING: lost subscription to job events; retrying')
+                await asyncio.sleep(self._retry_delay)
+            finally:
+                self._pubsub = None
+                # Waiters continue without confirmation (cf. subscribe()).
+                for future in self._subscribing.values():
+                    if not future.done():
+                        future.set_result(None)
+                self._subscribing.clear()
+                await pubsub.aclose()
+
+    async def subscribe(self, job_id):
+        """return queue that receives new states of the job.
+
+        the channel of the job is subscribed to if this is its first
+        waiter, and this returns once Redis confirmed it, so that no
+        message that is published afterwards is missed.
+        """
+        queue = asyncio.Queue()
+        first = len(self._waiters[job_id]) == 0
+        self._waiters[job_id].add(queue)
+        if first and self._pubsub is not None and channel(job_id) not in self._subscribing:
+            self._subscribing[channel(job_id)] = asyncio.get_running_loop().create_future()
+            try:
+                await self._pubsub.subscribe(channel(job_id))
+            except RedisConnectionError:
+                # The reader subscribes again once reconnected.
+                pass
+        future = self._subscribing.get(channel(job_id))
+        if future is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(future), SUBSCRIBE_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+        return queue
+
+    async def unsubscribe(self, job_id, queue):
+        self._waiters[job_id].discard(queue)
+        if len(self._waiters[job_id]) == 0:
+            del self._waiters[job_id]
+            future = self._subscribing.pop(channel(job_id), None)
+            if future is not None and not future.done():
+                future.set_result(None)
+            if self._pubsub is not None:
+                try:
+                    await self._pubsub.unsubscribe(channel(job_id))
+                except RedisConnectionError:
+                    pass
@@ -0,0 +1,127 @@
+"""Redis-backed queue of jobs shared by API servers and workers
+
+Job IDs are pushed on the left of the list QUEUE_KEY and popped from
+the right, so the list is in FIFO order. A worker atomically moves
+each job it takes into its own processing list. If the heartbeat of
+a worker expires, then jobs in its processing list are moved back to
+the queue by any other worker, and output of their partial runs is
+discarded.
+"""
+import json
+
+from . import events
+from . import records
+
+
+QUEUE_KEY = 'rcomp:queue'
+WORKERS_KEY = 'rcomp:workers'
+
+
+def processing_key(worker_id):
+    return 'rcomp:processing:' + worker_id
+
+def heartbeat_key(worker_id):
+    return 'rcomp:worker:' + worker_id
+
+
+async def enqueue(redis, job_id, command, argv, timeout=None, fields=None):
+    """store job description in its record and append it to the queue.
+
+    `argv` is stored as given, i.e., files are still encoded as sent
+    by the client. They are decoded by the worker that runs the job.
+    """
+    mapping = {
+        'command': command,
+        'argv': json.dumps(argv),
+        'state': 'queued',
+        'done': 0
+    }
+    if timeout is not None:
+        mapping['timeout'] = timeout
+    if fields is not None:
+        mapping.update(fields)
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(job_id, mapping=mapping)
+        pipe.lpush(QUEUE_KEY, job_id)
+        await pipe.execute()
+
+async def remove(redis, job_id):
+    """remove job from queue before a worker takes it.
+
+    return whether it was in the queue.
+    """
+    return await redis.lrem(QUEUE_KEY, 0, job_id) > 0
+
+async def length(redis):
+    return await redis.llen(QUEUE_KEY)
+
+async def position(redis, job_id):
+    """return 1-based position of job in queue, or None if not queued"""
+    return (await positions(redis, [job_id]))[0]
+
+async def positions(redis, job_ids):
+    """return list of positions as from position(), one per job ID"""
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.llen(QUEUE_KEY)
+        for job_id in job_ids:
+            pipe.lpos(QUEUE_KEY, job_id)
+        replies = await pipe.execute()
+    n = replies[0]
+    return [(None if index is None else n - index) for index in replies[1:]]
+
+async def take(redis, worker_id, timeout=1):
+    """block until a job is available and move it to processing list.
+
+    return job ID, or None if none was available before `timeout`.
+    """
+    job_id = await redis.blmove(QUEUE_KEY, processing_key(worker_id),
+                                timeout, src='RIGHT', dest='LEFT')
+    if job_id is None:
+        return None
+    return str(job_id, encoding='utf-8')
+
+async def release(redis, worker_id, job_id):
+    """remove job from processing list of worker after it finishes"""
+    await redis.lrem(processing_key(worker_id), 0, job_id)
+
+async def heartbeat(redis, worker_id, ttl):
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.set(heartbeat_key(worker_id), 1, ex=ttl)
+        pipe.sadd(WORKERS_KEY, worker_id)
+        await pipe.execute()
+
+async def retire(redis, worker_id):
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.delete(heartbeat_key(worker_id))
+        pipe.srem(WORKERS_KEY, worker_id)
+        await pipe.execute()
+
+async def requeue_dead(redis):
+    """move jobs of workers without heartbeat back to the queue.
+
+    return list of IDs of jobs that were requeued.
+    """
+    requeued = []
+    for worker_id in await redis.smembers(WORKERS_KEY):
+        worker_id = str(worker_id, encoding='utf-8')
+        if await redis.exists(heartbeat_key(worker_id)):
+            continue
+        while True:
+            # Requeued jobs are placed at the head of the queue.
+            job_id = await redis.lmove(processing_key(worker_id), QUEUE_KEY,
+                                       src='RIGHT', dest='RIGHT')
+            if job_id is None:
+                break
+            job_id = str(job_id, encoding='utf-8')
+            async with redis.pipeline(transaction=True) as pipe:
+                # The job runs again from the start, so output of the
+                # dead worker would otherwise precede its output.
+                pipe.delete(records.output_key(job_id), records.stderr_key(job_id))
+                pipe.hdel(job_id, 'output_size', 'output_digest', 'worker')
+                pipe.hset(job_id, 'state', 'queued')
+                pipe.hincrby(job_id, 'attempts', 1)
+                pipe.publish(events.channel(job_id), 'queued')
+                await pipe.execute()
+            requeued.append(job_id)
+        await redis.srem(WORKERS_KEY, worker_id)
+    return requeued
@@ -0,0 +1,228 @@
+"""Operational metrics in the Prometheus text exposition format
+
+Each process accumulates changes of metrics locally and periodically
+adds them to the hash METRICS_KEY in Redis, so that a request to
+/metrics at any process reports totals over all processes, e.g., all
+gunicorn workers of an API server and all `rcompserv worker`
+processes. Fields of the hash are series as they appear in the
+exposition, e.g., `rcomp_jobs_submitted_total{command="gr1c"}`.
+
+Gauges are not added up from changes, which would be lost if a
+process died, e.g., while jobs were running. Instead, each process
+sets the values of its gauges in a hash of its own (cf.
+gauges_key()), which expires unless the process keeps flushing. The
+values of gauges are sums over the hashes of processes in the set
+GAUGE_PROCESSES_KEY.
+"""
+import asyncio
+import collections
+import contextlib
+import os
+import socket
+import time
+import uuid
+
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+
+METRICS_KEY = 'rcomp:metrics'
+GAUGE_PROCESSES_KEY = 'rcomp:metrics:processes'
+
+# Gauges of a process expire after this many flush intervals without
+# a flush.
+GAUGE_TTL_INTERVALS = 3
+
+# Durations (seconds)
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 1800, float('inf'))
+
+# Sizes (bytes)
+SIZE_BUCKETS = tuple(2**k for k in range(8, 29, 2)) + (float('inf'),)
+
+
+def gauges_key(process_id):
+    return 'rcomp:metrics:gauges:' + process_id
+
+
+def _series(name, labels):
+    if len(labels) == 0:
+        return name
+    return '{}{{{}}}'.format(name, ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in sorted(labels.items())
+    ))
+
+def _format(value):
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metrics:
+    def __init__(self, flush_interval=5):
+        self.flush_interval = flush_interval
+        self._definitions = collections.OrderedDict()
+        self._pending = collections.defaultdict(float)
+        self._gauges = collections.defaultdict(float)
+        self._process_id = None
+        self._flusher = None
+
+    def counter(self, name, help):
+        self._definitions[name] = ('counter', help, None)
+
+    def gauge(self, name, help):
+        self._definitions[name] = ('gauge', help, None)
+
+    def histogram(self, name, help, buckets=TIME_BUCKETS):
+        self._definitions[name] = ('histogram', help, buckets)
+
+    def inc(self, name, value=1, **labels):
+        """add `value` to counter or gauge"""
+        kind = self._definitions[name][0]
+        assert kind in ('counter', 'gauge')
+        if kind == 'gauge':
+            self._gauges[_series(name, labels)] += value
+        else:
+            self._pending[_series(name, labels)] += value
+
+    def observe(self, name, value, **labels):
+        kind, _, buckets = self._definitions[name]
+        assert kind == 'histogram'
+        # Buckets are cumulative, as in the exposition.
+        for le in buckets:
+            if value <= le:
+                self._pending[_series(name + '_bucket', dict(labels, le=_format(le)))] += 1
+        self._pending[_series(name + '_sum', labels)] += value
+        self._pending[_series(name + '_count', labels)] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """observe duration (seconds) of the body of the `with` statement"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    async def flush(self, redis):
+        """add changes since the previous flush to the shared totals,
+        and set gauges of this process.
+        """
+        if len(self._pending) == 0 and len(self._gauges) == 0:
+            return
+        pending = self._pending
+        self._pending = collections.defaultdict(float)
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                for series, value in pending.items():
+                    pipe.hincrbyfloat(METRICS_KEY, series, value)
+                if len(self._gauges) > 0:
+                    key = gauges_key(self.process_id())
+                    pipe.hset(key, mapping=self._gauges)
+                    pipe.pexpire(key, int(1000*GAUGE_TTL_INTERVALS*self.flush_interval))
+                    pipe.sadd(GAUGE_PROCESSES_KEY, self.process_id())
+                await pipe.execute()
+        except RedisConnectionError:
+            # Keep changes for the next attempt.
+            for series, value in pending.items():
+                self._pending[series] += value
+            raise
+
+    async def read_gauges(self, redis):
+        """return `dict` of sums of gauges over all processes that are
+        alive, and forget processes whose gauges expired.
+        """
+        process_ids = [str(process_id, encoding='utf-8')
+                       for process_id in await redis.smembers(GAUGE_PROCESSES_KEY)]
+        async with redis.pipeline(transaction=False) as pipe:
+            for process_id in process_ids:
+                pipe.hgetall(gauges_key(process_id))
+            replies = await pipe.execute()
+        gauges = collections.defaultdict(float)
+        expired = []
+        for process_id, values in zip(process_ids, replies):
+            if len(values) == 0:
+                expired.append(process_id)
+            for series, value in values.items():
+                gauges[series] += float(value)
+        if len(expired) > 0:
+            await redis.srem(GAUGE_PROCESSES_KEY, *expired)
+        return gauges
+
+    async def render(self, redis):
+        """return totals over all processes in the text exposition format"""
+        await self.flush(redis)
+        values = await redis.hgetall(METRICS_KEY)
+        values.update(await self.read_gauges(redis))
+        totals = collections.defaultdict(list)
+        for series, value in values.items():
+            series = str(series, encoding='utf-8')
+            name, _, labels = series.partition('{')
+            for suffix in ('_bucket', '_sum', '_count'):
+                if name.endswith(suffix) and name[:-len(suffix)] in self._definitions:
+                    name = name[:-len(suffix)]
+                    break
+            totals[name].append((series, float(value)))
+        lines = []
+        for name, (kind, help, buckets) in self._definitions.items():
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for series, value in sorted(totals.get(name, []), key=_sort_key):
+                lines.append('{} {}'.format(series, _format(value)))
+        return '\n'.join(lines) + '\n'
+
+    def process_id(self):
+        """return ID of this process in GAUGE_PROCESSES_KEY, which is
+        chosen once this process uses it, i.e., after any fork.
+        """
+        if self._process_id is None:
+            self._process_id = '{}:{}:{}'.format(socket.gethostname(), os.getpid(),
+                                                 uuid.uuid4().hex[:8])
+        return self._process_id
+
+    async def start(self, redis):
+        self._flusher = asyncio.ensure_future(self._flush_periodically(redis))
+
+    async def stop(self, redis):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        try:
+            await self.flush(redis)
+            if self._process_id is not None:
+                # Gauges of this process no longer apply.
+                async with redis.pipeline(transaction=False) as pipe:
+                    pipe.delete(gauges_key(self._process_id))
+                    pipe.srem(GAUGE_PROCESSES_KEY, self._process_id)
+                    await pipe.execute()
+        except RedisConnectionError:
+            print('WARNING: failed to flush metrics')
+
+    async def _flush_periodically(self, redis):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush(redis)
+            except RedisConnectionError:
+                print('WARNING: failed to flush metrics; retrying')
+
+
+def _sort_key(item):
+    # Order series by labels other than `le`, then buckets by `le`,
+    # then _sum and _count.
+    series = item[0]
+    name, _, labels = series.partition('{')
+    labels = labels.rstrip('}').split(',') if len(labels) > 0 else []
+    le = [label for label in labels if label.startswith('le=')]
+    others = [label for label in labels if not label.startswith('le=')]
+    if len(le) > 0:
+        le = le[0][len('le="'):-1]
+        le = float('inf') if le == '+Inf' else float(le)
+    else:
+        le = float('inf')
+    return (others, not name.endswith('_bucket'), le, name)
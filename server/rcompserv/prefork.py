@@ -0,0 +1,109 @@
+"""Serving requests with several processes
+
+The parent process probes tools of commands once, then forks worker
+processes that each run an event loop with the same Server object.
+Workers listen on the same TCP port through SO_REUSEPORT, so the
+kernel balances connections among them, or they share one Unix socket
+that the parent created, e.g., for nginx (cf. nginx.conf). E.g.,
+
+    rcompserv --workers 8 --unix /tmp/rcompserv.sock
+
+Workers that exit are restarted. On SIGTERM or SIGINT, the parent
+forwards SIGTERM to all workers, which stop accepting connections and
+exit once their jobs are done (cf. Server.serve()).
+"""
+import asyncio
+import os
+import signal
+import socket
+import time
+import traceback
+
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+
+# Minimum duration (seconds) between restarts of a worker that crashes
+RESTART_DELAY = 1
+
+
+def bind_unix(path):
+    """return listening Unix socket at `path`, replacing any stale socket"""
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(socket.SOMAXCONN)
+    return sock
+
+
+def unbind(sock):
+    """close listening socket and remove it if it is a Unix socket"""
+    path = sock.getsockname() if sock.family == socket.AF_UNIX else None
+    sock.close()
+    if path and os.path.exists(path):
+        os.unlink(path)
+
+
+async def probe(server):
+    """probe tools before forking, so workers do not need to"""
+    await server.start_redis(server.app)
+    try:
+        await server.reprobe(server.app['redis'])
+    except RedisConnectionError:
+        print('WARNING: failed to publish tools')
+    finally:
+        await server.stop_redis(server.app)
+
+
+def run(server, workers, sock=None):
+    """serve with `workers` processes until SIGTERM or SIGINT.
+
+    if `sock` is None, then workers listen on the host and port of
+    `server` with SO_REUSEPORT. Otherwise, they accept connections on
+    the listening socket `sock`.
+    """
+    asyncio.run(probe(server))
+    children = dict()
+    stopping = []
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                server.run(sock=sock, reuse_port=(sock is None))
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = (index, time.monotonic())
+
+    def stop(signum, frame):
+        if len(stopping) == 0:
+            stopping.append(signum)
+            for pid in children:
+                os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(workers):
+        spawn(index)
+    while len(children) > 0:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        if pid not in children:
+            continue
+        index, started = children.pop(pid)
+        if len(stopping) > 0:
+            continue
+        print('WARNING: worker {} (pid {}) exited with status {}; restarting'.format(
+            index, pid, os.waitstatus_to_exitcode(status)))
+        if time.monotonic() - started < RESTART_DELAY:
+            time.sleep(RESTART_DELAY)
+        if len(stopping) == 0:
+            spawn(index)
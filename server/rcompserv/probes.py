@@ -0,0 +1,145 @@
+"""Probing of the tools that implement commands
+
+Whether a tool is usable, and its version, is found by running it
+(cf. check functions in serv.py), which takes a while for some tools.
+Probes of all commands run concurrently, and results are cached in
+Redis per host together with the path and modification time of the
+executable, so processes on the same host, e.g., gunicorn workers,
+only run a probe again if the executable changed.
+
+Probes are repeated in the background, so a tool that is installed or
+upgraded while the server runs is picked up without a restart. This
+is cheap while the executable does not change.
+"""
+import asyncio
+import json
+import os
+import shutil
+import socket
+
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+
+PROBES_KEY_PREFIX = 'rcomp:probes:'
+
+# Duration (seconds) for which cached results are kept
+CACHE_TTL = 7*86400
+
+
+def probes_key():
+    """return key of the hash of cached results for this host"""
+    return PROBES_KEY_PREFIX + socket.gethostname()
+
+
+def locate(tool):
+    """return pair of path and modification time of executable `tool`.
+
+    if it is not found, return pair (None, None).
+    """
+    path = shutil.which(tool)
+    if path is None:
+        return None, None
+    try:
+        return path, os.stat(path).st_mtime
+    except OSError:
+        return None, None
+
+
+class Probe:
+    def __init__(self, name, check, tool=None):
+        """probe of command `name` by calling `check`.
+
+        `check` is as for Server.register_command(). `tool` is the
+        name of the executable that is run by `check`. If it is None,
+        then results are never reused.
+        """
+        self.name = name
+        self.check = check
+        self.tool = tool
+        self.result = None
+
+    @property
+    def available(self):
+        return self.result is not None and self.result['available']
+
+    @property
+    def version(self):
+        if self.result is None:
+            return None
+        return self.result['version']
+
+    def run(self, path=None, mtime=None):
+        """call check and return result as `dict`. This blocks."""
+        try:
+            found = self.check()
+        except Exception as e:
+            print('WARNING: probe of command {} failed: {}'.format(self.name, e))
+            found = False
+        return {
+            'available': bool(found),
+            'version': found if isinstance(found, str) else None,
+            'path': path,
+            'mtime': mtime
+        }
+
+
+async def probe_all(probes, redis=None):
+    """probe commands concurrently and update their results.
+
+    cached results are used if the executable has the same path and
+    modification time as when it was probed. If `redis` is None, then
+    results are not cached.
+
+    return list of probes whose availability or version changed.
+    """
+    loop = asyncio.get_running_loop()
+    cached = dict()
+    if redis is not None:
+        try:
+            cached = await redis.hgetall(probes_key())
+        except RedisConnectionError:
+            print('WARNING: failed to read cached probes')
+    located = await asyncio.gather(*[loop.run_in_executor(None, locate, probe.tool)
+                                     for probe in probes if probe.tool is not None])
+    located = iter(located)
+    results = dict()
+    running = []
+    for probe in probes:
+        path, mtime = (None, None) if probe.tool is None else next(located)
+        if probe.tool is not None:
+            result = cached.get(probe.name.encode('utf-8'))
+            if result is not None:
+                result = json.loads(result)
+                if result['path'] == path and result['mtime'] == mtime:
+                    results[probe] = result
+                    continue
+            if path is None:
+                # The tool is not installed, so there is nothing to run.
+                results[probe] = {'available': False, 'version': None,
+                                  'path': None, 'mtime': None}
+                continue
+        running.append(probe)
+        results[probe] = loop.run_in_executor(None, probe.run, path, mtime)
+    for probe in running:
+        results[probe] = await results[probe]
+
+    if redis is not None:
+        fresh = {probe.name: json.dumps(result) for probe, result in results.items()
+                 if probe.tool is not None}
+        if len(fresh) > 0:
+            try:
+                async with redis.pipeline(transaction=False) as pipe:
+                    pipe.hset(probes_key(), mapping=fresh)
+                    pipe.expire(probes_key(), CACHE_TTL)
+                    await pipe.execute()
+            except RedisConnectionError:
+                print('WARNING: failed to cache probes')
+
+    changed = []
+    for probe, result in results.items():
+        if (probe.result is None
+            or (probe.result['available'], probe.result['version'])
+               != (result['available'], result['version'])):
+            changed.append(probe)
+        probe.result = result
+    return changed
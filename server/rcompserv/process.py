@@ -0,0 +1,156 @@
+"""Subprocesses of jobs and their resource usage
+
+Subprocesses are started with pipes for stdout and stderr, which are
+read through asyncio streams, as with asyncio.create_subprocess_exec().
+Unlike those of asyncio, each subprocess is reaped by os.wait4() in a
+thread of its own, so its resource usage, e.g., peak RSS and CPU time,
+is known when it exits (cf. Process.usage()). asyncio only reaps
+subprocesses that it started, so it does not interfere.
+
+On Linux, the peak RSS from os.wait4() is at least that of the server
+when the subprocess was started, because it is kept through fork and
+exec. So the peak RSS of a subprocess that stays below it is instead
+read from /proc while the subprocess runs.
+"""
+import asyncio
+import os
+import resource
+import select
+import subprocess
+import sys
+import threading
+
+
+# Minimum and maximum intervals (seconds) between reads of peak RSS of
+# a running subprocess. Reads start at the minimum interval, which is
+# doubled after each read, so that short subprocesses are sampled.
+PEAK_RSS_MIN_INTERVAL = 0.01
+PEAK_RSS_MAX_INTERVAL = 1
+
+
+def read_peak_rss(pid):
+    """return peak RSS (bytes) of running process `pid` from /proc, or
+    None if it is not known, e.g., because the process exited.
+    """
+    try:
+        with open('/proc/{}/status'.format(pid), 'rb') as fp:
+            for line in fp:
+                if line.startswith(b'VmHWM:'):
+                    return int(line.split()[1])*1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class Process:
+    def __init__(self, popen, stdout, stderr, inherited_rss=0):
+        """subprocess `popen` (a subprocess.Popen) and StreamReader
+        objects of its stdout and stderr. This starts its reaper.
+
+        `inherited_rss` is the peak RSS (bytes) that the subprocess
+        inherited from this process (cf. start()).
+        """
+        self.pid = popen.pid
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+        self.rusage = None
+        self._popen = popen
+        self._inherited_rss = inherited_rss
+        self._peak_rss = None
+        loop = asyncio.get_running_loop()
+        self._exited = loop.create_future()
+        threading.Thread(target=self._reap, args=(loop,), daemon=True).start()
+
+    def _reap(self, loop):
+        self._watch_peak_rss()
+        _, status, rusage = os.wait4(self.pid, 0)
+        try:
+            loop.call_soon_threadsafe(self._set_exited, os.waitstatus_to_exitcode(status), rusage)
+        except RuntimeError:
+            # The event loop was closed.
+            pass
+
+    def _watch_peak_rss(self):
+        """read peak RSS of the process until it exits, if the platform
+        has /proc and pidfd_open().
+        """
+        if self._inherited_rss == 0:
+            return
+        try:
+            pidfd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError):
+            return
+        try:
+            poller = select.poll()
+            poller.register(pidfd, select.POLLIN)
+            interval = PEAK_RSS_MIN_INTERVAL
+            while True:
+                # The peak only grows, so it is read again until exit.
+                peak_rss = read_peak_rss(self.pid)
+                if peak_rss is not None:
+                    self._peak_rss = peak_rss
+                if len(poller.poll(1000*interval)) > 0:
+                    break
+                interval = min(2*interval, PEAK_RSS_MAX_INTERVAL)
+        finally:
+            os.close(pidfd)
+
+    def _set_exited(self, returncode, rusage):
+        self.returncode = returncode
+        self.rusage = rusage
+        # The process was reaped, so Popen must not wait for it.
+        self._popen.returncode = returncode
+        self._exited.set_result(returncode)
+
+    async def wait(self):
+        """wait until the process exits and return its exit code"""
+        return await asyncio.shield(self._exited)
+
+    def usage(self):
+        """return `dict` of peak RSS (bytes) and CPU time (seconds) of the
+        process, which must have exited.
+
+        the peak RSS is None if it is below the peak RSS that the
+        process inherited and the process exited before it was read.
+        """
+        max_rss = self.rusage.ru_maxrss*_RSS_SCALE
+        if max_rss <= self._inherited_rss:
+            max_rss = self._peak_rss
+        return {'max_rss_bytes': max_rss,
+                'user_seconds': self.rusage.ru_utime,
+                'system_seconds': self.rusage.ru_stime}
+
+
+# ru_maxrss is in KiB, except on macOS, where it is in bytes.
+_RSS_SCALE = 1 if sys.platform == 'darwin' else 1024
+
+
+async def _reader(pipe):
+    reader = asyncio.StreamReader()
+    await asyncio.get_running_loop().connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    return reader
+
+
+async def start(cmd, pass_fds=()):
+    """start `cmd` in a new session and return Process.
+
+    the session makes the process the leader of a process group,
+    which can be killed together with all processes that it starts.
+    """
+    popen = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             pass_fds=pass_fds, start_new_session=True)
+    inherited_rss = 0
+    if sys.platform.startswith('linux'):
+        # Peak RSS of this process only grows, so this bounds the peak
+        # that the subprocess inherited.
+        inherited_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*_RSS_SCALE
+    try:
+        stdout = await _reader(popen.stdout)
+        stderr = await _reader(popen.stderr)
+    except BaseException:
+        popen.kill()
+        popen.wait()
+        raise
+    return Process(popen, stdout, stderr, inherited_rss=inherited_rss)
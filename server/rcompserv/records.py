@@ -0,0 +1,105 @@
+"""Layout of job records in Redis
+
+The record of a job is a hash that has the job ID as its key. Output
+of the job is kept in separate strings, so that it can be appended
+while the job runs and copied among keys without passing through
+rcomp server processes.
+
+Output of a finished job can be compressed, in which case the field
+`output_codec` of its record is set (cf. retention.py). Records of
+finished jobs have fields `output_size` and `output_digest` (SHA-256)
+of the output, which are sent to clients instead of the output unless
+they ask for it (cf. output_summary()). The trace of a job is a
+separate hash (cf. trace.py).
+"""
+import hashlib
+import zlib
+
+
+def output_key(job_id):
+    return job_id + ':output'
+
+def stderr_key(job_id):
+    return job_id + ':stderr'
+
+def trace_key(job_id):
+    return job_id + ':trace'
+
+
+def decode_output(record, output):
+    """return output as stored for job with `record` (from read()), decompressed"""
+    if output is not None and record.get('output_codec') == b'zlib':
+        return zlib.decompress(output)
+    return output
+
+
+def output_summary(output):
+    """return fields `output_size` and `output_digest` for `output`"""
+    return {'output_size': len(output),
+            'output_digest': hashlib.sha256(output).hexdigest()}
+
+
+# Read a job record and, only if the job is done, its output, in one
+# round trip. If ARGV[1] is positive, then the TTL of a job that is
+# done is reset to it. Output is only read if ARGV[2] is 1 or the
+# record does not have a digest of it, in which case false is returned
+# in its place. If the job has a trace, then the event ARGV[3] is
+# recorded in it unless the job was read before.
+_READ_SCRIPT = """
+local record = redis.call('HGETALL', KEYS[1])
+if #record == 0 then
+  return {}
+end
+if redis.call('HGET', KEYS[1], 'done') == '0' then
+  return {record}
+end
+local ttl = tonumber(ARGV[1])
+if ttl > 0 then
+  for i = 1, 4 do
+    redis.call('EXPIRE', KEYS[i], ttl)
+  end
+end
+if ARGV[3] ~= '' and redis.call('EXISTS', KEYS[4]) == 1 then
+  redis.call('HSETNX', KEYS[4], 'first_read', ARGV[3])
+end
+local output = false
+if ARGV[2] == '1' or redis.call('HEXISTS', KEYS[1], 'output_digest') == 0 then
+  output = redis.call('GET', KEYS[2])
+end
+return {record, output, redis.call('GET', KEYS[3])}
+"""
+
+
+async def read(redis, job_ids, ttl=None, output=True, first_read=None):
+    """read records of jobs with one pipelined call.
+
+    if `ttl` is given, then it is the new TTL of jobs that are done.
+    If `output` is False, then output is only read for jobs whose
+    records do not have its digest. If `first_read` is given, then
+    it is the JSON of the event that is recorded in traces of jobs
+    that are done when they are first read (cf. trace.FIRST_READ).
+
+    return list with one element per job ID, each of which is None if
+    the job is not known, or a triple of the record as a `dict` with
+    `str` keys, output, and stderr. Output and stderr are None if the
+    job is not done, they do not exist, or output was not read.
+    """
+    script = redis.register_script(_READ_SCRIPT)
+    async with redis.pipeline(transaction=False) as pipe:
+        for job_id in job_ids:
+            await script(keys=[job_id, output_key(job_id), stderr_key(job_id),
+                               trace_key(job_id)],
+                         args=[ttl or 0, int(output), first_read or ''], client=pipe)
+        replies = await pipe.execute()
+    jobs = []
+    for reply in replies:
+        if len(reply) == 0:
+            jobs.append(None)
+            continue
+        fields = reply[0]
+        record = {str(fields[ii], encoding='utf-8'): fields[ii+1]
+                  for ii in range(0, len(fields), 2)}
+        output = decode_output(record, reply[1] if len(reply) > 1 else None)
+        stderr = reply[2] if len(reply) > 2 else None
+        jobs.append((record, output, stderr))
+    return jobs
@@ -0,0 +1,272 @@
+"""Content-addressed cache of job results and deduplication of jobs
+
+Results are keyed by a digest of the command, its arguments, the
+decompressed contents of input files, and the version of the tool. If
+a job with the same digest is already running, then a new job is
+attached to it instead of starting another process, and the result of
+the running job is copied to all attached jobs when it finishes.
+
+A claim of a running job expires after a short TTL unless the process
+that runs or queued the job refreshes it (cf. ResultCache.start()), so
+if that process dies, identical jobs start again instead of waiting
+for it. Jobs that were attached to the lost job are attached to the
+next job that claims the same digest.
+"""
+import asyncio
+import hashlib
+import json
+import time
+
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from . import events
+from . import records
+
+
+RESULT_PREFIX = 'rcomp:result:'
+INDEX_KEY = 'rcomp:results'
+SIZES_KEY = 'rcomp:results:size'
+BYTES_KEY = 'rcomp:results:bytes'
+INFLIGHT_PREFIX = 'rcomp:inflight:'
+
+# Only deterministic outcomes are stored.
+CACHEABLE_STATUS = ('success', 'error (nonzero exitcode)')
+
+# Extend the TTL of claim KEYS[1] to ARGV[2] if job ARGV[1] holds it,
+# and return whether it does.
+_REFRESH_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+  return 0
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def job_digest(command, argv, file_digests, version):
+    """return hex digest identifying a job.
+
+    `file_digests` is a `dict` that maps indices of `argv` to SHA-256
+    digests of decompressed file contents. Those elements of `argv`
+    are ignored, so that the digest does not depend on the way files
+    were encoded or on local paths.
+    """
+    normalized = [('file' if ii in file_digests else arg) for ii, arg in enumerate(argv)]
+    h = hashlib.sha256()
+    h.update(json.dumps([command, version, normalized]).encode('utf-8'))
+    for ii in sorted(file_digests):
+        h.update(file_digests[ii])
+    return h.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, ttl=86400, max_bytes=64*2**20, max_entry_bytes=2**20, inflight_ttl=60):
+        """
+        `ttl` is the duration (seconds) for which a result is kept
+        after it was last used. `max_bytes` bounds the total size of
+        outputs in the cache; if it is exceeded, then least recently
+        used results are evicted first. Results with output larger than
+        `max_entry_bytes` are not cached.
+
+        `inflight_ttl` is the TTL (seconds) of claims of running jobs,
+        which are refreshed every third of it while this process holds
+        them, so it bounds the duration for which later jobs can be
+        attached to a running job after the running job is lost.
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.inflight_ttl = inflight_ttl
+        self._claims = dict()
+        self._refresher = None
+
+    async def start(self, redis):
+        self._refresher = asyncio.ensure_future(self._refresh_periodically(redis))
+
+    async def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+
+    async def _refresh_periodically(self, redis):
+        while True:
+            await asyncio.sleep(self.inflight_ttl/3)
+            try:
+                await self.refresh(redis)
+            except RedisConnectionError:
+                print('WARNING: failed to refresh claims of running jobs; retrying')
+
+    def hold(self, digest, job_id):
+        """refresh the claim of job `job_id` for `digest` in this process,
+        e.g., after a worker took the job from the queue.
+        """
+        self._claims[digest] = job_id
+
+    async def refresh(self, redis):
+        """extend claims of jobs that this process holds, and forget
+        those that were completed or lost.
+        """
+        claims = list(self._claims.items())
+        if len(claims) == 0:
+            return
+        script = redis.register_script(_REFRESH_SCRIPT)
+        async with redis.pipeline(transaction=False) as pipe:
+            for digest, job_id in claims:
+                await script(keys=[INFLIGHT_PREFIX + digest],
+                             args=[job_id, self.inflight_ttl], client=pipe)
+            held = await pipe.execute()
+        for (digest, job_id), is_held in zip(claims, held):
+            if not is_held and self._claims.get(digest) == job_id:
+                del self._claims[digest]
+
+    async def restore(self, redis, digest, job_id):
+        """copy cached output to job and return cached result as `dict`.
+
+        return None if nothing is cached for `digest`.
+        """
+        key = RESULT_PREFIX + digest
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hgetall(key)
+            pipe.copy(records.output_key(key), records.output_key(job_id), replace=True)
+            pipe.copy(records.stderr_key(key), records.stderr_key(job_id), replace=True)
+            for k in (key, records.output_key(key), records.stderr_key(key)):
+                pipe.expire(k, self.ttl)
+            pipe.zadd(INDEX_KEY, {digest: time.time()}, xx=True)
+            result = (await pipe.execute())[0]
+        if len(result) == 0:
+            return None
+        return {str(k, encoding='utf-8'): v for k, v in result.items()}
+
+    async def put(self, redis, digest, job_id, result):
+        """store `result` (a `dict` with fields exitcode and status)
+        together with output of the job `job_id`.
+        """
+        if result['status'] not in CACHEABLE_STATUS:
+            return
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.strlen(records.output_key(job_id))
+            pipe.strlen(records.stderr_key(job_id))
+            size = sum(await pipe.execute())
+        if size > self.max_entry_bytes:
+            return
+        key = RESULT_PREFIX + digest
+        fields = {
+            'exitcode': result['exitcode'],
+            'status': result['status']
+        }
+        for field in ('output_size', 'output_digest'):
+            if field in result:
+                fields[field] = result[field]
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hget(SIZES_KEY, digest)
+            pipe.hset(key, mapping=fields)
+            pipe.copy(records.output_key(job_id), records.output_key(key), replace=True)
+            pipe.copy(records.stderr_key(job_id), records.stderr_key(key), replace=True)
+            for k in (key, records.output_key(key), records.stderr_key(key)):
+                pipe.expire(k, self.ttl)
+            pipe.zadd(INDEX_KEY, {digest: time.time()})
+            pipe.hset(SIZES_KEY, digest, size)
+            pipe.incrby(BYTES_KEY, size)
+            previous_size = (await pipe.execute())[0]
+        if previous_size is not None:
+            await redis.decrby(BYTES_KEY, int(previous_size))
+        await self.evict(redis)
+
+    async def evict(self, redis):
+        """remove expired entries from the index, then least recently
+        used entries until the total size is within the bound.
+        """
+        expired = await redis.zrangebyscore(INDEX_KEY, '-inf', time.time() - self.ttl)
+        for digest in expired:
+            await self._remove(redis, digest)
+        while int(await redis.get(BYTES_KEY) or 0) > self.max_bytes:
+            oldest = await redis.zrange(INDEX_KEY, 0, 0)
+            if len(oldest) == 0:
+                await redis.set(BYTES_KEY, 0)
+                break
+            await self._remove(redis, oldest[0])
+
+    async def _remove(self, redis, digest):
+        if isinstance(digest, bytes):
+            digest = str(digest, encoding='utf-8')
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hget(SIZES_KEY, digest)
+            pipe.zrem(INDEX_KEY, digest)
+            pipe.hdel(SIZES_KEY, digest)
+            pipe.delete(RESULT_PREFIX + digest,
+                        records.output_key(RESULT_PREFIX + digest),
+                        records.stderr_key(RESULT_PREFIX + digest))
+            size, removed, _, _ = await pipe.execute()
+        if removed and size is not None:
+            await redis.decrby(BYTES_KEY, int(size))
+
+    async def claim(self, redis, digest, job_id):
+        """try to become the job that computes the result for `digest`.
+
+        return None if `job_id` claimed it. Otherwise, `job_id` is
+        attached to the running job, and its ID is returned.
+        """
+        key = INFLIGHT_PREFIX + digest
+        if await redis.set(key, job_id, nx=True, ex=self.inflight_ttl):
+            self.hold(digest, job_id)
+            return None
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.get(key)
+            pipe.rpush(key + ':attached', job_id)
+            leader, _ = await pipe.execute()
+        if leader is None:
+            # The running job finished after our attempt to claim, so
+            # nobody would copy a result to this job.
+            await redis.lrem(key + ':attached', 0, job_id)
+            if await redis.set(key, job_id, nx=True, ex=self.inflight_ttl):
+                self.hold(digest, job_id)
+                return None
+            return await self.claim(redis, digest, job_id)
+        return str(leader, encoding='utf-8')
+
+    async def is_shared(self, redis, digest, job_id):
+        """return whether other jobs are attached to running job `job_id`"""
+        key = INFLIGHT_PREFIX + digest
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.get(key)
+            pipe.llen(key + ':attached')
+            leader, attached = await pipe.execute()
+        return leader is not None and str(leader, encoding='utf-8') == job_id and attached > 0
+
+    async def detach(self, redis, digest, job_id):
+        """stop copying the result for `digest` to job `job_id`.
+
+        return whether it was attached.
+        """
+        return await redis.lrem(INFLIGHT_PREFIX + digest + ':attached', 0, job_id) > 0
+
+    async def complete(self, redis, digest, job_id, result):
+        """store result of job `job_id` and copy it to attached jobs.
+
+        return list of IDs of attached jobs.
+        """
+        if self._claims.get(digest) == job_id:
+            del self._claims[digest]
+        await self.put(redis, digest, job_id, result)
+        key = INFLIGHT_PREFIX + digest
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.lrange(key + ':attached', 0, -1)
+            pipe.delete(key + ':attached')
+            _, attached, _ = await pipe.execute()
+        attached = [str(attached_id, encoding='utf-8') for attached_id in attached]
+        if len(attached) > 0:
+            async with redis.pipeline(transaction=False) as pipe:
+                for attached_id in attached:
+                    pipe.copy(records.output_key(job_id), records.output_key(attached_id),
+                              replace=True)
+                    pipe.copy(records.stderr_key(job_id), records.stderr_key(attached_id),
+                              replace=True)
+                    pipe.hset(attached_id, mapping=dict(result, cache='shared'))
+                    pipe.publish(events.channel(attached_id), result['state'])
+                await pipe.execute()
+        return attached
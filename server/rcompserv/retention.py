@@ -0,0 +1,160 @@
+"""Expiry of finished jobs and a bound on the memory that they use
+
+When a job is done, its record and output get a TTL, which is reset
+whenever the status of the job is read. Output that is larger than a
+threshold is stored compressed, as indicated by the field
+`output_codec` of the job record (cf. records.decode_output()).
+
+Finished jobs are indexed by the time at which they finished, together
+with the size of their output. A sweeper removes expired jobs from the
+index and, if the total size exceeds a budget, evicts the jobs that
+finished first. Counts of reclaimed bytes are kept in the hash
+STATS_KEY.
+"""
+import asyncio
+import time
+import zlib
+
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from . import records
+
+
+FINISHED_KEY = 'rcomp:finished'
+SIZES_KEY = 'rcomp:finished:size'
+BYTES_KEY = 'rcomp:finished:bytes'
+STATS_KEY = 'rcomp:retention'
+
+
+class Retention:
+    def __init__(self, ttl=7*86400, compress_threshold=65536, max_bytes=256*2**20,
+                 sweep_interval=60):
+        """
+        `ttl` is the duration (seconds) for which a finished job is
+        kept after it finished or its status was last read. If None,
+        then jobs do not expire.
+
+        outputs larger than `compress_threshold` bytes are compressed.
+        If None, then outputs are never compressed.
+
+        `max_bytes` bounds the total size of outputs of finished jobs.
+        If None, then only the TTL applies. The bound is enforced by
+        the sweeper every `sweep_interval` seconds, so it can be
+        exceeded briefly.
+        """
+        self.ttl = ttl
+        self.compress_threshold = compress_threshold
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._sweeper = None
+
+    async def finish(self, redis, job_id):
+        """compress output of job if it is large, set TTL, and index the job"""
+        out_key = records.output_key(job_id)
+        err_key = records.stderr_key(job_id)
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.strlen(out_key)
+            pipe.strlen(err_key)
+            pipe.hexists(job_id, 'output_codec')
+            size, stderr_size, is_compressed = await pipe.execute()
+        compressed = None
+        # Output that was copied from another job can be compressed already.
+        if (self.compress_threshold is not None and size > self.compress_threshold
+            and not is_compressed):
+            output = await redis.get(out_key)
+            compressed = await asyncio.get_running_loop().run_in_executor(
+                None, zlib.compress, output)
+            if len(compressed) >= len(output):
+                compressed = None
+        async with redis.pipeline(transaction=True) as pipe:
+            if compressed is not None:
+                pipe.set(out_key, compressed)
+                pipe.hset(job_id, 'output_codec', 'zlib')
+                pipe.hincrby(STATS_KEY, 'compressed_bytes', size - len(compressed))
+                size = len(compressed)
+            if self.ttl is not None:
+                for key in (job_id, out_key, err_key, records.trace_key(job_id)):
+                    pipe.expire(key, self.ttl)
+            pipe.zadd(FINISHED_KEY, {job_id: time.time()})
+            pipe.hset(SIZES_KEY, job_id, size + stderr_size)
+            pipe.incrby(BYTES_KEY, size + stderr_size)
+            await pipe.execute()
+
+    async def sweep(self, redis):
+        """forget expired jobs, then evict jobs until within the budget"""
+        if self.ttl is not None:
+            # Jobs that were read recently still exist.
+            candidates = await redis.zrangebyscore(FINISHED_KEY, '-inf', time.time() - self.ttl)
+            if len(candidates) > 0:
+                async with redis.pipeline(transaction=False) as pipe:
+                    for job_id in candidates:
+                        pipe.exists(job_id)
+                    exists = await pipe.execute()
+                expired = [job_id for job_id, e in zip(candidates, exists) if not e]
+                if len(expired) > 0:
+                    await self._forget(redis, expired, 'expired')
+        if self.max_bytes is not None:
+            while int(await redis.get(BYTES_KEY) or 0) > self.max_bytes:
+                oldest = await redis.zpopmin(FINISHED_KEY)
+                if len(oldest) == 0:
+                    await redis.set(BYTES_KEY, 0)
+                    break
+                await self._forget(redis, [job_id for job_id, _ in oldest], 'evicted',
+                                   delete=True)
+
+    async def _forget(self, redis, job_ids, reason, delete=False):
+        job_ids = [(str(job_id, encoding='utf-8') if isinstance(job_id, bytes) else job_id)
+                   for job_id in job_ids]
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hmget(SIZES_KEY, job_ids)
+            pipe.zrem(FINISHED_KEY, *job_ids)
+            pipe.hdel(SIZES_KEY, *job_ids)
+            if delete:
+                for job_id in job_ids:
+                    pipe.delete(job_id, records.output_key(job_id), records.stderr_key(job_id),
+                                records.trace_key(job_id))
+            sizes = (await pipe.execute())[0]
+        size = sum(int(s) for s in sizes if s is not None)
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.decrby(BYTES_KEY, size)
+            pipe.hincrby(STATS_KEY, reason + '_bytes', size)
+            pipe.hincrby(STATS_KEY, reason + '_jobs', len(job_ids))
+            await pipe.execute()
+
+    async def stats(self, redis):
+        """return `dict` with size of finished jobs and reclaimed bytes"""
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zcard(FINISHED_KEY)
+            pipe.get(BYTES_KEY)
+            pipe.hgetall(STATS_KEY)
+            jobs, size, counters = await pipe.execute()
+        stats = {
+            'ttl': self.ttl,
+            'max_bytes': self.max_bytes,
+            'jobs': jobs,
+            'bytes': int(size or 0)
+        }
+        for name in ('compressed_bytes', 'expired_bytes', 'expired_jobs',
+                     'evicted_bytes', 'evicted_jobs'):
+            stats[name] = int(counters.get(name.encode('utf-8'), 0))
+        return stats
+
+    async def start(self, redis):
+        self._sweeper = asyncio.ensure_future(self._sweep_periodically(redis))
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    async def _sweep_periodically(self, redis):
+        while True:
+            try:
+                await self.sweep(redis)
+            except RedisConnectionError:
+                print('WARNING: failed to sweep finished jobs; retrying')
+            await asyncio.sleep(self.sweep_interval)
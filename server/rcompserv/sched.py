@@ -0,0 +1,256 @@
+"""Bounded scheduling of jobs that run as local subprocesses
+
+Queued jobs are started in order of weighted fair queuing across
+clients (start-time fair queuing): each client has a virtual finish
+time that advances by the reciprocal of its weight whenever one of
+its jobs starts, and the client whose next job has the smallest
+virtual start time goes first. So a client that submits many jobs at
+once does not delay clients that submit few.
+Among jobs of one client, those with higher priority start first.
+"""
+import asyncio
+import collections
+import heapq
+import itertools
+import os
+
+
+class QueueFull(Exception):
+    """raised when a job cannot be admitted because the queue is full"""
+    pass
+
+
+class Scheduler:
+    def __init__(self, max_jobs=None, max_jobs_per_command=None, max_queue=64,
+                 max_jobs_per_client=None, client_weights=None):
+        """limit concurrently running jobs and queue the remainder.
+
+        `max_jobs` is the maximum number of jobs running at once
+        (summed over all commands). If it is not given, the number of
+        CPUs on the host is used.
+
+        `max_jobs_per_command` is a `dict` that maps command names to
+        the maximum number of running jobs of that command. Commands
+        not in the `dict` are only limited by `max_jobs`.
+
+        `max_queue` is the maximum number of jobs that wait to be
+        started. If it is None, then the queue is unbounded.
+
+        `max_jobs_per_client` is the maximum number of running jobs of
+        each client. If it is None, then clients are only limited by
+        `max_jobs`. `client_weights` is a `dict` that maps clients to
+        their weights in fair queuing; the default weight is 1.
+
+        N.B., limits apply per Scheduler object, i.e., per process.
+        """
+        if max_jobs is None:
+            max_jobs = os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        if max_jobs_per_command is None:
+            max_jobs_per_command = dict()
+        self.max_jobs_per_command = max_jobs_per_command
+        self.max_queue = max_queue
+        self.max_jobs_per_client = max_jobs_per_client
+        if client_weights is None:
+            client_weights = dict()
+        self.client_weights = client_weights
+        # Each client has a heap of (-priority, sequence number, job ID).
+        self._pending = dict()
+        self._pending_jobs = dict()
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._finish_times = dict()
+        self._running = dict()
+        self._running_per_command = collections.Counter()
+        self._running_per_client = collections.Counter()
+        self._capacity = asyncio.Event()
+
+    def _can_start(self, command, client):
+        if len(self._running) >= self.max_jobs:
+            return False
+        if (self.max_jobs_per_client is not None
+            and self._running_per_client[client] >= self.max_jobs_per_client):
+            return False
+        if command in self.max_jobs_per_command:
+            return self._running_per_command[command] < self.max_jobs_per_command[command]
+        return True
+
+    def is_full(self):
+        return (self.max_queue is not None
+                and len(self._pending_jobs) >= self.max_queue)
+
+    def submit(self, job_id, command, start, client=None, priority=0):
+        """submit job to be started when capacity is available.
+
+        `start` is a coroutine function that is called with no
+        arguments to start the job. The job is considered to be
+        running until the coroutine returns.
+
+        `client` identifies the submitter for fair queuing, and jobs
+        of the same client with greater `priority` start first.
+
+        return position of the job in the queue, where 0 indicates
+        that the job was started immediately.
+
+        raise QueueFull if the job cannot be queued.
+        """
+        if self.is_full():
+            raise QueueFull()
+        self._pending_jobs[job_id] = (command, start, client)
+        heapq.heappush(self._pending.setdefault(client, []),
+                       (-priority, next(self._sequence), job_id))
+        self._dispatch()
+        return self.position(job_id)
+
+    def cancel(self, job_id):
+        """remove job from the queue.
+
+        return the coroutine function that was given to submit(), or
+        None if the job is not queued, e.g., because it is running.
+        """
+        if job_id not in self._pending_jobs:
+            return None
+        command, start, client = self._pending_jobs.pop(job_id)
+        heap = self._pending[client]
+        heap[:] = [entry for entry in heap if entry[2] != job_id]
+        heapq.heapify(heap)
+        if len(heap) == 0:
+            del self._pending[client]
+        self._capacity.set()
+        return start
+
+    def _start_time(self, client, virtual_time=None, finish_times=None):
+        if virtual_time is None:
+            virtual_time = self._virtual_time
+        if finish_times is None:
+            finish_times = self._finish_times
+        return max(virtual_time, finish_times.get(client, 0.0))
+
+    def _started(self, client, start_time, finish_times):
+        finish_times[client] = start_time + 1.0/self.client_weights.get(client, 1)
+
+    def _order(self):
+        """return IDs of pending jobs in the order in which they would
+        start if there were no limits
+        """
+        heaps = {client: sorted(heap) for client, heap in self._pending.items()}
+        finish_times = dict(self._finish_times)
+        virtual_time = self._virtual_time
+        order = []
+        while len(heaps) > 0:
+            client = min(heaps, key=lambda c: (
+                self._start_time(c, virtual_time, finish_times),
+                heaps[c][0][1]
+            ))
+            virtual_time = self._start_time(client, virtual_time, finish_times)
+            self._started(client, virtual_time, finish_times)
+            order.append(heaps[client].pop(0)[2])
+            if len(heaps[client]) == 0:
+                del heaps[client]
+        return order
+
+    def position(self, job_id):
+        """return 1-based position of job in queue.
+
+        if the job is running or not known, return 0 or None,
+        respectively.
+        """
+        return self.positions([job_id])[0]
+
+    def positions(self, job_ids):
+        """return list of positions as from position(), one per job ID"""
+        order = None
+        positions = []
+        for job_id in job_ids:
+            if job_id in self._running:
+                positions.append(0)
+            elif job_id not in self._pending_jobs:
+                positions.append(None)
+            else:
+                if order is None:
+                    order = {pending_id: ii + 1 for ii, pending_id in enumerate(self._order())}
+                positions.append(order[job_id])
+        return positions
+
+    def job_ids(self):
+        """return list of IDs of jobs that are queued or running"""
+        return list(self._pending_jobs) + list(self._running)
+
+    def running(self, command=None):
+        """return number of running jobs, optionally of only `command`"""
+        if command is None:
+            return len(self._running)
+        return self._running_per_command[command]
+
+    def pending(self):
+        """return number of queued jobs"""
+        return len(self._pending_jobs)
+
+    def share(self, client):
+        """return `dict` with numbers of running and queued jobs of
+        `client`, and the fraction of all running jobs that are its.
+        """
+        running = self._running_per_client[client]
+        return {
+            'running': running,
+            'queued': len(self._pending.get(client, [])),
+            'share': running / max(1, len(self._running)),
+            'weight': self.client_weights.get(client, 1)
+        }
+
+    async def wait_for_capacity(self):
+        """wait until a newly submitted job would start immediately"""
+        while len(self._pending_jobs) > 0 or len(self._running) >= self.max_jobs:
+            self._capacity.clear()
+            await self._capacity.wait()
+
+    async def join(self):
+        """wait until no jobs are running or queued"""
+        while len(self._pending_jobs) > 0 or len(self._running) > 0:
+            self._capacity.clear()
+            await self._capacity.wait()
+
+    def _dispatch(self):
+        while len(self._running) < self.max_jobs:
+            # Among clients that have a job that can start, choose the
+            # one with the smallest virtual start time. Within a client,
+            # a command that is at its limit does not block jobs of
+            # other commands behind it.
+            best = None
+            for client, heap in self._pending.items():
+                for entry in sorted(heap):
+                    command = self._pending_jobs[entry[2]][0]
+                    if self._can_start(command, client):
+                        key = (self._start_time(client), entry[1])
+                        if best is None or key < best[0]:
+                            best = (key, client, entry)
+                        break
+            if best is None:
+                break
+            (start_time, _), client, entry = best
+            self._virtual_time = start_time
+            self._started(client, start_time, self._finish_times)
+            heap = self._pending[client]
+            heap.remove(entry)
+            heapq.heapify(heap)
+            if len(heap) == 0:
+                del self._pending[client]
+            job_id = entry[2]
+            command, start, client = self._pending_jobs.pop(job_id)
+            self._running_per_command[command] += 1
+            self._running_per_client[client] += 1
+            task = asyncio.ensure_future(start())
+            self._running[job_id] = (command, client, task)
+            task.add_done_callback(lambda t, job_id=job_id: self._finished(job_id))
+
+    def _finished(self, job_id):
+        command, client, task = self._running.pop(job_id)
+        self._running_per_command[command] -= 1
+        self._running_per_client[client] -= 1
+        if self._running_per_client[client] == 0:
+            del self._running_per_client[client]
+            if client not in self._pending:
+                # Idle clients do not keep credit or debt.
+                self._finish_times.pop(client, None)
+        self._dispatch()
+        self._capacity.set()
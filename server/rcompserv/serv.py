@@ -1,18 +1,134 @@
 import asyncio
+import concurrent.futures
 from datetime import datetime
 import base64
+import hashlib
 import json
 import os
 import os.path
+import re
+import shutil
+import signal
 import subprocess
-import tempfile
 import uuid
 import zlib
 
 from aiohttp import web
-import redis
+import redis.asyncio as aioredis
+from redis.exceptions import ConnectionError as RedisConnectionError
 
 from . import __version__
+from . import compression
+from . import events
+from . import jobqueue
+from . import metrics
+from . import probes
+from . import process
+from . import records
+from . import staging
+from . import trace
+from .resultcache import ResultCache, job_digest
+from .retention import Retention
+from .sched import Scheduler, QueueFull
+
+
+TOOLS_KEY = 'rcomp:tools'
+
+# Result of jobs that were cancelled
+CANCELLED = {
+    'status': 'cancelled',
+    'exitcode': 1,
+    'state': 'done',
+    'done': 1
+}
+
+# Result of steps of pipelines that are skipped because a step that
+# they depend on did not succeed
+SKIPPED = {
+    'status': 'skipped (dependency failed)',
+    'exitcode': 1,
+    'state': 'done',
+    'done': 1
+}
+
+# Maximum duration (seconds) for which a request to cancel a running
+# job waits until the job is done
+CANCEL_WAIT = 5
+
+# Names of steps of pipelines, which are part of the IDs of their jobs
+STEP_NAME = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# Stands in for outputs of earlier steps in argv of a step, so that
+# file_indices() applies
+STEP_OUTPUT = 'step-output'
+
+# Single range of bytes in header Range
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Responses with larger bodies are compressed in the default executor.
+EXECUTOR_COMPRESS_SIZE = 2**16
+
+# Maximum duration (seconds) for which calls to Redis wait for a
+# connection of the pool
+REDIS_POOL_TIMEOUT = 10
+
+# Files in argv of jobs are decoded on the event loop until they are
+# larger in total (bytes, decompressed), and then in the staging pool.
+INLINE_DECODE_SIZE = 2**16
+
+# Duration (seconds) between measurements of the lag of the event loop
+LAG_INTERVAL = 0.5
+
+# Lag (seconds) of the event loop beyond which a warning is printed
+LAG_WARNING = 1
+
+
+def parse_byte_range(header, size):
+    """return pair (start, stop) of bytes in header Range of content
+    that has `size` bytes.
+
+    return None if the header is not a single range of bytes, in which
+    case the whole content is sent, and raise ValueError if the range
+    is not satisfiable.
+    """
+    match = BYTE_RANGE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first == '':
+        if last == '':
+            return None
+        start, stop = max(size - int(last), 0), size
+    else:
+        start = int(first)
+        if last == '':
+            stop = size
+        elif int(last) < start:
+            return None
+        else:
+            stop = min(int(last) + 1, size)
+    if start >= stop:
+        raise ValueError('range not satisfiable')
+    return start, stop
+
+
+def etag_matches(header, digest):
+    """return whether header If-None-Match matches output with `digest`,
+    including any content coding of it (cf. Server.compress_response()).
+    """
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        for encoding in compression.RESPONSE_ENCODINGS:
+            if tag.endswith('-' + encoding):
+                tag = tag[:-len(encoding)-1]
+        if tag == digest:
+            return True
+    return False
 
 
 def check_date():
@@ -36,7 +152,7 @@ def check_gr1c():
     parts = v[:endofline].split()
     if len(parts) != 2 or parts[0] != 'gr1c':
         return False
-    return True
+    return v[:endofline]
 
 def check_ltl2ba():
     try:
@@ -45,19 +161,294 @@ def check_ltl2ba():
         return False
     if not h.startswith('never {'):
         return False
-    return True
+    # LTL2BA does not report a version number, so identify the
+    # executable by its modification time instead.
+    path = shutil.which('ltl2ba')
+    return 'ltl2ba {}'.format(int(os.stat(path).st_mtime) if path else '')
+
+
+def file_indices(command, argv):
+    """return indices of elements of argv that are encoded files"""
+    indices = []
+    if command == 'ltl2ba':
+        start = 0
+        while True:
+            try:
+                start = argv.index('-F', start) + 1
+            except ValueError:
+                break
+            if start < len(argv):
+                indices.append(start)
+    elif command == 'gr1c':
+        all_files = False
+        for ii in range(len(argv)):
+            if argv[ii] == '--':
+                all_files = True
+            elif all_files or argv[ii][0] != '-':
+                indices.append(ii)
+    return indices
+
+def check_argv(argv):
+    """raise ValueError unless `argv` is a list of nonempty strings,
+    as expected by file_indices().
+    """
+    if (not isinstance(argv, list)
+        or not all(isinstance(arg, str) and len(arg) > 0 for arg in argv)):
+        raise ValueError('argv must be a list of nonempty strings')
+
+def parse_priority(payload):
+    """return priority of job from request payload, default 0"""
+    priority = payload.get('priority', 0)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        return 0
+    return priority
+
+def parse_variants(command, argv, payload, max_variants):
+    """return variants of job from request payload, or None if not a race.
+
+    `variants` is a list of lists of options, each of which is placed
+    before `argv` to form one variant. Options cannot be files, so
+    that all variants share the files in `argv`.
+
+    raise ValueError if the variants are malformed.
+    """
+    variants = payload.get('variants')
+    if variants is None:
+        return None
+    if (not isinstance(variants, list)
+        or not 2 <= len(variants) <= max_variants):
+        raise ValueError('variants must be a list of 2 to {} lists of options'.format(max_variants))
+    indices = file_indices(command, argv)
+    for options in variants:
+        if (not isinstance(options, list)
+            or not all(isinstance(option, str) and len(option) > 0 for option in options)):
+            raise ValueError('variants must be lists of options')
+        if file_indices(command, options + argv) != [len(options) + ii for ii in indices]:
+            raise ValueError('variants cannot contain files')
+    return variants
+
+def parse_pipeline(payload, commands, max_steps):
+    """return steps of pipeline from request payload.
+
+    `steps` is a list of objects with fields `name`, `command` (one of
+    `commands`), `argv`, and optionally `timeout`. Files in argv are
+    encoded as in requests to individual commands, except that an
+    element of argv that is an object {"step": NAME} is a file whose
+    contents are the output of the earlier step NAME.
+
+    each step is returned as a `dict` with the same fields, where
+    `inputs` is a list of pairs of an index of argv and the name of
+    the step whose output is that file.
+
+    raise ValueError if the pipeline is malformed.
+    """
+    steps = payload.get('steps')
+    if not isinstance(steps, list) or not 1 <= len(steps) <= max_steps:
+        raise ValueError('steps must be a list of 1 to {} steps'.format(max_steps))
+    parsed = []
+    names = set()
+    for step in steps:
+        if not isinstance(step, dict):
+            raise ValueError('steps must be objects')
+        name = step.get('name')
+        if not isinstance(name, str) or not STEP_NAME.match(name) or name in names:
+            raise ValueError('steps must have unique names of letters, digits, _, and -')
+        if step.get('command') not in commands:
+            raise ValueError('unknown command in step {}'.format(name))
+        argv = step.get('argv', [])
+        if not isinstance(argv, list):
+            raise ValueError('argv of step {} must be a list'.format(name))
+        argv = list(argv)
+        inputs = []
+        for ii, arg in enumerate(argv):
+            if isinstance(arg, dict):
+                if arg.get('step') not in names:
+                    raise ValueError('step {} refers to a step that is not before it'.format(name))
+                inputs.append([ii, arg['step']])
+                argv[ii] = STEP_OUTPUT
+            elif not isinstance(arg, str) or len(arg) == 0:
+                raise ValueError('argv of step {} must contain nonempty strings'.format(name))
+        indices = file_indices(step['command'], argv)
+        if not all(ii in indices for ii, _ in inputs):
+            raise ValueError('outputs of steps must be file arguments of step {}'.format(name))
+        timeout = step.get('timeout')
+        if timeout is not None and (not isinstance(timeout, int) or timeout < 0):
+            raise ValueError('timeout of step {} must be a nonnegative integer'.format(name))
+        parsed.append({'name': name, 'command': step['command'], 'argv': argv,
+                       'inputs': inputs, 'timeout': timeout})
+        names.add(name)
+    return parsed
+
+def client_key_identity(key):
+    """return client identity for API key, without revealing the key"""
+    return 'key:' + hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+def kill_process_group(pr):
+    """kill subprocess `pr` and all processes that it started"""
+    try:
+        os.killpg(pr.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def define_metrics(m):
+    m.counter('rcomp_jobs_submitted_total', 'Jobs submitted, including cache hits.')
+    m.counter('rcomp_jobs_succeeded_total', 'Jobs that exited with code 0.')
+    m.counter('rcomp_jobs_nonzero_exit_total', 'Jobs that exited with nonzero code.')
+    m.counter('rcomp_jobs_timeout_total', 'Jobs that were killed after their timeout.')
+    m.counter('rcomp_jobs_cancelled_total', 'Jobs that were cancelled by clients.')
+    m.gauge('rcomp_running_jobs', 'Subprocesses of jobs that are running.')
+    m.histogram('rcomp_job_duration_seconds', 'Wall time of subprocesses of jobs.')
+    m.histogram('rcomp_job_wait_seconds', 'Time from submission until start of jobs.')
+    m.histogram('rcomp_redis_latency_seconds', 'Latency of calls to Redis.')
+    m.histogram('rcomp_request_body_bytes', 'Size of bodies of requests.',
+                buckets=metrics.SIZE_BUCKETS)
+    m.histogram('rcomp_input_bytes', 'Size of decompressed input files of jobs.',
+                buckets=metrics.SIZE_BUCKETS)
+    m.counter('rcomp_inputs_too_large_total', 'Jobs rejected because input files were too large.')
+    m.histogram('rcomp_staging_seconds', 'Time to decode and stage input files of jobs.')
+    m.histogram('rcomp_event_loop_lag_seconds',
+                'Delay of timers of the event loop, i.e., how long it was blocked.')
 
 
 class Server:
-    def __init__(self, host='127.0.0.1', port=8080, timeout_per_job=None):
+    def __init__(self, host='127.0.0.1', port=8080, timeout_per_job=None,
+                 redis_url=None, max_redis_connections=32,
+                 max_jobs=None, max_jobs_per_command=None, max_queue=64,
+                 retry_after=5, dispatch='local', result_cache=None,
+                 max_wait=60, keepalive_interval=15, output_chunk_size=65536,
+                 max_batch=1000, retention=None,
+                 max_jobs_per_client=None, client_weights=None,
+                 input_memory_threshold=staging.MEMORY_THRESHOLD, staging_dir=None,
+                 probe_interval=300, max_variants=8, max_pipeline_steps=32,
+                 staging_threads=4, max_input_bytes=128*2**20,
+                 max_job_input_bytes=256*2**20):
+        """
+        if `dispatch` is 'local' (default), then jobs are run as
+        subprocesses of this server. If 'queue', then jobs are only
+        appended to the Redis queue, from which `rcompserv worker`
+        processes take them.
+
+        `result_cache` is a ResultCache object, or False to not cache
+        results. If it is None (default), a ResultCache with default
+        parameters is used.
+
+        `max_wait` is the maximum duration (seconds) for which a
+        status request with parameter `wait` is held open.
+
+        `max_batch` is the maximum number of jobs in one request to
+        POST /batch or POST /status.
+
+        `retention` is a Retention object, or False to keep finished
+        jobs forever. If it is None (default), a Retention with default
+        parameters is used.
+
+        jobs are queued fairly across clients, which are identified by
+        the API key in the header X-Rcomp-Key, or otherwise by address.
+        `max_jobs_per_client` limits running jobs of each client, and
+        `client_weights` maps API keys to weights (default 1) in fair
+        queuing.
+
+        input files of jobs that are not larger than
+        `input_memory_threshold` bytes are staged in memory; others
+        are written to a temporary directory under `staging_dir`
+        (cf. staging.Inputs). Input files are decoded and staged by
+        at most `staging_threads` threads (cf. stage_files()). Jobs
+        with an input file larger than `max_input_bytes`, or input
+        files larger than `max_job_input_bytes` in total, after
+        decompression, are rejected with status 413. None means no
+        limit.
+
+        tools that implement commands are probed at startup and then
+        every `probe_interval` seconds, so that tools that are
+        installed or upgraded later are picked up. If it is None, then
+        tools are only probed at startup.
+
+        `max_variants` is the maximum number of variants of a job in
+        race mode, in which the first variant that succeeds is kept
+        (cf. start_race()). `max_pipeline_steps` is the maximum
+        number of steps of a pipeline (cf. start_pipeline()).
+        """
+        assert dispatch in ('local', 'queue')
+        self._dispatch = dispatch
         self._host = host
         self._port = port
         self._timeout_per_job = timeout_per_job
+        if client_weights is None:
+            client_weights = dict()
+        self.scheduler = Scheduler(max_jobs=max_jobs,
+                                   max_jobs_per_command=max_jobs_per_command,
+                                   max_queue=max_queue,
+                                   max_jobs_per_client=max_jobs_per_client,
+                                   client_weights={client_key_identity(key): weight
+                                                   for key, weight in client_weights.items()})
+        self._retry_after = retry_after
+        if result_cache is None:
+            result_cache = ResultCache()
+        self.result_cache = result_cache
+        if retention is None:
+            retention = Retention()
+        self.retention = retention
+        self.tool_versions = dict()
+        self.probes = dict()
+        self._probe_interval = probe_interval
+        self._prober = None
+        self.events = events.JobEvents(on_cancel=self.cancel_local)
+        # Subprocesses of running jobs, and jobs of this process that
+        # are being cancelled
+        self._processes = dict()
+        self._cancelled = set()
+        self._max_variants = max_variants
+        self._max_pipeline_steps = max_pipeline_steps
+        # Jobs that this process coordinates, e.g., races, mapped to
+        # IDs of their child jobs, tasks of the coordinators, and
+        # futures of results of child jobs
+        self._children = dict()
+        self._coordinators = set()
+        # Steps of pipelines of this process that wait for earlier
+        # steps, mapped to their commands
+        self._waiting_steps = dict()
+        self._child_results = dict()
+        self._max_wait = max_wait
+        self._keepalive_interval = keepalive_interval
+        self._output_chunk_size = output_chunk_size
+        self._max_batch = max_batch
+        self._input_memory_threshold = input_memory_threshold
+        self._staging_dir = staging_dir
+        # Threads are only started once needed, i.e., after prefork.
+        self.staging_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=staging_threads, thread_name_prefix='rcomp-staging')
+        self._max_input_bytes = max_input_bytes
+        self._max_job_input_bytes = max_job_input_bytes
+        self._lag_monitor = None
+        self.cacheable_commands = set()
+        self.batch_commands = set()
+        self._redis_url = redis_url
+        self._max_redis_connections = max_redis_connections
         self.extra_headers = {'Access-Control-Allow-Origin': '*'}
-        self.app = web.Application()
+        self.metrics = metrics.Metrics()
+        define_metrics(self.metrics)
+        self.app = web.Application(middlewares=[self.observe_request,
+                                                self.compress_response])
         self.app.on_startup.append(self.start_redis)
+        self.app.on_startup.append(self.probe_tools)
+        self.app.on_startup.append(self.start_events)
+        self.app.on_startup.append(self.start_retention)
+        self.app.on_startup.append(self.start_result_cache)
+        self.app.on_startup.append(self.start_metrics)
+        self.app.on_startup.append(self.start_lag_monitor)
+        self.app.on_cleanup.append(self.stop_probing)
+        self.app.on_cleanup.append(self.stop_lag_monitor)
+        self.app.on_cleanup.append(self.stop_staging)
+        self.app.on_cleanup.append(self.stop_metrics)
+        self.app.on_cleanup.append(self.stop_retention)
+        self.app.on_cleanup.append(self.stop_result_cache)
+        self.app.on_cleanup.append(self.stop_events)
+        self.app.on_cleanup.append(self.stop_redis)
         self.app.router.add_get('/', self.index)
         self.known_commands = dict()
+        self._commands = dict()
         self.register_command('version',
                               'version string for rcomp server',
                               self.version)
@@ -66,13 +457,75 @@ class Server:
                                ' mostly of interest for testing.'),
                               self.date,
                               ['get', 'post'],
-                              check=check_date)
+                              check=check_date,
+                              tool='date')
+        self.register_command('batch',
+                              ('submit several jobs in one request;'
+                               ' respond with their statuses in order'),
+                              self.batch,
+                              ['post'],
+                              hidden=True)
+        self.register_command('pipeline',
+                              ('submit jobs whose files can be outputs of'
+                               ' earlier jobs; each job starts once the'
+                               ' jobs that it depends on succeeded'),
+                              self.pipeline,
+                              ['post'],
+                              hidden=True)
+        self.register_command('metrics',
+                              ('operational metrics of all server and worker'
+                               ' processes in the Prometheus text format'),
+                              self.get_metrics,
+                              hidden=True)
+        self.register_command('retention',
+                              ('numbers of finished jobs that are kept, their'
+                               ' size, and bytes reclaimed by expiry,'
+                               ' eviction, and compression'),
+                              self.retention_stats,
+                              hidden=True)
         self.register_command('status ID',
                               ('get status of and, if available, results'
                                ' from job identified by ID'),
                               self.status,
                               route='/status/{ID}',
                               hidden=True)
+        self.register_command('cancel ID',
+                              ('cancel job identified by ID, killing its'
+                               ' subprocess if it is running'),
+                              self.cancel,
+                              ['delete'],
+                              route='/status/{ID}',
+                              hidden=True)
+        self.register_command('status',
+                              ('get status of and, if available, results'
+                               ' from several jobs at once'),
+                              self.batch_status,
+                              ['post'],
+                              hidden=True)
+        self.register_command('status ID events',
+                              ('stream of server-sent events with status'
+                               ' of job identified by ID until it is done'),
+                              self.status_events,
+                              route='/status/{ID}/events',
+                              hidden=True)
+        self.register_command('status ID steps',
+                              ('get statuses of steps of pipeline'
+                               ' identified by ID'),
+                              self.status_steps,
+                              route='/status/{ID}/steps',
+                              hidden=True)
+        self.register_command('status ID output',
+                              ('stream output of job identified by ID,'
+                               ' starting at byte `offset`, until it is done'),
+                              self.status_output,
+                              route='/status/{ID}/output',
+                              hidden=True)
+        self.register_command('status ID trace',
+                              ('get timeline of events in the life'
+                               ' of job identified by ID'),
+                              self.status_trace,
+                              route='/status/{ID}/trace',
+                              hidden=True)
         self.register_command('trivial',
                               ('command that immediately completes with'
                                ' success, mostly of interest for testing.'),
@@ -83,14 +536,20 @@ class Server:
                                ' Denis Oddoux and Paul Gastin)'),
                               self.ltl2ba,
                               ['get', 'post'],
-                              check=check_ltl2ba)
+                              check=check_ltl2ba,
+                              tool='ltl2ba',
+                              cacheable=True,
+                              batch=True)
         self.register_command('gr1c',
                               ('wrapper of gr1c (http://scottman.net/2012/gr1c)'),
                               self.gr1c,
                               ['get', 'post'],
-                              check=check_gr1c)
+                              check=check_gr1c,
+                              tool='gr1c',
+                              cacheable=True,
+                              batch=True)
 
-    def register_command(self, name, summary, function, methods=None, route=None, hidden=False, check=None):
+    def register_command(self, name, summary, function, methods=None, route=None, hidden=False, check=None, tool=None, cacheable=False, batch=False):
         """register new command in rcomp server.
 
         if `route` is not given, then `name` is used to form the route
@@ -104,82 +563,1064 @@ class Server:
 
         if `check` is a function, then it will be called to decide
         whether the command to be registered is supported by the host.
-        Otherwise (default), no check is performed.
+        Otherwise (default), no check is performed. The check is
+        skipped if jobs are dispatched to workers through the queue.
+        If the check returns a string, then it is the version of the
+        tool that implements the command. Checks run when the server
+        starts and periodically afterwards (cf. probes.py), and until a
+        check succeeds, requests for the command are answered with 404.
+        `tool` is the name of the executable that the check runs; if it
+        is given, then results of the check are reused until the
+        executable changes.
+
+        if `cacheable` (default False), then the command is
+        deterministic, so results are cached and identical jobs that
+        are running at the same time are merged.
+
+        if `batch` (default False), then jobs of the command can also
+        be submitted together with other jobs through POST /batch.
         """
-        assert name not in self.known_commands
-        if check:
-            if not check():
-                print('WARNING: failed to register command: {}'.format(name))
-                return
+        assert name not in self._commands and name not in self.probes
+        if check and self._dispatch == 'local':
+            self.probes[name] = probes.Probe(name, check, tool=tool)
+            function = self.requires_probe(name, function)
+        if cacheable:
+            self.cacheable_commands.add(name)
+        if batch:
+            self.batch_commands.add(name)
         if methods is None:
             methods = ['get']
         if route is None:
             route = '/' + name
         if not hidden:
-            self.known_commands[name] = {'name': name,
-                                         'summary': summary,
-                                         'http_methods': methods,
-                                         'route': route}
+            self._commands[name] = {'name': name,
+                                    'summary': summary,
+                                    'http_methods': methods,
+                                    'route': route}
+            self.update_known_commands()
         for method in methods:
             self.app.router.add_route(method, route, function)
 
     async def start_redis(self, app):
-        app['redis'] = redis.StrictRedis()
+        """create pooled asyncio Redis client shared by all handlers.
+
+        if `redis_url` was not given to the constructor, then connect
+        to Redis on localhost at the default port. Once all connections
+        are in use, handlers wait for one to be released, for at most
+        REDIS_POOL_TIMEOUT seconds.
+        """
+        if self._redis_url is None:
+            pool = aioredis.BlockingConnectionPool(max_connections=self._max_redis_connections,
+                                                   timeout=REDIS_POOL_TIMEOUT)
+        else:
+            pool = aioredis.BlockingConnectionPool.from_url(
+                self._redis_url,
+                max_connections=self._max_redis_connections,
+                timeout=REDIS_POOL_TIMEOUT)
+        app['redis'] = aioredis.StrictRedis(connection_pool=pool)
+
+    def is_available(self, name):
+        """return whether the tool of command `name`, if any, passed its check"""
+        return name not in self.probes or self.probes[name].available
+
+    def update_known_commands(self):
+        self.known_commands = {name: entry for name, entry in self._commands.items()
+                               if self.is_available(name)}
+
+    def requires_probe(self, name, function):
+        """return handler that calls `function` only if command `name` is available"""
+        async def handler(request):
+            if not self.is_available(name):
+                raise web.HTTPNotFound(text=json.dumps({'err': 'command not available: {}'.format(name)}),
+                                       content_type='application/json',
+                                       headers=self.extra_headers)
+            return await function(request)
+        return handler
+
+    async def probe_tools(self, app):
+        """probe tools of commands, then keep probing in the background"""
+        if len(self.probes) > 0 and all(probe.result is not None
+                                        for probe in self.probes.values()):
+            # Probed before this process was forked (cf. prefork.py)
+            await self.publish_tools(app)
+        else:
+            await self.reprobe(app['redis'])
+        if self._probe_interval is not None and len(self.probes) > 0:
+            self._prober = asyncio.ensure_future(self._probe_periodically(app['redis']))
+
+    async def stop_probing(self, app):
+        if self._prober is not None:
+            self._prober.cancel()
+            try:
+                await self._prober
+            except asyncio.CancelledError:
+                pass
+            self._prober = None
+
+    async def _probe_periodically(self, redis):
+        while True:
+            await asyncio.sleep(self._probe_interval)
+            try:
+                await self.reprobe(redis)
+            except RedisConnectionError:
+                print('WARNING: failed to publish tools; retrying')
+
+    async def reprobe(self, redis):
+        """probe tools and update commands that are available"""
+        changed = await probes.probe_all(list(self.probes.values()), redis)
+        if len(changed) == 0:
+            return
+        for probe in changed:
+            if not probe.available:
+                print('WARNING: failed to register command: {}'.format(probe.name))
+        self.tool_versions = {probe.name: probe.version for probe in self.probes.values()
+                              if probe.available and probe.version is not None}
+        self.update_known_commands()
+        await self.publish_tools(self.app)
+
+    async def publish_tools(self, app):
+        """share versions of tools with API servers that do not run jobs"""
+        if self._dispatch == 'local' and len(self.tool_versions) > 0:
+            await app['redis'].hset(TOOLS_KEY, mapping=self.tool_versions)
+
+    async def read_tool_versions(self):
+        """return `dict` of versions of tools that implement commands"""
+        if self._dispatch == 'local':
+            return self.tool_versions
+        versions = await self.app['redis'].hgetall(TOOLS_KEY)
+        return {str(name, encoding='utf-8'): str(version, encoding='utf-8')
+                for name, version in versions.items()}
+
+    async def tool_version(self, command):
+        if self._dispatch == 'local':
+            return self.tool_versions.get(command, '')
+        version = await self.app['redis'].hget(TOOLS_KEY, command)
+        return '' if version is None else str(version, encoding='utf-8')
+
+    async def start_events(self, app):
+        await self.events.start(app['redis'])
+
+    async def stop_events(self, app):
+        await self.events.stop()
+
+    async def start_lag_monitor(self, app):
+        self._lag_monitor = asyncio.ensure_future(self._monitor_lag())
+
+    async def stop_lag_monitor(self, app):
+        if self._lag_monitor is not None:
+            self._lag_monitor.cancel()
+            try:
+                await self._lag_monitor
+            except asyncio.CancelledError:
+                pass
+            self._lag_monitor = None
+
+    async def _monitor_lag(self):
+        """observe how late timers fire, which is how long the event
+        loop was blocked, e.g., by work that belongs in an executor
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            lag = max(loop.time() - start - LAG_INTERVAL, 0)
+            self.metrics.observe('rcomp_event_loop_lag_seconds', lag)
+            if lag > LAG_WARNING:
+                print('WARNING: event loop was blocked for {:.2f} seconds'.format(lag))
+
+    async def stop_staging(self, app):
+        self.staging_pool.shutdown(wait=True)
+
+    async def start_retention(self, app):
+        if self.retention:
+            await self.retention.start(app['redis'])
+
+    async def stop_retention(self, app):
+        if self.retention:
+            await self.retention.stop()
+
+    async def start_result_cache(self, app):
+        if self.result_cache:
+            await self.result_cache.start(app['redis'])
+
+    async def stop_result_cache(self, app):
+        if self.result_cache:
+            await self.result_cache.stop()
+
+    async def update_job(self, job_id, mapping, job_trace=None):
+        """write fields of job record and notify waiters of new state.
+
+        if `job_trace` (a trace.Trace) is given, then its events are
+        written with the record, and once that is done, the event
+        trace.PERSISTED is recorded before waiters are notified.
+        """
+        redis = self.app['redis']
+        with self.metrics.timer('rcomp_redis_latency_seconds', operation='update'):
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.hset(job_id, mapping=mapping)
+                if job_trace is not None:
+                    if len(job_trace.events) > 0:
+                        pipe.hset(records.trace_key(job_id), mapping=job_trace.events)
+                    await pipe.execute()
+                    pipe.hset(records.trace_key(job_id), trace.PERSISTED, trace.event())
+                if 'state' in mapping:
+                    pipe.publish(events.channel(job_id), mapping['state'])
+                await pipe.execute()
+
+    async def finish_job(self, job_id, result, digest=None, job_trace=None):
+        """write final `result` of job, share it with jobs that are
+        attached to it, and apply the retention policy to all of them.
+
+        `job_trace` is as for update_job().
+        """
+        await self.update_job(job_id, result, job_trace=job_trace)
+        finished = [job_id]
+        if digest is not None and self.result_cache:
+            finished += await self.result_cache.complete(self.app['redis'], digest,
+                                                         job_id, result)
+        if self.retention:
+            for finished_id in finished:
+                await self.retention.finish(self.app['redis'], finished_id)
+        future = self._child_results.pop(job_id, None)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    async def fail_job(self, job_id, status, digest=None):
+        await self.finish_job(job_id, {
+            'status': status,
+            'exitcode': 1,
+            'state': 'done',
+            'done': 1
+        }, digest=digest)
+
+    async def start_metrics(self, app):
+        await self.metrics.start(app['redis'])
+
+    async def stop_metrics(self, app):
+        await self.metrics.stop(app['redis'])
+
+    @web.middleware
+    async def observe_request(self, request, handler):
+        # Handlers of jobs start their traces at this time.
+        request['received'] = trace.now()
+        if request.content_length is not None:
+            self.metrics.observe('rcomp_request_body_bytes', request.content_length,
+                                 route=request.path.split('/')[1])
+        return await handler(request)
+
+    @web.middleware
+    async def compress_response(self, request, handler):
+        """compress body of response with content coding that the client
+        accepts (cf. compression.negotiate()), if it is large enough.
+        """
+        response = await handler(request)
+        if (not isinstance(response, web.Response) or response.status != 200
+                or not isinstance(response.body, bytes)
+                or len(response.body) < compression.MIN_RESPONSE_SIZE
+                or 'Content-Encoding' in response.headers):
+            return response
+        encoding = compression.negotiate(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+        body = response.body
+        if len(body) < EXECUTOR_COMPRESS_SIZE:
+            body = compression.compress(body, encoding)
+        else:
+            body = await asyncio.get_running_loop().run_in_executor(
+                None, compression.compress, body, encoding)
+        response.body = body
+        response.headers['Content-Encoding'] = encoding
+        vary = response.headers.get('Vary')
+        response.headers['Vary'] = 'Accept-Encoding' if vary is None else vary + ', Accept-Encoding'
+        etag = response.headers.get('ETag')
+        if etag is not None:
+            # Each content coding is a different representation.
+            response.headers['ETag'] = '{}-{}"'.format(etag[:-1], encoding)
+        return response
+
+    async def get_metrics(self, request):
+        return web.Response(text=await self.metrics.render(self.app['redis']),
+                            headers=dict(self.extra_headers,
+                                         **{'Content-Type': 'text/plain; version=0.0.4'}))
+
+    async def stop_redis(self, app):
+        await app['redis'].aclose()
+        await app['redis'].connection_pool.disconnect()
 
     async def index(self, request):
-        return web.json_response({'commands': self.known_commands},
+        return web.json_response({'commands': self.known_commands,
+                                  'codecs': compression.SUPPORTED_CODECS,
+                                  'tools': await self.read_tool_versions()},
                                  headers=self.extra_headers)
 
     async def version(self, request):
         return web.json_response({'version': __version__},
                                  headers=self.extra_headers)
 
-    async def generic_task(self, job_id, cmd, temporary_dir=None, timeout=None):
+    async def generic_task(self, job_id, cmd, inputs=None, timeout=None, digest=None,
+                           submitted=None, job_trace=None):
+        """run job as subprocess and write its output and result.
+
+        `inputs` is the staging.Inputs object of files in `cmd`, if
+        any, which are removed when the job is done. `submitted` is
+        the `datetime` (UTC) at which the job was submitted, if
+        known. Events of the subprocess are added to `job_trace`
+        (default a new trace.Trace), which is saved with the result.
+        """
+        if job_trace is None:
+            job_trace = trace.Trace()
         if self._timeout_per_job is not None:
             if timeout is None:
                 timeout = self._timeout_per_job
             else:
                 timeout = min(timeout, self._timeout_per_job)
-        pr = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        command = cmd[0]
+        if job_id in self._cancelled:
+            # Cancelled while queued
+            self._cancelled.discard(job_id)
+            await staging.remove(inputs)
+            self.metrics.inc('rcomp_jobs_cancelled_total', command=command)
+            await self.finish_job(job_id, CANCELLED, digest=digest)
+            return
+        if submitted is not None:
+            self.metrics.observe('rcomp_job_wait_seconds',
+                                 (datetime.utcnow() - submitted).total_seconds(),
+                                 command=command)
+        await self.update_job(job_id, {'state': 'running'})
+        self.metrics.inc('rcomp_running_jobs', command=command)
+        try:
+            with self.metrics.timer('rcomp_job_duration_seconds', command=command):
+                result = await self.run_subprocess(job_id, cmd, inputs=inputs,
+                                                   timeout=timeout,
+                                                   job_trace=job_trace)
+        finally:
+            self.metrics.inc('rcomp_running_jobs', -1, command=command)
+            self._cancelled.discard(job_id)
+        if result['status'] == 'cancelled':
+            self.metrics.inc('rcomp_jobs_cancelled_total', command=command)
+        elif result['status'] == 'error (timeout)':
+            self.metrics.inc('rcomp_jobs_timeout_total', command=command)
+        elif result['exitcode'] == 0:
+            self.metrics.inc('rcomp_jobs_succeeded_total', command=command)
+        else:
+            self.metrics.inc('rcomp_jobs_nonzero_exit_total', command=command)
+        await self.finish_job(job_id, result, digest=digest, job_trace=job_trace)
+
+    async def run_subprocess(self, job_id, cmd, inputs=None, timeout=None, job_trace=None):
+        """run `cmd`, copy its output to the job, and return result as `dict`.
+
+        the subprocess is in a new process group, which is killed
+        after the timeout or if the job is cancelled. If `job_trace`
+        is given, then the events trace.SPAWNED and trace.EXITED are
+        added to it.
+        """
+        # Output of an earlier attempt, e.g., of a job that was
+        # requeued after its worker died, would precede new output.
+        await self.app['redis'].delete(records.output_key(job_id), records.stderr_key(job_id))
+        try:
+            pr = await process.start(cmd, pass_fds=(inputs.fds if inputs else ()))
+        except Exception:
+            await staging.remove(inputs)
+            raise
+        if job_trace is not None:
+            job_trace.mark(trace.SPAWNED, pid=pr.pid)
+        self._processes[job_id] = pr
+        if job_id in self._cancelled:
+            kill_process_group(pr)
+        digest = hashlib.sha256()
+        copying = asyncio.gather(
+            self.copy_stream(job_id, pr.stdout, records.output_key(job_id), digest=digest),
+            self.copy_stream(job_id, pr.stderr, records.stderr_key(job_id)),
+            pr.wait()
+        )
         try:
             if timeout is None or timeout < 1:
-                stdout_data, stderr_data = await pr.communicate()
+                await copying
             else:
-                stdout_data, stderr_data = await asyncio.wait_for(pr.communicate(), timeout=timeout)
+                await asyncio.wait_for(asyncio.shield(copying), timeout=timeout)
         except asyncio.TimeoutError:
-            pr.kill()
-            self.app['redis'].hset(job_id, 'output', '')
-            self.app['redis'].hset(job_id, 'status', 'error (timeout)')
-            self.app['redis'].hset(job_id, 'exitcode', 1)
-            self.app['redis'].hset(job_id, 'done', 1)
+            kill_process_group(pr)
+            await copying
+            result = {
+                'status': 'error (timeout)',
+                'exitcode': 1,
+                'state': 'done',
+                'done': 1
+            }
         else:
-            self.app['redis'].hset(job_id, 'output', stdout_data)
-            self.app['redis'].hset(job_id, 'exitcode', pr.returncode)
-            if pr.returncode == 0:
-                self.app['redis'].hset(job_id, 'status', 'success')
-            else:
-                self.app['redis'].hset(job_id, 'status', 'error (nonzero exitcode)')
-            self.app['redis'].hset(job_id, 'done', 1)
+            result = {
+                'exitcode': pr.returncode,
+                'status': ('success'
+                           if pr.returncode == 0
+                           else 'error (nonzero exitcode)'),
+                'state': 'done',
+                'done': 1
+            }
         finally:
-            if (temporary_dir is not None) and len(temporary_dir) > 0:
-                for fpath in os.listdir(temporary_dir):
-                    os.unlink(os.path.join(temporary_dir, fpath))
-                os.rmdir(temporary_dir)
+            del self._processes[job_id]
+            await staging.remove(inputs)
+        if job_trace is not None:
+            job_trace.mark(trace.EXITED, exitcode=pr.returncode, **pr.usage())
+        if job_id in self._cancelled:
+            result = dict(CANCELLED)
+        result['output_size'] = copying.result()[0]
+        result['output_digest'] = digest.hexdigest()
+        return result
 
-    async def call_generic(self, cmd, temporary_dir=None, timeout=None):
-        job_id = str(uuid.uuid4())
-        start_time = str(datetime.utcnow())
-        self.app['redis'].hset(job_id, 'cmd', ' '.join(cmd))
-        self.app['redis'].hset(job_id, 'stime', start_time)
-        self.app['redis'].hset(job_id, 'done', 0)
-        self.app.loop.create_task(self.generic_task(job_id, cmd, temporary_dir=temporary_dir, timeout=timeout))
+    async def copy_stream(self, job_id, stream, key, digest=None):
+        """append data from `stream` to string at `key` as it arrives.
+
+        if `digest` is given, then it is a hash object that is updated
+        with the data.
+
+        return number of bytes copied.
+        """
+        size = 0
+        while True:
+            chunk = await stream.read(self._output_chunk_size)
+            if len(chunk) == 0:
+                return size
+            size += len(chunk)
+            if digest is not None:
+                digest.update(chunk)
+            with self.metrics.timer('rcomp_redis_latency_seconds', operation='append'):
+                async with self.app['redis'].pipeline(transaction=False) as pipe:
+                    pipe.append(key, chunk)
+                    pipe.publish(events.channel(job_id), events.OUTPUT)
+                    await pipe.execute()
+
+    def too_large(self, err):
+        """return HTTPRequestEntityTooLarge for staging.InputTooLarge `err`"""
+        return web.HTTPRequestEntityTooLarge(
+            max_size=err.limit, actual_size=err.size,
+            text=json.dumps({'err': str(err), 'limit': err.limit}),
+            content_type='application/json',
+            headers=self.extra_headers)
+
+    def too_many_requests(self):
+        return web.HTTPTooManyRequests(
+            text=json.dumps({'err': 'job queue is full'}),
+            content_type='application/json',
+            headers=dict(self.extra_headers,
+                         **{'Retry-After': str(self._retry_after)}))
+
+    async def call_generic(self, cmd, inputs=None, timeout=None, job_id=None, digest=None,
+                           client=None, priority=0):
+        """submit `cmd` to the scheduler and create job record.
+
+        the record has the state that the job has after submission,
+        i.e., 'running' if it was started immediately. `client` and
+        `priority` are as for Scheduler.submit().
+
+        raise HTTPTooManyRequests if the scheduler queue is full, in
+        which case `inputs` are removed.
+        """
+        if self.scheduler.is_full():
+            await staging.remove(inputs)
+            raise self.too_many_requests()
+        if job_id is None:
+            job_id = str(uuid.uuid4())
+        submitted = datetime.utcnow()
+        record = {
+            'cmd': ' '.join(cmd),
+            'stime': str(submitted),
+            'done': 0
+        }
+        if digest is not None:
+            record['digest'] = digest
+            record['cache'] = 'miss'
+        if client is not None:
+            record['client'] = client
+        created = asyncio.Event()
+        failed = False
+
+        async def start():
+            # The job does not write to its record before it is created.
+            await created.wait()
+            if failed:
+                await staging.remove(inputs)
+                return
+            await self.generic_task(job_id, cmd, inputs=inputs, timeout=timeout,
+                                    digest=digest, submitted=submitted)
+
+        try:
+            position = self.scheduler.submit(job_id, cmd[0], start,
+                                             client=client,
+                                             priority=priority)
+        except QueueFull:
+            await staging.remove(inputs)
+            raise self.too_many_requests()
+        record['state'] = 'running' if position == 0 else 'queued'
+        try:
+            await self.app['redis'].hset(job_id, mapping=record)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            created.set()
         return job_id
 
+    async def start_race(self, job_id, command, argv, variants, inputs=None, timeout=None,
+                         client=None, priority=0):
+        """create race job and submit one job per variant to the scheduler.
+
+        variant `ii` has ID `job_id`.`ii` and runs `command` with the
+        options `variants[ii]` before `argv`. All variants share the
+        files `inputs`, which are removed once all variants are done.
+
+        return task that finishes the race job (cf. finish_race()).
+
+        raise HTTPTooManyRequests if the scheduler queue cannot hold
+        all variants, in which case `inputs` are removed.
+        """
+        if (self.scheduler.max_queue is not None
+            and self.scheduler.pending() + len(variants) > self.scheduler.max_queue):
+            await staging.remove(inputs)
+            raise self.too_many_requests()
+        children = ['{}.{}'.format(job_id, ii) for ii in range(len(variants))]
+        record = {
+            'cmd': ' '.join([command]+argv),
+            'stime': str(datetime.utcnow()),
+            'state': 'running',
+            'done': 0,
+            'variants': json.dumps(children)
+        }
+        if client is not None:
+            record['client'] = client
+        await self.app['redis'].hset(job_id, mapping=record)
+        self._children[job_id] = children
+        loop = asyncio.get_running_loop()
+        futures = []
+        for child_id, options in zip(children, variants):
+            future = loop.create_future()
+            futures.append(future)
+            self._child_results[child_id] = future
+            if job_id in self._cancelled:
+                # The race was cancelled while variants were submitted.
+                self._cancelled.add(child_id)
+            try:
+                await self.call_generic([command]+options+argv,
+                                        inputs=(inputs.share() if inputs else None),
+                                        timeout=timeout,
+                                        job_id=child_id,
+                                        client=client,
+                                        priority=priority)
+            except web.HTTPTooManyRequests:
+                del self._child_results[child_id]
+                future.set_result({
+                    'status': 'error (job queue is full)',
+                    'exitcode': 1,
+                    'state': 'done',
+                    'done': 1
+                })
+        await staging.remove(inputs)
+        task = asyncio.ensure_future(self.finish_race(job_id, children, futures))
+        self._coordinators.add(task)
+        task.add_done_callback(self._coordinators.discard)
+        return task
+
+    async def finish_race(self, job_id, children, futures):
+        """wait for variants of race job until one succeeds.
+
+        the race job gets the output and result of the first variant
+        that succeeds, whose index is the field `winner`, and the
+        other variants are cancelled. If no variant succeeds, then the
+        race job gets the result of the variant that finished first.
+        """
+        index = {future: ii for ii, future in enumerate(futures)}
+        results = dict()
+        winner = None
+        try:
+            pending = set(futures)
+            while len(pending) > 0 and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in sorted(done, key=index.get):
+                    results[index[future]] = future.result()
+                    if winner is None and future.result()['status'] == 'success':
+                        winner = index[future]
+            for future in pending:
+                self.cancel_local(children[index[future]])
+        finally:
+            del self._children[job_id]
+            self._cancelled.discard(job_id)
+        chosen = winner if winner is not None else next(iter(results))
+        result = await self.copy_output(children[chosen], job_id, results[chosen])
+        if winner is not None:
+            result['winner'] = winner
+        await self.finish_job(job_id, result)
+
+    async def copy_output(self, source_id, job_id, result):
+        """copy output of job `source_id` to job `job_id`.
+
+        return copy of `result` with the codec of the output, if any.
+        """
+        async with self.app['redis'].pipeline(transaction=False) as pipe:
+            pipe.copy(records.output_key(source_id), records.output_key(job_id),
+                      replace=True)
+            pipe.copy(records.stderr_key(source_id), records.stderr_key(job_id),
+                      replace=True)
+            pipe.hget(source_id, 'output_codec')
+            codec = (await pipe.execute())[2]
+        result = dict(result)
+        if codec is not None:
+            result['output_codec'] = codec
+        return result
+
+    async def read_output(self, job_id):
+        """return output of job that is done, decompressed"""
+        # The retention policy compresses output and sets its codec
+        # atomically, so both are read in one transaction.
+        async with self.app['redis'].pipeline(transaction=True) as pipe:
+            pipe.hget(job_id, 'output_codec')
+            pipe.get(records.output_key(job_id))
+            codec, output = await pipe.execute()
+        output = records.decode_output({'output_codec': codec}, output)
+        return b'' if output is None else output
+
+    async def start_pipeline(self, job_id, steps, timeout=None, client=None, priority=0):
+        """create pipeline job and start steps from parse_pipeline().
+
+        step NAME has ID `job_id`.NAME. `timeout` applies to steps
+        that do not have their own.
+
+        return task that runs the steps and finishes the pipeline job
+        (cf. run_pipeline()).
+        """
+        children = {step['name']: '{}.{}'.format(job_id, step['name']) for step in steps}
+        stime = str(datetime.utcnow())
+        async with self.app['redis'].pipeline(transaction=False) as pipe:
+            record = {
+                'cmd': 'pipeline ' + ' '.join(children),
+                'stime': stime,
+                'state': 'running',
+                'done': 0,
+                'steps': json.dumps(children)
+            }
+            if client is not None:
+                record['client'] = client
+            pipe.hset(job_id, mapping=record)
+            for step in steps:
+                # Steps wait until the outputs that they need are done.
+                pipe.hset(children[step['name']], mapping={
+                    'cmd': step['command'],
+                    'stime': stime,
+                    'state': 'waiting',
+                    'done': 0
+                })
+            await pipe.execute()
+        self._children[job_id] = list(children.values())
+        for step in steps:
+            self._waiting_steps[children[step['name']]] = step['command']
+        task = asyncio.ensure_future(self.run_pipeline(job_id, steps, children,
+                                                       timeout=timeout,
+                                                       client=client,
+                                                       priority=priority))
+        self._coordinators.add(task)
+        task.add_done_callback(self._coordinators.discard)
+        return task
+
+    async def run_pipeline(self, job_id, steps, children, timeout=None, client=None,
+                           priority=0):
+        """start each step once the steps that it depends on succeeded.
+
+        steps that depend on a step that did not succeed are skipped.
+        Steps that were cancelled while they waited were already
+        finished by cancel_local(). The pipeline job gets the output
+        and result of the first step that did not succeed, whose name
+        is the field `failed_step`, or, if all succeeded, of the last
+        step.
+        """
+        results = dict()
+        running = dict()
+        try:
+            while True:
+                for step in steps:
+                    name = step['name']
+                    if name in results or name in running.values():
+                        continue
+                    step_id = children[name]
+                    needed = [results.get(dependency) for _, dependency in step['inputs']]
+                    if step_id in self._cancelled and step_id not in self._waiting_steps:
+                        self._cancelled.discard(step_id)
+                        results[name] = CANCELLED
+                        continue
+                    elif job_id in self._cancelled:
+                        results[name] = CANCELLED
+                    elif any(result is not None and result['status'] != 'success'
+                             for result in needed):
+                        results[name] = SKIPPED
+                    elif all(result is not None for result in needed):
+                        future = await self.start_step(step_id, step, children,
+                                                       timeout=timeout,
+                                                       client=client,
+                                                       priority=priority)
+                        running[future] = name
+                        continue
+                    else:
+                        continue
+                    del self._waiting_steps[step_id]
+                    await self.finish_job(step_id, results[name])
+                if len(running) == 0:
+                    break
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        finally:
+            del self._children[job_id]
+            self._cancelled.discard(job_id)
+            for step_id in children.values():
+                self._waiting_steps.pop(step_id, None)
+        chosen = steps[-1]['name']
+        for step in steps:
+            if results[step['name']]['status'] != 'success':
+                chosen = step['name']
+                break
+        result = await self.copy_output(children[chosen], job_id, results[chosen])
+        if result['status'] != 'success':
+            result['failed_step'] = chosen
+        await self.finish_job(job_id, result)
+
+    async def start_step(self, step_id, step, children, timeout=None, client=None, priority=0):
+        """stage files of step, including outputs of earlier steps, and submit it.
+
+        return future of the result of the step.
+        """
+        command = step['command']
+        future = asyncio.get_running_loop().create_future()
+        self._child_results[step_id] = future
+        if command not in self.known_commands:
+            del self._waiting_steps[step_id]
+            await self.fail_job(step_id, 'error (command not supported)')
+            return future
+        argv = list(step['argv'])
+        outputs = dict(step['inputs'])
+        indices = file_indices(command, argv)
+        inputs = self.new_inputs()
+        step_trace = trace.Trace()
+        failure = None
+        try:
+            await self.stage_files(command, argv, inputs=inputs,
+                                   indices=[ii for ii in indices if ii not in outputs],
+                                   job_trace=step_trace)
+            files = dict()
+            for ii in indices:
+                if ii in outputs:
+                    files[ii] = await self.read_output(children[outputs[ii]])
+            argv = await staging.write_files(inputs, argv, files)
+        except (ValueError, zlib.error):
+            failure = 'error (malformed input files)'
+        except staging.InputTooLarge:
+            failure = 'error (input files too large)'
+        except BaseException:
+            await staging.remove(inputs)
+            raise
+        cancelled = self._waiting_steps.pop(step_id, None) is None
+        if cancelled or failure is not None:
+            await staging.remove(inputs)
+            if cancelled:
+                # Cancelled while files were staged, which finished
+                # the step and its future (cf. cancel_local())
+                self._cancelled.discard(step_id)
+            else:
+                await self.fail_job(step_id, failure)
+            return future
+        if step['timeout'] is not None:
+            timeout = step['timeout']
+        await step_trace.save(self.app['redis'], step_id)
+        try:
+            await self.call_generic([command]+argv,
+                                    inputs=inputs,
+                                    timeout=timeout,
+                                    job_id=step_id,
+                                    client=client,
+                                    priority=priority)
+        except web.HTTPTooManyRequests:
+            # The record of the step was deleted.
+            await self.app['redis'].hset(step_id, mapping={'cmd': command,
+                                                           'stime': str(datetime.utcnow())})
+            await self.fail_job(step_id, 'error (job queue is full)')
+        return future
+
+    async def submit_job(self, command, argv, timeout=None, staged=None, client=None, priority=0,
+                         variants=None, job_trace=None):
+        """run `command` locally or enqueue it, depending on dispatch mode.
+
+        if `staged` is None, then `argv` is as received from the
+        client, i.e., files have not been decoded yet. Otherwise,
+        files were already staged by receive_multipart(), `argv`
+        contains their paths, and `staged` is the pair of
+        staging.Inputs and `dict` of SHA-256 digests of files.
+
+        If results of `command` are cacheable, then the cache is
+        checked first, and identical running jobs are joined.
+
+        `client` identifies the submitter (cf. client_identity()), and
+        `priority` orders jobs of the same client.
+
+        if `variants` is given (cf. parse_variants()), then the job is
+        a race among the variants, and results are not cached.
+
+        if `job_trace` (a trace.Trace) is given, then it has events of
+        the request, and it is saved as the trace of the job once files
+        are staged.
+
+        return job ID.
+        """
+        inputs = None
+        if staged is not None:
+            inputs, file_digests = staged
+        try:
+            await self.admit()
+        except web.HTTPTooManyRequests:
+            await staging.remove(inputs)
+            raise
+        job_id = str(uuid.uuid4())
+        self.metrics.inc('rcomp_jobs_submitted_total', command=command)
+        cacheable = (self.result_cache and command in self.cacheable_commands
+                     and variants is None)
+        if staged is None and (cacheable or self._dispatch == 'local'):
+            # Workers only receive files encoded in argv, so files are
+            # only checked and hashed in queue mode.
+            if self._dispatch == 'local':
+                inputs = self.new_inputs()
+            try:
+                file_digests = await self.stage_files(command, argv, inputs=inputs,
+                                                      job_trace=job_trace)
+            except staging.InputTooLarge as err:
+                await staging.remove(inputs)
+                self.metrics.inc('rcomp_inputs_too_large_total', command=command)
+                raise self.too_large(err)
+            except (ValueError, TypeError, zlib.error):
+                await staging.remove(inputs)
+                raise self.bad_request('malformed file data')
+            except BaseException:
+                await staging.remove(inputs)
+                raise
+        if job_trace is not None:
+            await job_trace.save(self.app['redis'], job_id)
+        digest = None
+        if cacheable:
+            digest = job_digest(command, argv, file_digests,
+                                await self.tool_version(command))
+            result = await self.result_cache.restore(self.app['redis'], digest, job_id)
+            if result is not None:
+                await staging.remove(inputs)
+                await self.app['redis'].hset(job_id, mapping=dict(
+                    result,
+                    cmd=' '.join([command]+argv),
+                    stime=str(datetime.utcnow()),
+                    state='done',
+                    done=1,
+                    cache='hit'
+                ))
+                if self.retention:
+                    await self.retention.finish(self.app['redis'], job_id)
+                return job_id
+            leader = await self.result_cache.claim(self.app['redis'], digest, job_id)
+            if leader is not None:
+                await staging.remove(inputs)
+                await self.app['redis'].hset(job_id, mapping={
+                    'cmd': ' '.join([command]+argv),
+                    'stime': str(datetime.utcnow()),
+                    'state': 'attached',
+                    'leader': leader,
+                    'digest': digest,
+                    'done': 0
+                })
+                return job_id
+
+        if self._dispatch == 'queue' and inputs is not None:
+            # Workers only receive files encoded in argv.
+            try:
+                argv = await asyncio.get_running_loop().run_in_executor(
+                    None, self.encode_files, command, argv)
+            finally:
+                await staging.remove(inputs)
+            inputs = None
+        try:
+            return await self.dispatch_job(job_id, command, argv,
+                                           inputs=inputs,
+                                           timeout=timeout, digest=digest,
+                                           client=client, priority=priority,
+                                           variants=variants)
+        except web.HTTPTooManyRequests:
+            if digest is not None:
+                # Release jobs that were attached in the meantime.
+                attached = await self.result_cache.complete(self.app['redis'], digest, job_id, {
+                    'status': 'error (job queue is full)',
+                    'exitcode': 1,
+                    'state': 'done',
+                    'done': 1
+                })
+                if self.retention:
+                    for attached_id in attached:
+                        await self.retention.finish(self.app['redis'], attached_id)
+            # The record of the job was not kept.
+            await self.app['redis'].delete(records.trace_key(job_id))
+            raise
+
+    async def admit(self):
+        """raise HTTPTooManyRequests if no more jobs can be queued"""
+        if self._dispatch == 'queue':
+            if (self.scheduler.max_queue is not None
+                and await jobqueue.length(self.app['redis']) >= self.scheduler.max_queue):
+                raise self.too_many_requests()
+        elif self.scheduler.is_full():
+            raise self.too_many_requests()
+
+    async def dispatch_job(self, job_id, command, argv, inputs=None, timeout=None, digest=None,
+                           client=None, priority=0, variants=None):
+        if self._dispatch == 'queue':
+            # The shared queue is FIFO, so fair queuing only applies
+            # among jobs that a worker has taken.
+            fields = {'cmd': command,
+                      'stime': str(datetime.utcnow()),
+                      'priority': priority}
+            if digest is not None:
+                fields['digest'] = digest
+                fields['cache'] = 'miss'
+            if client is not None:
+                fields['client'] = client
+            if variants is not None:
+                fields['race'] = json.dumps(variants)
+            with self.metrics.timer('rcomp_redis_latency_seconds', operation='enqueue'):
+                await jobqueue.enqueue(self.app['redis'], job_id, command, argv,
+                                       timeout=timeout,
+                                       fields=fields)
+            return job_id
+        if variants is not None:
+            await self.start_race(job_id, command, argv, variants,
+                                  inputs=inputs,
+                                  timeout=timeout,
+                                  client=client,
+                                  priority=priority)
+            return job_id
+        return await self.call_generic([command]+argv,
+                                       inputs=inputs,
+                                       timeout=timeout,
+                                       job_id=job_id,
+                                       digest=digest,
+                                       client=client,
+                                       priority=priority)
+
+    async def receive_multipart(self, command, request, job_trace=None):
+        """stream files of multipart request to staged input files.
+
+        The first part must be named `job` and contain JSON with the
+        same fields as requests that are entirely JSON, i.e., `argv`
+        and optionally `timeout`, `priority`, and `variants`, and,
+        additionally, `codec`, which is the compression of file parts
+        (default zlib). Each following part is named `file` and
+        provides, in order, the file for the next file argument in
+        argv. Elements of argv that are file arguments are ignored,
+        e.g., clients can send local file names.
+
+        return tuple of argv, timeout, priority, variants, and staged
+        as for submit_job().
+
+        if `job_trace` is given, then the events trace.BODY_READ, once
+        the part `job` is read, and trace.STAGED are added to it. File
+        parts are decoded as they arrive, so staging includes reading
+        them.
+
+        raise HTTPBadRequest if the request is malformed, or
+        HTTPUnsupportedMediaType if the codec is not supported.
+        """
+        reader = await request.multipart()
+        part = await reader.next()
+        if part is None or part.name != 'job':
+            raise self.bad_request('first part must be named "job"')
+        payload = json.loads(await part.read())
+        if job_trace is not None:
+            job_trace.mark(trace.BODY_READ)
+        argv = payload.get('argv', [])
+        timeout = None
+        if ('timeout' in payload
+            and isinstance(payload['timeout'], int)
+            and payload['timeout'] >= 0):
+            timeout = payload['timeout']
+        priority = parse_priority(payload)
+        try:
+            check_argv(argv)
+            variants = parse_variants(command, argv, payload, self._max_variants)
+        except ValueError as err:
+            raise self.bad_request(str(err))
+        codec = payload.get('codec', 'zlib')
+        if codec not in compression.SUPPORTED_CODECS:
+            raise web.HTTPUnsupportedMediaType(
+                text=json.dumps({'err': 'unsupported codec',
+                                 'codecs': compression.SUPPORTED_CODECS}),
+                content_type='application/json',
+                headers=self.extra_headers)
+        indices = file_indices(command, argv)
+        inputs = self.new_inputs()
+        limits = self.input_limits()
+        file_digests = dict()
+        compressed_bytes = 0
+        loop = asyncio.get_running_loop()
+        try:
+            for ii in indices:
+                part = await reader.next()
+                if part is None or part.name != 'file':
+                    raise self.bad_request('expected {} file parts'.format(len(indices)))
+                staged_file = inputs.open()
+                decoder = staging.Decoder(compression.decompressor(codec), limits, staged_file)
+                with self.metrics.timer('rcomp_staging_seconds', command=command):
+                    while True:
+                        chunk = await part.read_chunk(self._output_chunk_size)
+                        if len(chunk) == 0:
+                            break
+                        await loop.run_in_executor(self.staging_pool, decoder.feed, chunk)
+                    file_digests[ii] = await loop.run_in_executor(self.staging_pool,
+                                                                  decoder.finish)
+                self.metrics.observe('rcomp_input_bytes', decoder.size, command=command)
+                compressed_bytes += decoder.compressed_size
+                argv[ii] = staged_file.close()
+            if await reader.next() is not None:
+                raise self.bad_request('expected {} file parts'.format(len(indices)))
+        except compression.ERRORS:
+            await staging.remove(inputs)
+            raise self.bad_request('malformed compressed file data')
+        except staging.InputTooLarge as err:
+            await staging.remove(inputs)
+            self.metrics.inc('rcomp_inputs_too_large_total', command=command)
+            raise self.too_large(err)
+        except BaseException:
+            await staging.remove(inputs)
+            raise
+        if job_trace is not None:
+            job_trace.mark(trace.STAGED, files=len(indices),
+                           compressed_bytes=compressed_bytes,
+                           decompressed_bytes=limits.job_bytes)
+        return argv, timeout, priority, variants, (inputs, file_digests)
+
+    def client_identity(self, request):
+        """return identity of the client that sent `request`.
+
+        clients that send an API key in the header X-Rcomp-Key are
+        identified by it. Otherwise, the address of the client is used,
+        which is taken from the header X-Real-IP if the request comes
+        through a proxy on the same host (cf. nginx.conf).
+        """
+        key = request.headers.get('X-Rcomp-Key')
+        if key:
+            return client_key_identity(key)
+        address = request.remote
+        if address in (None, '', '127.0.0.1', '::1') and 'X-Real-IP' in request.headers:
+            address = request.headers['X-Real-IP']
+        return 'addr:{}'.format(address or 'unknown')
+
+    def bad_request(self, message):
+        return web.HTTPBadRequest(text=json.dumps({'err': message}),
+                                  content_type='application/json',
+                                  headers=self.extra_headers)
+
     async def date(self, request):
         if request.method == 'GET':
             return web.json_response({'err': 'not implemented'},
                                      headers=self.extra_headers)
         else:  # request.method == 'POST'
+            job_trace = trace.Trace(received=request.get('received'))
             timeout = None
             if request.has_body:
                 payload = json.loads(await request.read())
@@ -189,114 +1630,645 @@ class Server:
                     and isinstance(payload['timeout'], int)
                     and payload['timeout'] >= 0):
                     timeout = payload['timeout']
-            job_id = await self.call_generic(['date'], timeout=timeout)
+            job_trace.mark(trace.BODY_READ)
+            job_id = await self.submit_job('date', [], timeout=timeout,
+                                           client=self.client_identity(request),
+                                           job_trace=job_trace)
             return await self.get_status(job_id)
 
-    async def get_status(self, job_id):
-        if not self.app['redis'].exists(job_id):
+    async def batch(self, request):
+        """submit several jobs.
+
+        the request body is JSON with field `jobs`, a list of objects
+        that each have fields `command` and `argv` (files are encoded as
+        in requests to individual commands), and optionally `timeout`
+        and `priority`.
+        The response has field `jobs`, a list in the same order, with
+        the status of each job that was submitted, or an object with
+        field `err` if the job was rejected. Malformed jobs are
+        rejected before any job is submitted, and remaining jobs are
+        rejected once the queue is full.
+        """
+        try:
+            payload = json.loads(await request.read())
+            jobs = payload['jobs']
+        except (ValueError, KeyError, TypeError):
+            raise self.bad_request('expected JSON with list `jobs`')
+        if not isinstance(jobs, list):
+            raise self.bad_request('expected JSON with list `jobs`')
+        if len(jobs) > self._max_batch:
+            raise self.bad_request('at most {} jobs per request'.format(self._max_batch))
+        client = self.client_identity(request)
+        request_trace = trace.Trace(received=request.get('received'))
+        request_trace.mark(trace.BODY_READ)
+        errors = []
+        for job in jobs:
+            if (not isinstance(job, dict)
+                or job.get('command') not in self.batch_commands
+                or not self.is_available(job['command'])):
+                errors.append({'err': 'unknown command or malformed job'})
+                continue
+            try:
+                check_argv(job.get('argv', []))
+            except ValueError as err:
+                errors.append({'err': str(err)})
+                continue
+            errors.append(None)
+        job_ids = []
+        for job, error in zip(jobs, errors):
+            if error is not None:
+                job_ids.append(error)
+                continue
+            timeout = None
+            if ('timeout' in job
+                and isinstance(job['timeout'], int)
+                and job['timeout'] >= 0):
+                timeout = job['timeout']
+            try:
+                job_ids.append(await self.submit_job(job['command'], list(job.get('argv', [])),
+                                                     timeout=timeout,
+                                                     client=client,
+                                                     priority=parse_priority(job),
+                                                     job_trace=request_trace.copy()))
+            except web.HTTPTooManyRequests:
+                job_ids.append({'err': 'job queue is full'})
+            except (web.HTTPBadRequest, web.HTTPRequestEntityTooLarge) as err:
+                job_ids.append(json.loads(err.text))
+        statuses = await self.read_statuses([job_id for job_id in job_ids
+                                             if isinstance(job_id, str)])
+        statuses.reverse()
+        resp = [(statuses.pop() if isinstance(job_id, str) else job_id)
+                for job_id in job_ids]
+        return web.json_response({'jobs': resp}, headers=self.extra_headers)
+
+    async def pipeline(self, request):
+        """submit pipeline and respond with its status.
+
+        the request body is JSON with field `steps` as for
+        parse_pipeline(), and optionally `timeout`, which applies to
+        steps that do not have their own, and `priority`. Outputs of
+        steps stay on the server until later steps read them.
+        """
+        pipeline_trace = trace.Trace(received=request.get('received'))
+        try:
+            payload = json.loads(await request.read())
+        except ValueError:
+            raise self.bad_request('expected JSON with list `steps`')
+        pipeline_trace.mark(trace.BODY_READ)
+        if not isinstance(payload, dict):
+            raise self.bad_request('expected JSON with list `steps`')
+        commands = [command for command in self.batch_commands if self.is_available(command)]
+        try:
+            steps = parse_pipeline(payload, commands, self._max_pipeline_steps)
+        except ValueError as err:
+            raise self.bad_request(str(err))
+        timeout = None
+        if ('timeout' in payload
+            and isinstance(payload['timeout'], int)
+            and payload['timeout'] >= 0):
+            timeout = payload['timeout']
+        priority = parse_priority(payload)
+        client = self.client_identity(request)
+        await self.admit()
+        job_id = str(uuid.uuid4())
+        self.metrics.inc('rcomp_jobs_submitted_total', command='pipeline')
+        await pipeline_trace.save(self.app['redis'], job_id)
+        if self._dispatch == 'queue':
+            fields = {'cmd': 'pipeline ' + ' '.join(step['name'] for step in steps),
+                      'stime': str(datetime.utcnow()),
+                      'priority': priority,
+                      'client': client,
+                      'pipeline': json.dumps(steps)}
+            with self.metrics.timer('rcomp_redis_latency_seconds', operation='enqueue'):
+                await jobqueue.enqueue(self.app['redis'], job_id, 'pipeline', [],
+                                       timeout=timeout,
+                                       fields=fields)
+        else:
+            await self.start_pipeline(job_id, steps,
+                                      timeout=timeout,
+                                      client=client,
+                                      priority=priority)
+        return await self.get_status(job_id)
+
+    async def status_steps(self, request):
+        """respond with field `steps`, which maps names of steps of a
+        pipeline to their statuses.
+        """
+        job_id = request.match_info['ID']
+        steps = await self.app['redis'].hget(job_id, 'steps')
+        if steps is None:
+            return web.Response(status=404,
+                                text=json.dumps({'err': 'pipeline not found or not started'}),
+                                headers=self.extra_headers)
+        steps = json.loads(steps)
+        statuses = await self.read_statuses(list(steps.values()))
+        return web.json_response({'steps': dict(zip(steps, statuses))},
+                                 headers=self.extra_headers)
+
+    async def read_status(self, job_id, inline=False):
+        """return status of job as `dict`, or None if job is not known.
+
+        the status of a job that is done has the size and digest of its
+        output (cf. status_output()), or if `inline` is True, the output
+        itself. Jobs that finished before outputs had digests always
+        have the output.
+        """
+        return (await self.read_statuses([job_id], inline=inline))[0]
+
+    async def read_statuses(self, job_ids, inline=False):
+        """return list of statuses as from read_status(), one per job ID.
+
+        records of all jobs are read in one round trip to Redis.
+        """
+        statuses = []
+        ttl = self.retention.ttl if self.retention else None
+        with self.metrics.timer('rcomp_redis_latency_seconds', operation='read'):
+            jobs = await records.read(self.app['redis'], job_ids, ttl=ttl, output=inline,
+                                      first_read=trace.event())
+        for job_id, job in zip(job_ids, jobs):
+            if job is None:
+                statuses.append(None)
+                continue
+            record, output, stderr = job
+            done = (False
+                    if int(record['done']) == 0
+                    else True)
+            resp = {
+                'cmd': str(record['cmd'], encoding='utf-8'),
+                'id': job_id,
+                'stime': str(record['stime'], encoding='utf-8'),
+                'status': (None
+                           if 'status' not in record
+                           else str(record['status'], encoding='utf-8')),
+                'done': done
+            }
+            if 'cache' in record:
+                resp['cache'] = str(record['cache'], encoding='utf-8')
+            if 'state' in record:
+                resp['state'] = str(record['state'], encoding='utf-8')
+            if 'client' in record:
+                resp['client'] = str(record['client'], encoding='utf-8')
+            if 'variants' in record:
+                resp['variants'] = json.loads(record['variants'])
+            if 'winner' in record:
+                resp['winner'] = int(record['winner'])
+            if 'steps' in record:
+                resp['steps'] = json.loads(record['steps'])
+            if 'failed_step' in record:
+                resp['failed_step'] = str(record['failed_step'], encoding='utf-8')
+            if done:
+                if 'output_digest' in record and not inline:
+                    resp['output_size'] = int(record['output_size'])
+                    resp['output_digest'] = str(record['output_digest'], encoding='utf-8')
+                else:
+                    if output is None:
+                        # Records that do not have output in a separate string
+                        output = record.get('output', b'')
+                    resp['output'] = str(output, encoding='utf-8')
+                if stderr is not None:
+                    resp['stderr'] = str(stderr, encoding='utf-8', errors='replace')
+                resp['ec'] = int(str(record['exitcode'], encoding='utf-8'))
+            statuses.append(resp)
+
+        queued = [resp for resp in statuses
+                  if resp is not None and resp.get('state') == 'queued']
+        if self._dispatch == 'queue':
+            if len(queued) > 0:
+                positions = await jobqueue.positions(self.app['redis'],
+                                                     [resp['id'] for resp in queued])
+                for resp, position in zip(queued, positions):
+                    resp['position'] = position
+        else:
+            # Only known if this process owns the job.
+            active = [resp for resp in statuses
+                      if resp is not None and resp.get('state') in ('queued', 'running')]
+            positions = self.scheduler.positions([resp['id'] for resp in active])
+            for resp, position in zip(active, positions):
+                if resp['state'] == 'queued':
+                    resp['position'] = position
+                if position is not None and 'client' in resp:
+                    resp['client_share'] = self.scheduler.share(resp['client'])
+        return statuses
+
+    async def get_status(self, job_id, wait=None, inline=False):
+        """respond with status of job.
+
+        if `wait` is positive, then hold the response for at most
+        `wait` seconds until the job is done. `inline` is as for
+        read_status().
+        """
+        if wait is not None and wait > 0:
+            queue = await self.events.subscribe(job_id)
+            try:
+                resp = await self.read_status(job_id, inline=inline)
+                deadline = asyncio.get_running_loop().time() + wait
+                while resp is not None and not resp['done']:
+                    remaining = deadline - asyncio.get_running_loop().time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        await events.wait_for_state(queue, remaining)
+                    except asyncio.TimeoutError:
+                        break
+                    resp = await self.read_status(job_id, inline=inline)
+            finally:
+                await self.events.unsubscribe(job_id, queue)
+        else:
+            resp = await self.read_status(job_id, inline=inline)
+        if resp is None:
             return web.Response(status=404,
                                 text=json.dumps({'err': 'job not found'}),
                                 headers=self.extra_headers)
-        cmd = str(self.app['redis'].hget(job_id, 'cmd'),
-                  encoding='utf-8')
-        start_time = str(self.app['redis'].hget(job_id, 'stime'),
-                         encoding='utf-8')
-        done = (False
-                if int(self.app['redis'].hget(job_id, 'done')) == 0
-                else True)
-        status = (None
-                  if not self.app['redis'].hexists(job_id, 'status')
-                  else str(self.app['redis'].hget(job_id, 'status'),
-                           encoding='utf-8'))
-        resp = {
-            'cmd': cmd,
-            'id': job_id,
-            'stime': start_time,
-            'status': status,
-            'done': done
-        }
-        if done:
-            resp['output'] = str(self.app['redis'].hget(job_id, 'output'),
-                                 encoding='utf-8')
-            resp['ec'] = int(str(self.app['redis'].hget(job_id, 'exitcode'),
-                                 encoding='utf-8'))
         return web.json_response(resp,
                                  headers=self.extra_headers)
 
     async def status(self, request):
         job_id = request.match_info['ID']
-        return await self.get_status(job_id)
+        wait = None
+        if 'wait' in request.query:
+            try:
+                wait = min(float(request.query['wait']), self._max_wait)
+            except ValueError:
+                return web.Response(status=400,
+                                    text=json.dumps({'err': 'wait must be a number'}),
+                                    headers=self.extra_headers)
+        return await self.get_status(job_id, wait=wait,
+                                     inline=(request.query.get('output') == 'inline'))
+
+    def cancel_local(self, job_id):
+        """cancel job if it is queued or running in this process.
+
+        this is called for requests to cancel that are published by
+        any process (cf. cancel()).
+        """
+        if job_id in self._children:
+            self._cancelled.add(job_id)
+            for child_id in self._children[job_id]:
+                self.cancel_local(child_id)
+            return
+        if job_id in self._waiting_steps:
+            # Steps wait for earlier steps outside of the scheduler, so
+            # they are finished here, and not started later (cf.
+            # run_pipeline() and start_step()).
+            self.metrics.inc('rcomp_jobs_cancelled_total', command=self._waiting_steps.pop(job_id))
+            self._cancelled.add(job_id)
+            asyncio.ensure_future(self.finish_job(job_id, CANCELLED))
+            return
+        start = self.scheduler.cancel(job_id)
+        if start is not None:
+            # Cleans up and finishes the job without running it.
+            self._cancelled.add(job_id)
+            asyncio.ensure_future(start())
+        elif self.scheduler.position(job_id) == 0:
+            self._cancelled.add(job_id)
+            if job_id in self._processes:
+                kill_process_group(self._processes[job_id])
+
+    async def cancel(self, request):
+        """cancel job and respond with its status.
+
+        a queued job is removed from the queue, and the process group
+        of a running job is killed, by whichever process owns the job.
+        Jobs that other jobs are attached to are not cancelled.
+        """
+        job_id = request.match_info['ID']
+        redis = self.app['redis']
+        state, digest, done = await redis.hmget(job_id, 'state', 'digest', 'done')
+        if done is None:
+            return web.Response(status=404,
+                                text=json.dumps({'err': 'job not found'}),
+                                headers=self.extra_headers)
+        if int(done) != 0:
+            return await self.get_status(job_id)
+        state = str(state, encoding='utf-8')
+        if digest is not None:
+            digest = str(digest, encoding='utf-8')
+        if state == 'attached':
+            if await self.result_cache.detach(redis, digest, job_id):
+                await self.update_job(job_id, CANCELLED)
+                if self.retention:
+                    await self.retention.finish(redis, job_id)
+            return await self.get_status(job_id)
+        if (digest is not None and self.result_cache
+            and await self.result_cache.is_shared(redis, digest, job_id)):
+            return web.Response(status=409,
+                                text=json.dumps({'err': 'other jobs are attached to this job'}),
+                                headers=self.extra_headers)
+        await redis.hset(job_id, 'cancel', 1)
+        if self._dispatch == 'queue' and await jobqueue.remove(redis, job_id):
+            # No worker took the job.
+            await self.finish_job(job_id, CANCELLED, digest=digest)
+            return await self.get_status(job_id)
+        await redis.publish(events.CANCEL_CHANNEL, job_id)
+        return await self.get_status(job_id, wait=CANCEL_WAIT)
+
+    async def retention_stats(self, request):
+        if not self.retention:
+            return web.json_response({'err': 'finished jobs are kept forever'},
+                                     headers=self.extra_headers)
+        return web.json_response(await self.retention.stats(self.app['redis']),
+                                 headers=self.extra_headers)
+
+    async def batch_status(self, request):
+        """respond with statuses of several jobs.
+
+        the request body is JSON with field `ids`, a list of job IDs,
+        and optionally `output`, which is 'inline' to include outputs.
+        The response has field `jobs`, which maps each job ID to its
+        status, or to null if the job is not known.
+        """
+        try:
+            payload = json.loads(await request.read())
+            job_ids = payload['ids']
+        except (ValueError, KeyError, TypeError):
+            raise self.bad_request('expected JSON with list `ids`')
+        if (not isinstance(job_ids, list)
+            or not all(isinstance(job_id, str) for job_id in job_ids)):
+            raise self.bad_request('expected JSON with list `ids`')
+        if len(job_ids) > self._max_batch:
+            raise self.bad_request('at most {} jobs per request'.format(self._max_batch))
+        statuses = await self.read_statuses(job_ids, inline=(payload.get('output') == 'inline'))
+        return web.json_response({'jobs': dict(zip(job_ids, statuses))},
+                                 headers=self.extra_headers)
+
+    async def status_events(self, request):
+        """stream status of job as server-sent events until it is done"""
+        job_id = request.match_info['ID']
+        inline = request.query.get('output') == 'inline'
+        queue = await self.events.subscribe(job_id)
+        try:
+            resp = await self.read_status(job_id, inline=inline)
+            if resp is None:
+                return web.Response(status=404,
+                                    text=json.dumps({'err': 'job not found'}),
+                                    headers=self.extra_headers)
+            stream = web.StreamResponse(headers=dict(self.extra_headers,
+                                                     **{'Content-Type': 'text/event-stream',
+                                                        'Cache-Control': 'no-cache'}))
+            await stream.prepare(request)
+            previous = None
+            while True:
+                if resp != previous:
+                    await stream.write('event: status\ndata: {}\n\n'
+                                       .format(json.dumps(resp)).encode('utf-8'))
+                    previous = resp
+                if resp['done']:
+                    break
+                try:
+                    await events.wait_for_state(queue, self._keepalive_interval)
+                except asyncio.TimeoutError:
+                    await stream.write(b': keepalive\n\n')
+                resp = await self.read_status(job_id, inline=inline)
+            await stream.write_eof()
+            return stream
+        finally:
+            await self.events.unsubscribe(job_id, queue)
+
+    async def status_trace(self, request):
+        """respond with timeline of events of job (cf. trace.timeline()).
+
+        jobs whose results were restored from the result cache, or that
+        finished before servers recorded traces, have few or no events.
+        """
+        job_id = request.match_info['ID']
+        async with self.app['redis'].pipeline(transaction=False) as pipe:
+            pipe.exists(job_id)
+            pipe.hgetall(records.trace_key(job_id))
+            exists, events = await pipe.execute()
+        if not exists:
+            return web.Response(status=404,
+                                text=json.dumps({'err': 'job not found'}),
+                                headers=self.extra_headers)
+        return web.json_response(dict(trace.timeline(events), id=job_id),
+                                 headers=self.extra_headers)
+
+    async def status_output(self, request):
+        """stream output of job from byte `offset` until the job is done.
+
+        if query parameter `stream` is 'stderr', then stream the
+        standard error of the job instead.
+
+        output of a job that is done is sent in one response (cf.
+        send_output()) if its record has the digest of it.
+        """
+        job_id = request.match_info['ID']
+        try:
+            offset = int(request.query.get('offset', 0))
+        except ValueError:
+            return web.Response(status=400,
+                                text=json.dumps({'err': 'offset must be an integer'}),
+                                headers=self.extra_headers)
+        if request.query.get('stream') == 'stderr':
+            key = records.stderr_key(job_id)
+        else:
+            key = records.output_key(job_id)
+            done, digest = await self.app['redis'].hmget(job_id, 'done', 'output_digest')
+            if done is not None and int(done) != 0 and digest is not None:
+                return await self.send_output(request, job_id,
+                                              str(digest, encoding='utf-8'), offset)
+        queue = await self.events.subscribe(job_id)
+        try:
+            if not await self.app['redis'].exists(job_id):
+                return web.Response(status=404,
+                                    text=json.dumps({'err': 'job not found'}),
+                                    headers=self.extra_headers)
+            stream = web.StreamResponse(headers=dict(self.extra_headers,
+                                                     **{'Content-Type': 'application/octet-stream'}))
+            stream.enable_chunked_encoding()
+            await stream.prepare(request)
+            while True:
+                # Output is complete before the job is marked done, and
+                # it can be compressed once the job is done, so whether
+                # the job is done is read together with each chunk.
+                async with self.app['redis'].pipeline(transaction=True) as pipe:
+                    pipe.hmget(job_id, 'done', 'output_codec')
+                    pipe.getrange(key, offset, offset + self._output_chunk_size - 1)
+                    (done, codec), chunk = await pipe.execute()
+                if codec is not None and key == records.output_key(job_id):
+                    output = records.decode_output({'output_codec': codec},
+                                                   await self.app['redis'].get(key))
+                    if output is not None:
+                        await stream.write(output[offset:])
+                    break
+                if len(chunk) > 0:
+                    await stream.write(chunk)
+                    offset += len(chunk)
+                    continue
+                if done is None or int(done) != 0:
+                    break
+                try:
+                    await asyncio.wait_for(queue.get(), timeout=self._keepalive_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await stream.write_eof()
+            return stream
+        finally:
+            await self.events.unsubscribe(job_id, queue)
+
+    async def send_output(self, request, job_id, digest, offset=0):
+        """respond with output of job that is done from byte `offset`.
+
+        the ETag of the response is the digest of the output, so
+        clients can avoid downloading it again with If-None-Match. One
+        range of bytes in header Range is sent instead, e.g., to resume
+        an interrupted download, unless If-Range has another ETag. A
+        range of all bytes is sent as the whole output, which can be
+        compressed (cf. compress_response()).
+        """
+        etag = '"{}"'.format(digest)
+        headers = dict(self.extra_headers, **{'ETag': etag,
+                                              'Accept-Ranges': 'bytes',
+                                              'Content-Type': 'application/octet-stream'})
+        if etag_matches(request.headers.get('If-None-Match', ''), digest):
+            return web.Response(status=304, headers=headers)
+        output = await self.read_output(job_id)
+        byte_range = request.headers.get('Range')
+        if byte_range is not None and request.headers.get('If-Range', etag) == etag:
+            try:
+                byte_range = parse_byte_range(byte_range, len(output))
+            except ValueError:
+                headers['Content-Range'] = 'bytes */{}'.format(len(output))
+                return web.Response(status=416, headers=headers)
+            if byte_range is not None and byte_range != (0, len(output)):
+                start, stop = byte_range
+                headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, stop - 1, len(output))
+                return web.Response(status=206, body=output[start:stop], headers=headers)
+        return web.Response(body=output[offset:], headers=headers)
 
     async def trivial(self, request):
         job_id = str(uuid.uuid4())
         start_time = str(datetime.utcnow())
-        request.app['redis'].hset(job_id, 'cmd', 'trivial')
-        request.app['redis'].hset(job_id, 'stime', start_time)
-        request.app['redis'].hset(job_id, 'output', '')
-        request.app['redis'].hset(job_id, 'exitcode', 0)
-        request.app['redis'].hset(job_id, 'status', 'success')
-        request.app['redis'].hset(job_id, 'done', 1)
+        await request.app['redis'].hset(job_id, mapping={
+            'cmd': 'trivial',
+            'stime': start_time,
+            'output': '',
+            'exitcode': 0,
+            'status': 'success',
+            'state': 'done',
+            'done': 1
+        })
+        if self.retention:
+            await self.retention.finish(request.app['redis'], job_id)
         return await self.get_status(job_id)
 
-    def map_files(self, command, argv):
-        """Create temporary files from base64 encoded compressed data.
+    def new_inputs(self):
+        """return staging.Inputs for files of a new job"""
+        return staging.Inputs(memory_threshold=self._input_memory_threshold,
+                              directory=self._staging_dir)
+
+    def input_limits(self):
+        """return staging.SizeLimits for input files of a new job"""
+        return staging.SizeLimits(max_file_bytes=self._max_input_bytes,
+                                  max_job_bytes=self._max_job_input_bytes)
 
-        If any temporary files are created, they will all be in the
-        same temporary directory. If it is created, the path to this
-        temporary directory is returned. Otherwise, an empty string is
-        returned (instead of a path).
+    async def map_files(self, command, argv, job_trace=None):
+        """stage files from base64 encoded compressed data in argv.
 
-        return pair D and ARGV, where D is the path to temporary
-        directory or empty string if no directory was created, and
-        ARGV is copy of argv with compressed file data replaced by
-        local paths to temporary files.
+        return pair INPUTS and ARGV, where INPUTS is the
+        staging.Inputs object of the files, and ARGV is argv with
+        compressed file data replaced by paths of staged files.
 
-        The caller is responsible for deleting any temporary files or
-        directories that are created.
+        The caller is responsible for removing INPUTS, e.g., by
+        passing it to generic_task(). `job_trace` is as for
+        stage_files().
         """
-        if command == 'ltl2ba':
-            start = 0
-            temporary_dir = ''
-            while True:
-                try:
-                    start = argv.index('-F', start) + 1
-                except ValueError:
-                    break
-                if len(temporary_dir) == 0:
-                    temporary_dir = tempfile.mkdtemp()
-                fd, fname = tempfile.mkstemp(dir=temporary_dir)
-                fp = os.fdopen(fd, 'wb')
-                fp.write(zlib.decompress(base64.b64decode(bytes(argv[start], encoding='utf-8'),
-                                                          validate=True)))
-                fp.close()
-                argv[start] = fname
-            return temporary_dir, argv
-        elif command == 'gr1c':
-            temporary_dir = ''
-            all_files = False
-            for ii in range(len(argv)):
-                if argv[ii] == '--':
-                    all_files = True
-                elif all_files or argv[ii][0] != '-':
-                    if len(temporary_dir) == 0:
-                        temporary_dir = tempfile.mkdtemp()
-                    fd, fname = tempfile.mkstemp(dir=temporary_dir)
-                    fp = os.fdopen(fd, 'wb')
-                    fp.write(zlib.decompress(base64.b64decode(bytes(argv[ii], encoding='utf-8'),
-                                                              validate=True)))
-                    fp.close()
-                    argv[ii] = fname
-            return temporary_dir, argv
-        else:
-            return '', argv
+        inputs = self.new_inputs()
+        try:
+            await self.stage_files(command, argv, inputs=inputs, job_trace=job_trace)
+        except BaseException:
+            await staging.remove(inputs)
+            raise
+        return inputs, argv
+
+    async def stage_files(self, command, argv, inputs=None, indices=None, job_trace=None):
+        """decode files from base64 encoded compressed data in argv.
+
+        files are decoded on the event loop until they exceed
+        INLINE_DECODE_SIZE bytes in total, and then in the staging
+        pool, so that data that decompress to large files do not block
+        the event loop. They are written to staging.Inputs `inputs` in
+        pieces, in which case argv is changed in place to have their
+        paths. If `inputs` is None, then files are only checked and
+        hashed. `indices` are those of files in argv (default all of
+        them). If files are staged and `job_trace` is given, then the
+        event trace.STAGED is added to it.
+
+        return `dict` that maps indices of files to SHA-256 digests of
+        their contents.
+
+        raise ValueError or zlib.error if data are malformed, and
+        staging.InputTooLarge if files exceed the limits of this server.
+        """
+        if indices is None:
+            indices = file_indices(command, argv)
+        if len(indices) == 0:
+            if inputs is not None and job_trace is not None:
+                job_trace.mark(trace.STAGED, files=0, compressed_bytes=0, decompressed_bytes=0)
+            return dict()
+        limits = self.input_limits()
+
+        def decode():
+            decoded = dict()
+            for ii in indices:
+                staged_file = None if inputs is None else inputs.open()
+                decoded[ii] = yield from staging.decode_pieces(argv[ii], limits, staged_file)
+                if staged_file is not None:
+                    argv[ii] = staged_file.close()
+            return decoded
+
+        pieces = decode()
+        decoded = None
+        with self.metrics.timer('rcomp_staging_seconds', command=command):
+            try:
+                while limits.job_bytes <= INLINE_DECODE_SIZE:
+                    next(pieces)
+            except StopIteration as stop:
+                decoded = stop.value
+            if decoded is None:
+                decoded = await asyncio.get_running_loop().run_in_executor(
+                    self.staging_pool, staging.run, pieces)
+        file_digests = dict()
+        for ii, (compressed_size, size, file_digest) in decoded.items():
+            self.metrics.observe('rcomp_input_bytes', size, command=command)
+            file_digests[ii] = file_digest
+        if inputs is not None and job_trace is not None:
+            job_trace.mark(trace.STAGED, files=len(decoded),
+                           compressed_bytes=sum(d[0] for d in decoded.values()),
+                           decompressed_bytes=sum(d[1] for d in decoded.values()))
+        return file_digests
+
+    def encode_files(self, command, argv):
+        """replace paths of files in argv with encoded file data.
+
+        this is the inverse of map_files(). It reads files, so
+        call it in an executor from the event loop.
+        """
+        for ii in file_indices(command, argv):
+            with open(argv[ii], 'rb') as fp:
+                argv[ii] = str(base64.b64encode(zlib.compress(fp.read())),
+                               encoding='utf-8')
+        return argv
 
     async def ltl2ba(self, request):
         if request.method == 'GET':
             return web.json_response({'err': 'not implemented'},
                                      headers=self.extra_headers)
+        elif request.content_type == 'multipart/form-data':
+            job_trace = trace.Trace(received=request.get('received'))
+            argv, timeout, priority, variants, staged = await self.receive_multipart(
+                'ltl2ba', request, job_trace=job_trace)
+            job_id = await self.submit_job('ltl2ba', argv, timeout=timeout, staged=staged,
+                                           client=self.client_identity(request),
+                                           priority=priority,
+                                           variants=variants,
+                                           job_trace=job_trace)
+            return await self.get_status(job_id)
         else:  # request.method == 'POST'
+            job_trace = trace.Trace(received=request.get('received'))
             argv = []
             timeout = None
+            priority = 0
+            variants = None
             if request.has_body:
                 payload = json.loads(await request.read())
                 if 'argv' in payload:
@@ -305,19 +2277,40 @@ class Server:
                     and isinstance(payload['timeout'], int)
                     and payload['timeout'] >= 0):
                     timeout = payload['timeout']
-            temporary_dir, argv = self.map_files('ltl2ba', argv)
-            job_id = await self.call_generic(['ltl2ba']+argv,
-                                             temporary_dir=temporary_dir,
-                                             timeout=timeout)
+                priority = parse_priority(payload)
+                try:
+                    check_argv(argv)
+                    variants = parse_variants('ltl2ba', argv, payload, self._max_variants)
+                except ValueError as err:
+                    raise self.bad_request(str(err))
+            job_trace.mark(trace.BODY_READ)
+            job_id = await self.submit_job('ltl2ba', argv, timeout=timeout,
+                                           client=self.client_identity(request),
+                                           priority=priority,
+                                           variants=variants,
+                                           job_trace=job_trace)
             return await self.get_status(job_id)
 
     async def gr1c(self, request):
         if request.method == 'GET':
             return web.json_response({'err': 'not implemented'},
                                      headers=self.extra_headers)
+        elif request.content_type == 'multipart/form-data':
+            job_trace = trace.Trace(received=request.get('received'))
+            argv, timeout, priority, variants, staged = await self.receive_multipart(
+                'gr1c', request, job_trace=job_trace)
+            job_id = await self.submit_job('gr1c', argv, timeout=timeout, staged=staged,
+                                           client=self.client_identity(request),
+                                           priority=priority,
+                                           variants=variants,
+                                           job_trace=job_trace)
+            return await self.get_status(job_id)
         else:  # request.method == 'POST'
+            job_trace = trace.Trace(received=request.get('received'))
             argv = []
             timeout = None
+            priority = 0
+            variants = None
             if request.has_body:
                 payload = json.loads(await request.read())
                 if 'argv' in payload:
@@ -326,11 +2319,52 @@ class Server:
                     and isinstance(payload['timeout'], int)
                     and payload['timeout'] >= 0):
                     timeout = payload['timeout']
-            temporary_dir, argv = self.map_files('gr1c', argv)
-            job_id = await self.call_generic(['gr1c']+argv,
-                                             temporary_dir=temporary_dir,
-                                             timeout=timeout)
+                priority = parse_priority(payload)
+                try:
+                    check_argv(argv)
+                    variants = parse_variants('gr1c', argv, payload, self._max_variants)
+                except ValueError as err:
+                    raise self.bad_request(str(err))
+            job_trace.mark(trace.BODY_READ)
+            job_id = await self.submit_job('gr1c', argv, timeout=timeout,
+                                           client=self.client_identity(request),
+                                           priority=priority,
+                                           variants=variants,
+                                           job_trace=job_trace)
             return await self.get_status(job_id)
 
-    def run(self):
-        web.run_app(self.app, host=self._host, port=self._port)
+    async def serve(self, sock=None, reuse_port=False):
+        """serve requests until SIGINT or SIGTERM is received.
+
+        if `sock` is None, then listen on the host and port given to
+        the constructor, optionally with SO_REUSEPORT. Otherwise,
+        accept connections on the listening socket `sock`.
+
+        after a signal, no more connections are accepted, and jobs
+        that are queued or running are allowed to finish.
+        """
+        runner = web.AppRunner(self.app, handle_signals=False)
+        await runner.setup()
+        if sock is None:
+            site = web.TCPSite(runner, self._host, self._port, reuse_port=reuse_port)
+        else:
+            site = web.SockSite(runner, sock)
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopping.set)
+        try:
+            await site.start()
+            print('======== Running on {} (pid {}) ========'.format(site.name, os.getpid()))
+            await stopping.wait()
+            await site.stop()
+            if self.scheduler.running() + self.scheduler.pending() > 0:
+                print('waiting for {} jobs to finish'.format(
+                    self.scheduler.running() + self.scheduler.pending()))
+            await self.scheduler.join()
+            await asyncio.gather(*self._coordinators)
+        finally:
+            await runner.cleanup()
+
+    def run(self, sock=None, reuse_port=False):
+        asyncio.run(self.serve(sock=sock, reuse_port=reuse_port))
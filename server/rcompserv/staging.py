@@ -0,0 +1,324 @@
+"""Staging of input files of jobs
+
+Files that are given in argv of a job are materialized before the job
+is started. Files that are not larger than a threshold are kept in
+memory as anonymous files (memfd), which are inherited by the
+subprocess and appear in its argv as /dev/fd/N, so staging does not
+touch the disk. Larger files, and all files on platforms without
+memfd, are written to a temporary directory, which can be on tmpfs,
+e.g., /dev/shm.
+
+Writes to disk and removal of staged files are blocking, so callers on
+the event loop should do them through the coroutines of this module,
+which run them in the default executor.
+
+Compressed file data are decoded incrementally (cf. Decoder), so that
+neither the whole compressed nor the whole decompressed file has to be
+in memory at once, and sizes are checked against SizeLimits as data
+are decompressed, so that small uploads that decompress to huge files
+are rejected early. Decoding takes CPU time, so callers on the event
+loop should run it in an executor, e.g., Server.staging_pool.
+"""
+import asyncio
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+import zlib
+
+
+# Maximum size (bytes) of a file that is kept in memory
+MEMORY_THRESHOLD = 8*2**20
+
+# Maximum size (bytes) of pieces in which files are decompressed
+DECODED_CHUNK_SIZE = 2**16
+
+# Size (characters) of pieces in which base64 encoded files are
+# decoded, which is a multiple of 4, so that pieces decode separately
+ENCODED_CHUNK_SIZE = 4*2**14
+
+
+class InputTooLarge(Exception):
+    """raised if decompressed input files exceed SizeLimits.
+
+    `limit` is the limit (bytes) that was exceeded, and `size` is the
+    size (bytes) that was read when it was exceeded. Decompression
+    stops there, so the whole input can be larger.
+    """
+    def __init__(self, message, limit, size):
+        super().__init__(message)
+        self.limit = limit
+        self.size = size
+
+
+class SizeLimits:
+    def __init__(self, max_file_bytes=None, max_job_bytes=None):
+        """limits of decompressed sizes (bytes) of each input file and
+        of all input files of one job. None means no limit.
+        """
+        self.max_file_bytes = max_file_bytes
+        self.max_job_bytes = max_job_bytes
+        self.job_bytes = 0
+
+    def add(self, file_bytes, n):
+        """account for `n` more bytes of a file that has `file_bytes`.
+
+        raise InputTooLarge if a limit is exceeded.
+        """
+        if self.max_file_bytes is not None and file_bytes + n > self.max_file_bytes:
+            raise InputTooLarge('input file is larger than {} bytes'.format(self.max_file_bytes),
+                                self.max_file_bytes, file_bytes + n)
+        if self.max_job_bytes is not None and self.job_bytes + n > self.max_job_bytes:
+            raise InputTooLarge('input files are larger than {} bytes in total'.format(
+                self.max_job_bytes), self.max_job_bytes, self.job_bytes + n)
+        self.job_bytes += n
+
+
+class Decoder:
+    def __init__(self, decompressor, limits, staged_file=None):
+        """incremental decoding of one compressed file.
+
+        `decompressor` is as from compression.decompressor(). Contents
+        are hashed and, if `staged_file` is given, written to it in
+        pieces of at most DECODED_CHUNK_SIZE bytes if `decompressor`
+        supports that, like zlib does, or pieces of the size that it
+        chooses if it has method decompress_to(), like zstd does.
+        """
+        self._decompressor = decompressor
+        self._limits = limits
+        self._staged_file = staged_file
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.compressed_size = 0
+
+    def _write(self, data):
+        if len(data) == 0:
+            return
+        self._limits.add(self.size, len(data))
+        self._hash.update(data)
+        if self._staged_file is not None:
+            self._staged_file.write(data)
+        self.size += len(data)
+
+    def feed(self, data):
+        """decompress `data` and write the result. This blocks."""
+        for _ in self.pieces(data):
+            pass
+
+    def pieces(self, data):
+        """as feed(), but generate after each piece of the result is
+        written, so that callers can stop and resume, e.g., in another
+        thread.
+        """
+        self.compressed_size += len(data)
+        if hasattr(self._decompressor, 'decompress_to'):
+            self._decompressor.decompress_to(data, self._write)
+            yield
+        elif hasattr(self._decompressor, 'unconsumed_tail'):
+            while len(data) > 0:
+                self._write(self._decompressor.decompress(data, DECODED_CHUNK_SIZE))
+                data = self._decompressor.unconsumed_tail
+                yield
+        else:
+            self._write(self._decompressor.decompress(data))
+            yield
+
+    def finish(self):
+        """write the rest of the file and return SHA-256 digest of it"""
+        self._write(self._decompressor.flush())
+        if not getattr(self._decompressor, 'eof', True):
+            raise zlib.error('incomplete compressed data')
+        return self._hash.digest()
+
+
+def decode(data, limits, staged_file=None):
+    """decode file from base64 encoded zlib compressed `data` (`str`),
+    as in argv of jobs in JSON requests.
+
+    return triple of compressed size, size, and SHA-256 digest of the
+    contents, which are written to `staged_file` if it is given. This
+    blocks.
+
+    raise ValueError or zlib.error if `data` are malformed, and
+    InputTooLarge if the file exceeds `limits`.
+    """
+    return run(decode_pieces(data, limits, staged_file))
+
+
+def decode_pieces(data, limits, staged_file=None):
+    """as decode(), but return generator that generates after each
+    piece of the file is written (cf. Decoder.pieces()), and whose
+    value is that of decode().
+    """
+    decoder = Decoder(zlib.decompressobj(), limits, staged_file)
+    for start in range(0, len(data), ENCODED_CHUNK_SIZE):
+        yield from decoder.pieces(
+            base64.b64decode(data[start:start+ENCODED_CHUNK_SIZE], validate=True))
+    file_digest = decoder.finish()
+    return decoder.compressed_size, decoder.size, file_digest
+
+
+def run(pieces):
+    """run generator `pieces`, e.g., from decode_pieces(), to its end
+    and return its value. This blocks.
+    """
+    while True:
+        try:
+            next(pieces)
+        except StopIteration as stop:
+            return stop.value
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while len(view) > 0:
+        view = view[os.write(fd, view):]
+
+
+class StagedFile:
+    """file that is being written, e.g., as it arrives in a request"""
+    def __init__(self, inputs):
+        self._inputs = inputs
+        self._fd = None
+        self.in_memory = False
+        self.size = 0
+
+    def write(self, data):
+        """append `data`, moving the file to disk if it becomes too large"""
+        size = self.size + len(data)
+        if self._fd is None:
+            if self._inputs.fits_in_memory(size):
+                self._fd = self._inputs.memfd()
+                self.in_memory = True
+            else:
+                self._fd = self._inputs.disk_file()
+        elif self.in_memory and not self._inputs.fits_in_memory(size):
+            self._spill()
+        _write_all(self._fd, data)
+        self.size = size
+
+    def _spill(self):
+        data = os.pread(self._fd, self.size, 0)
+        self._inputs.release(self._fd)
+        self._fd = self._inputs.disk_file()
+        self.in_memory = False
+        _write_all(self._fd, data)
+
+    def close(self):
+        """return path of the file, which is usable by subprocesses of the job"""
+        if self._fd is None:
+            # Empty file
+            self.write(b'')
+        return self._inputs.path(self._fd)
+
+
+class Inputs:
+    def __init__(self, memory_threshold=MEMORY_THRESHOLD, directory=None):
+        """files of one job.
+
+        files of at most `memory_threshold` bytes are kept in memory
+        if the platform supports memfd. If `memory_threshold` is None,
+        then all files are written to disk. Other files are written to
+        a temporary directory under `directory`, or if it is None, the
+        default of the module `tempfile`.
+
+        Subprocesses must be started with `pass_fds=inputs.fds`.
+        """
+        self.memory_threshold = memory_threshold
+        self.directory = directory
+        self.fds = []
+        self.temporary_dir = None
+        self._disk_fds = dict()
+        self._users = 1
+
+    def fits_in_memory(self, size):
+        return (self.memory_threshold is not None
+                and size <= self.memory_threshold
+                and hasattr(os, 'memfd_create'))
+
+    def memfd(self):
+        # Descriptors are not inherited, except by the subprocess of
+        # this job through pass_fds.
+        fd = os.memfd_create('rcomp-input', os.MFD_CLOEXEC)
+        self.fds.append(fd)
+        return fd
+
+    def disk_file(self):
+        if self.temporary_dir is None:
+            self.temporary_dir = tempfile.mkdtemp(prefix='rcomp-', dir=self.directory)
+        fd, fname = tempfile.mkstemp(dir=self.temporary_dir)
+        self._disk_fds[fd] = fname
+        return fd
+
+    def on_disk(self):
+        return self.temporary_dir is not None
+
+    def path(self, fd):
+        if fd in self._disk_fds:
+            fname = self._disk_fds.pop(fd)
+            os.close(fd)
+            return fname
+        return '/dev/fd/{}'.format(fd)
+
+    def release(self, fd):
+        self.fds.remove(fd)
+        os.close(fd)
+
+    def open(self):
+        """return new StagedFile"""
+        return StagedFile(self)
+
+    def write(self, data):
+        """stage file with contents `data` and return its path"""
+        staged_file = self.open()
+        staged_file.write(data)
+        return staged_file.close()
+
+    def share(self):
+        """add a user of the files, e.g., another job, and return self.
+
+        files are only removed once remove() was called by all users.
+        """
+        self._users += 1
+        return self
+
+    def remove(self):
+        """close files that are in memory and remove those on disk"""
+        self._users -= 1
+        if self._users > 0:
+            return
+        for fd in self.fds:
+            os.close(fd)
+        self.fds = []
+        for fd in self._disk_fds:
+            os.close(fd)
+        self._disk_fds = dict()
+        if self.temporary_dir is not None:
+            shutil.rmtree(self.temporary_dir, ignore_errors=True)
+            self.temporary_dir = None
+
+
+async def write_files(inputs, argv, files):
+    """stage files whose contents are values of `dict` `files`, which
+    maps indices of argv to them, and put their paths in argv.
+
+    return argv.
+    """
+    def write():
+        for ii, data in sorted(files.items()):
+            argv[ii] = inputs.write(data)
+        return argv
+    if all(inputs.fits_in_memory(len(data)) for data in files.values()):
+        return write()
+    return await asyncio.get_running_loop().run_in_executor(None, write)
+
+
+async def remove(inputs):
+    """remove `inputs` (if not None) without blocking the event loop"""
+    if inputs is None:
+        return
+    if not inputs.on_disk() or inputs._users > 1:
+        inputs.remove()
+    else:
+        await asyncio.get_running_loop().run_in_executor(None, inputs.remove)
@@ -0,0 +1,111 @@
+"""Timelines of jobs
+
+The trace of a job is a hash in Redis (cf. records.trace_key()) that
+maps names of events in the life of the job to JSON objects with the
+time `t` of the event and other fields, e.g., sizes of input files.
+Each event is recorded at most once.
+
+Times are seconds since the epoch, but they are read from a monotonic
+clock that is anchored to the wall clock when the process starts (cf.
+now()). So durations within one process are not affected by changes
+of the system clock, and times from different processes, e.g., of an
+API server and a worker, are comparable up to synchronization of the
+clocks of their hosts.
+
+Events that happen before the job has an ID, e.g., while its request
+is read, are collected in a Trace object and saved once the ID is known.
+"""
+import json
+import time
+
+from . import records
+
+
+# The request that submitted the job arrived.
+RECEIVED = 'received'
+# The body of the request was read.
+BODY_READ = 'body_read'
+# Input files were decoded and staged; fields `files`,
+# `compressed_bytes`, and `decompressed_bytes`.
+STAGED = 'staged'
+# The subprocess started; field `pid`.
+SPAWNED = 'spawned'
+# The subprocess exited; fields `exitcode`, `max_rss_bytes` (None if
+# it is not known, cf. process.Process.usage()), `user_seconds`, and
+# `system_seconds`.
+EXITED = 'exited'
+# The result was written to the job record.
+PERSISTED = 'persisted'
+# The status of the job was first read after it was done.
+FIRST_READ = 'first_read'
+
+# Phases of jobs, i.e., durations between pairs of events
+PHASES = [
+    ('request', RECEIVED, BODY_READ),
+    ('staging', BODY_READ, STAGED),
+    ('waiting', STAGED, SPAWNED),
+    ('running', SPAWNED, EXITED),
+    ('persisting', EXITED, PERSISTED),
+    ('delivery', PERSISTED, FIRST_READ)
+]
+
+_ANCHOR = time.time() - time.monotonic()
+
+
+def now():
+    """return current time (seconds since the epoch) from the monotonic clock"""
+    return _ANCHOR + time.monotonic()
+
+
+def event(t=None, **fields):
+    """return JSON of event at time `t` (default now()) with `fields`"""
+    return json.dumps(dict(fields, t=(now() if t is None else t)))
+
+
+class Trace:
+    def __init__(self, received=None):
+        """events of a job that does not have an ID yet.
+
+        `received` is the time at which its request arrived, if any.
+        """
+        self.events = dict()
+        if received is not None:
+            self.events[RECEIVED] = event(received)
+
+    def mark(self, name, **fields):
+        self.events[name] = event(**fields)
+
+    def copy(self):
+        """return Trace with the events of this one, e.g., for each job
+        of a request that submits several jobs.
+        """
+        other = Trace()
+        other.events = dict(self.events)
+        return other
+
+    async def save(self, redis, job_id):
+        if len(self.events) > 0:
+            await redis.hset(records.trace_key(job_id), mapping=self.events)
+
+
+def timeline(trace):
+    """return `dict` with events of `trace` (from Redis) in order and phases.
+
+    each event has the field `elapsed`, which is the time (seconds)
+    since the first event. Phases whose events were both recorded map
+    to their durations.
+    """
+    events = []
+    times = dict()
+    for name, value in trace.items():
+        name = str(name, encoding='utf-8')
+        fields = json.loads(value)
+        times[name] = fields['t']
+        events.append(dict(fields, event=name))
+    events.sort(key=lambda e: e['t'])
+    for e in events:
+        e['elapsed'] = e['t'] - events[0]['t']
+    phases = {phase: times[end] - times[start]
+              for phase, start, end in PHASES
+              if start in times and end in times}
+    return {'events': events, 'phases': phases}
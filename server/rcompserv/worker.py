@@ -0,0 +1,288 @@
+"""Worker processes that run jobs taken from the Redis queue
+
+API servers that are started with dispatch 'queue' only record jobs
+and append them to the queue (cf. jobqueue.py). Each worker takes jobs
+from the queue as long as it has capacity, runs them as subprocesses
+exactly like a server with local dispatch would, and writes results
+back to the job records. Workers can be on hosts other than those of
+API servers, e.g.,
+
+    rcompserv --redis redis://10.0.0.2:6379/0 --max-jobs 8 worker
+"""
+import asyncio
+import binascii
+from datetime import datetime
+import json
+import os
+import signal
+import socket
+import uuid
+import zlib
+
+from aiohttp import web
+from redis.exceptions import RedisError
+
+from . import jobqueue
+from . import staging
+from . import trace
+from .serv import Server
+
+
+class Worker(Server):
+    def __init__(self, worker_id=None, heartbeat_interval=5, heartbeat_ttl=15, **kwargs):
+        """
+        `heartbeat_ttl` is the duration (seconds) after the most
+        recent heartbeat at which this worker is considered dead by
+        other workers, which then requeue jobs that it had taken. If
+        this worker cannot renew its heartbeat before then, it stops
+        (cf. lose_heartbeat()).
+        Other keyword arguments are passed to Server, e.g., to set
+        limits on the number of jobs running at once.
+        """
+        kwargs['dispatch'] = 'local'
+        kwargs.setdefault('max_queue', None)
+        super().__init__(**kwargs)
+        if worker_id is None:
+            worker_id = '{}:{}:{}'.format(socket.gethostname(), os.getpid(),
+                                          uuid.uuid4().hex[:8])
+        self.worker_id = worker_id
+        self._heartbeat_interval = heartbeat_interval
+        self._heartbeat_ttl = heartbeat_ttl
+        self._stopping = None
+        self._lost_heartbeat = False
+
+    async def keep_heartbeat(self):
+        """renew heartbeat of this worker and requeue jobs of dead workers.
+
+        failures to reach Redis are retried until the heartbeat would
+        expire before the next attempt, in which case lose_heartbeat()
+        is called.
+        """
+        loop = asyncio.get_running_loop()
+        renewed = loop.time()
+        while True:
+            try:
+                await jobqueue.heartbeat(self.app['redis'], self.worker_id,
+                                         self._heartbeat_ttl)
+                renewed = loop.time()
+                for job_id in await jobqueue.requeue_dead(self.app['redis']):
+                    print('WARNING: requeued job {} of dead worker'.format(job_id))
+            except RedisError as err:
+                print('WARNING: failed to renew heartbeat of worker {}: {}'.format(
+                    self.worker_id, err))
+                if loop.time() + self._heartbeat_interval - renewed >= self._heartbeat_ttl:
+                    self.lose_heartbeat()
+                    return
+            await asyncio.sleep(self._heartbeat_interval)
+
+    def lose_heartbeat(self):
+        """stop taking jobs, and cancel jobs that were taken.
+
+        other workers consider this worker dead and run its jobs again
+        (cf. jobqueue.requeue_dead()), so results of jobs of this worker
+        are no longer written, and its jobs stay in its processing list.
+        """
+        print('WARNING: heartbeat of worker {} expired; cancelling its jobs'.format(
+            self.worker_id))
+        self._lost_heartbeat = True
+        self._stopping.set()
+        if self.result_cache:
+            # Claims expire, so that other workers run attached jobs.
+            asyncio.ensure_future(self.result_cache.stop())
+        for job_id in list(self._children) + self.scheduler.job_ids():
+            self.cancel_local(job_id)
+
+    async def finish_job(self, job_id, result, digest=None, job_trace=None):
+        if self._lost_heartbeat:
+            # Coordinators of races and pipelines still wait for results.
+            future = self._child_results.pop(job_id, None)
+            if future is not None and not future.done():
+                future.set_result(result)
+            return
+        await super().finish_job(job_id, result, digest=digest, job_trace=job_trace)
+
+    async def release(self, job_id):
+        """remove job from processing list of this worker, unless it
+        is left for other workers to requeue
+        """
+        if not self._lost_heartbeat:
+            await jobqueue.release(self.app['redis'], self.worker_id, job_id)
+
+    async def run_queued_job(self, job_id, command, argv, timeout=None, digest=None,
+                             submitted=None):
+        if self._lost_heartbeat:
+            # Cancelled by lose_heartbeat() while queued
+            return
+        job_trace = trace.Trace()
+        try:
+            try:
+                inputs, argv = await self.map_files(command, argv, job_trace=job_trace)
+            except (binascii.Error, zlib.error, ValueError, TypeError, IndexError):
+                await self.fail_job(job_id, 'error (malformed input files)', digest=digest)
+                return
+            except staging.InputTooLarge:
+                await self.fail_job(job_id, 'error (input files too large)', digest=digest)
+                return
+            await self.app['redis'].hset(job_id, mapping={
+                'cmd': ' '.join([command]+argv),
+                'worker': self.worker_id
+            })
+            await self.generic_task(job_id, [command]+argv,
+                                    inputs=inputs,
+                                    timeout=timeout,
+                                    digest=digest,
+                                    submitted=submitted,
+                                    job_trace=job_trace)
+            await self.app['redis'].hdel(job_id, 'argv')
+        finally:
+            await self.release(job_id)
+
+    async def run_queued_race(self, job_id, command, argv, variants, timeout=None,
+                              client=None, priority=0):
+        """run race job, whose variants share files that are staged once"""
+        job_trace = trace.Trace()
+        try:
+            try:
+                inputs, argv = await self.map_files(command, argv, job_trace=job_trace)
+            except (binascii.Error, zlib.error, ValueError, TypeError, IndexError):
+                await self.fail_job(job_id, 'error (malformed input files)')
+                return
+            except staging.InputTooLarge:
+                await self.fail_job(job_id, 'error (input files too large)')
+                return
+            await self.app['redis'].hset(job_id, 'worker', self.worker_id)
+            await job_trace.save(self.app['redis'], job_id)
+            try:
+                finishing = await self.start_race(job_id, command, argv, variants,
+                                                  inputs=inputs,
+                                                  timeout=timeout,
+                                                  client=client,
+                                                  priority=priority)
+            except web.HTTPTooManyRequests:
+                await self.fail_job(job_id, 'error (job queue is full)')
+                return
+            await finishing
+            await self.app['redis'].hdel(job_id, 'argv')
+        finally:
+            await self.release(job_id)
+
+    async def run_queued_pipeline(self, job_id, steps, timeout=None, client=None, priority=0):
+        """run steps of pipeline job, which are submitted to the scheduler of this worker"""
+        try:
+            await self.app['redis'].hset(job_id, 'worker', self.worker_id)
+            finishing = await self.start_pipeline(job_id, steps,
+                                                  timeout=timeout,
+                                                  client=client,
+                                                  priority=priority)
+            await finishing
+        finally:
+            await self.release(job_id)
+
+    async def take_job(self):
+        """take one job from the queue and submit it to the scheduler.
+
+        return False if no job was available, otherwise True.
+        """
+        redis = self.app['redis']
+        job_id = await jobqueue.take(redis, self.worker_id)
+        if job_id is None:
+            return False
+        (command, argv, timeout, digest, submitted, client, priority, cancel,
+         race, pipeline) = await redis.hmget(job_id, 'command', 'argv', 'timeout', 'digest',
+                                             'stime', 'client', 'priority', 'cancel', 'race',
+                                             'pipeline')
+        if command is None or argv is None:
+            # Record was deleted or the job is not from the queue.
+            await jobqueue.release(redis, self.worker_id, job_id)
+            return True
+        if cancel is not None:
+            # Cancelled after it was taken from the queue, e.g., by a
+            # worker that died.
+            if digest is not None:
+                digest = str(digest, encoding='utf-8')
+            await self.fail_job(job_id, 'cancelled', digest=digest)
+            await jobqueue.release(redis, self.worker_id, job_id)
+            return True
+        command = str(command, encoding='utf-8')
+        argv = json.loads(str(argv, encoding='utf-8'))
+        if timeout is not None:
+            timeout = int(timeout)
+        if digest is not None:
+            digest = str(digest, encoding='utf-8')
+        if submitted is not None:
+            submitted = datetime.fromisoformat(str(submitted, encoding='utf-8'))
+        if client is not None:
+            client = str(client, encoding='utf-8')
+        priority = 0 if priority is None else int(priority)
+        if pipeline is not None:
+            # Steps, not the pipeline job, wait in the scheduler.
+            task = asyncio.ensure_future(self.run_queued_pipeline(
+                job_id, json.loads(pipeline),
+                timeout=timeout, client=client, priority=priority))
+            self._coordinators.add(task)
+            task.add_done_callback(self._coordinators.discard)
+            return True
+        if command not in self.known_commands:
+            await self.fail_job(job_id, 'error (command not supported by worker)',
+                                digest=digest)
+            await jobqueue.release(redis, self.worker_id, job_id)
+            return True
+        if race is not None:
+            # Variants, not the race job, wait in the scheduler.
+            task = asyncio.ensure_future(self.run_queued_race(
+                job_id, command, argv, json.loads(race),
+                timeout=timeout, client=client, priority=priority))
+            self._coordinators.add(task)
+            task.add_done_callback(self._coordinators.discard)
+            return True
+        if digest is not None and self.result_cache:
+            # Jobs with the same digest stay attached while this runs.
+            self.result_cache.hold(digest, job_id)
+        self.scheduler.submit(job_id, command,
+                              lambda: self.run_queued_job(job_id, command, argv,
+                                                          timeout=timeout,
+                                                          digest=digest,
+                                                          submitted=submitted),
+                              client=client,
+                              priority=priority)
+        return True
+
+    async def work(self):
+        """take and run jobs until SIGINT or SIGTERM is received.
+
+        after a signal, no more jobs are taken, and jobs that are
+        running are allowed to finish.
+        """
+        self._stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self._stopping.set)
+        await self.start_redis(self.app)
+        await self.start_metrics(self.app)
+        await self.start_lag_monitor(self.app)
+        await self.probe_tools(self.app)
+        await self.start_events(self.app)
+        await self.start_result_cache(self.app)
+        heartbeat = asyncio.ensure_future(self.keep_heartbeat())
+        try:
+            while not self._stopping.is_set():
+                await self.scheduler.wait_for_capacity()
+                if self._stopping.is_set():
+                    break
+                await self.take_job()
+            await self.scheduler.join()
+            await asyncio.gather(*self._coordinators)
+        finally:
+            heartbeat.cancel()
+            if not self._lost_heartbeat:
+                await jobqueue.retire(self.app['redis'], self.worker_id)
+            await self.stop_probing(self.app)
+            await self.stop_lag_monitor(self.app)
+            await self.stop_result_cache(self.app)
+            await self.stop_staging(self.app)
+            await self.stop_events(self.app)
+            await self.stop_metrics(self.app)
+            await self.stop_redis(self.app)
+
+    def run(self):
+        asyncio.run(self.work())
@@ -7,6 +7,16 @@ e.g., Gunicorn <http://gunicorn.org/>, which can be used by
 Requests can be sent to <http://127.0.0.1:8000>, e.g.,
 
     curl http://127.0.0.1:8000/
+
+To only enqueue jobs for `rcompserv worker` processes instead of
+running them in the gunicorn workers, set the environment variable
+RCOMPSERV_DISPATCH=queue.
+
+Each gunicorn worker probes the tools of commands when it starts, but
+results are cached in Redis per host (cf. probes.py), so only the first
+worker to start after a tool changed runs it.
 """
+import os
+
 from .serv import Server
-main = Server().app
+main = Server(dispatch=os.environ.get('RCOMPSERV_DISPATCH', 'local')).app
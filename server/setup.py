@@ -24,8 +24,13 @@ setup(name='rcompserv',
       license='BSD',
       description='',
       packages=['rcompserv'],
-      install_requires=['aiohttp', 'redis'],
+      python_requires='>=3.9',
+      install_requires=['aiohttp', 'redis>=5.0.1'],
       entry_points={'console_scripts': ['rcompserv = rcompserv.cli:main']},
       classifiers=['Programming Language :: Python :: 3',
-                   'Programming Language :: Python :: 3.5']
+                   'Programming Language :: Python :: 3 :: Only',
+                   'Programming Language :: Python :: 3.9',
+                   'Programming Language :: Python :: 3.10',
+                   'Programming Language :: Python :: 3.11',
+                   'Programming Language :: Python :: 3.12']
       )
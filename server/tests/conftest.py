@@ -0,0 +1,38 @@
+"""Fixtures of tests of rcompserv
+
+Tests use the harness of bench/bench.py, i.e., fake `gr1c` and
+`ltl2ba` executables and a server with jobs in the Redis stand-in of
+`fakeredis`. The fake tools run for RCOMP_BENCH_RUNTIME seconds, which
+tests can change with monkeypatch.setenv().
+"""
+import asyncio
+import os.path
+import sys
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bench'))
+import bench
+
+
+@pytest.fixture(scope='session', autouse=True)
+def fake_tools():
+    return bench.install_fake_tools(runtime=0, output_bytes=64)
+
+
+@pytest.fixture
+def serve():
+    """return function that runs coroutine function `test` with a new
+    bench.InMemoryServer and a TestClient of it.
+    """
+    def run(test, **kwargs):
+        async def main():
+            server = bench.InMemoryServer(**kwargs)
+            async with TestClient(TestServer(server.app)) as client:
+                await test(server, client)
+                await server.scheduler.join()
+                await asyncio.gather(*server._coordinators)
+        asyncio.run(main())
+    return run
+
@@ -0,0 +1,62 @@
+import base64
+import zlib
+
+
+SPEC = str(base64.b64encode(zlib.compress(b'spec')), encoding='utf-8')
+
+
+def test_batch(serve):
+    async def test(server, client):
+        jobs = [{'command': 'gr1c', 'argv': ['-r', SPEC]},
+                {'command': 'ltl2ba', 'argv': ['-f', '[]<>p'], 'timeout': 10},
+                {'command': 'nope', 'argv': []},
+                {'command': 'gr1c', 'argv': ['-r', 'not base64!']}]
+        res = await client.post('/batch', json={'jobs': jobs})
+        assert res.status == 200
+        resp = (await res.json())['jobs']
+        assert len(resp) == 4
+        assert resp[0]['cmd'].startswith('gr1c')
+        assert resp[1]['cmd'].startswith('ltl2ba')
+        assert 'err' in resp[2]
+        assert 'err' in resp[3]
+        for msg in resp[:2]:
+            msg = await (await client.get('/status/' + msg['id'] + '?wait=10')).json()
+            assert msg['status'] == 'success'
+    serve(test, max_jobs=4)
+
+
+def test_batch_malformed_argv(serve):
+    async def test(server, client):
+        jobs = [{'command': 'gr1c', 'argv': ['-r', SPEC]},
+                {'command': 'gr1c', 'argv': ['-r', '']},
+                {'command': 'gr1c', 'argv': ['-r', 1]},
+                {'command': 'ltl2ba', 'argv': '-f'},
+                {'command': 'gr1c', 'argv': ['-r', SPEC]}]
+        res = await client.post('/batch', json={'jobs': jobs})
+        assert res.status == 200
+        resp = (await res.json())['jobs']
+        assert resp[1] == resp[2] == resp[3] == {'err': 'argv must be a list of nonempty strings'}
+        # Jobs around malformed ones are submitted, and their IDs are sent.
+        for msg in (resp[0], resp[4]):
+            msg = await (await client.get('/status/' + msg['id'] + '?wait=10')).json()
+            assert msg['status'] == 'success'
+    serve(test, max_jobs=4)
+
+
+def test_batch_limits(serve):
+    async def test(server, client):
+        res = await client.post('/batch', json={'jobs': {}})
+        assert res.status == 400
+        res = await client.post('/batch', json={'jobs': [{'command': 'gr1c'}]*3})
+        assert res.status == 400
+        assert 'err' in await res.json()
+    serve(test, max_batch=2)
+
+
+def test_malformed_argv(serve):
+    async def test(server, client):
+        for argv in (['-r', ''], [''], ['-r', None]):
+            res = await client.post('/gr1c', json={'argv': argv})
+            assert res.status == 400
+            assert (await res.json())['err'] == 'argv must be a list of nonempty strings'
+    serve(test)
@@ -0,0 +1,54 @@
+import asyncio
+import base64
+import zlib
+
+
+async def submit(client, spec=b'spec'):
+    spec = str(base64.b64encode(zlib.compress(spec)), encoding='utf-8')
+    res = await client.post('/gr1c', json={'argv': ['-r', spec]})
+    assert res.status == 200
+    return (await res.json())['id']
+
+
+def test_cancel(serve, monkeypatch):
+    monkeypatch.setenv('RCOMP_BENCH_RUNTIME', '2')
+
+    async def test(server, client):
+        running = await submit(client)
+        queued = await submit(client, b'other spec')
+        await asyncio.sleep(0.2)
+        assert server.scheduler.position(running) == 0
+        assert server.scheduler.position(queued) == 1
+
+        res = await client.delete('/status/' + queued)
+        assert res.status == 200
+        assert (await res.json())['status'] == 'cancelled'
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        res = await client.delete('/status/' + running)
+        msg = await res.json()
+        assert msg['done'] and msg['status'] == 'cancelled'
+        # The subprocess was killed, and its slot is freed.
+        await asyncio.wait_for(server.scheduler.join(), 1)
+        assert loop.time() - start < 1
+        assert server._processes == dict()
+
+        # Cancelling again, or a job that is done, does not change it.
+        res = await client.delete('/status/' + running)
+        assert (await res.json())['status'] == 'cancelled'
+        res = await client.delete('/status/nope')
+        assert res.status == 404
+        assert server._cancelled == set()
+    serve(test, max_jobs=1)
+
+
+def test_cancel_done(serve):
+    async def test(server, client):
+        job_id = await submit(client)
+        msg = await (await client.get('/status/' + job_id + '?wait=10')).json()
+        assert msg['status'] == 'success'
+        res = await client.delete('/status/' + job_id)
+        assert res.status == 200
+        assert (await res.json())['status'] == 'success'
+    serve(test)
@@ -0,0 +1,83 @@
+import asyncio
+import base64
+import json
+import zlib
+
+import fakeredis
+
+from rcompserv import events
+
+
+SPEC = str(base64.b64encode(zlib.compress(b'spec')), encoding='utf-8')
+
+
+def test_job_events():
+    async def main():
+        redis = fakeredis.FakeAsyncRedis()
+        cancelled = ([], [])
+        a = events.JobEvents(on_cancel=cancelled[0].append)
+        b = events.JobEvents(on_cancel=cancelled[1].append)
+        await a.start(redis)
+        await b.start(redis)
+        try:
+            await asyncio.sleep(0.1)
+            queue = await a.subscribe('job')
+            assert set(await redis.pubsub_channels()) == {b'rcomp:cancel', b'rcomp:job:job'}
+            await redis.publish(events.channel('job'), events.OUTPUT)
+            await redis.publish(events.channel('job'), 'done')
+            assert await events.wait_for_state(queue, 1) == 'done'
+            # Only processes with waiters subscribe to channels of jobs.
+            assert await redis.pubsub_numsub(events.channel('job')) == [(b'rcomp:job:job', 1)]
+            await a.unsubscribe('job', queue)
+            await asyncio.sleep(0.1)
+            assert await redis.pubsub_channels() == [b'rcomp:cancel']
+
+            # Requests to cancel reach all processes.
+            await redis.publish(events.CANCEL_CHANNEL, 'other')
+            await asyncio.sleep(0.1)
+            assert cancelled == (['other'], ['other'])
+        finally:
+            await a.stop()
+            await b.stop()
+    asyncio.run(main())
+
+
+def test_long_poll(serve, monkeypatch):
+    monkeypatch.setenv('RCOMP_BENCH_RUNTIME', '0.5')
+
+    async def test(server, client):
+        job_id = (await (await client.post('/gr1c', json={'argv': ['-r', SPEC]})).json())['id']
+        msg = await (await client.get('/status/' + job_id + '?wait=0.1')).json()
+        assert not msg['done']
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        msg = await (await client.get('/status/' + job_id + '?wait=10')).json()
+        assert msg['done'] and msg['status'] == 'success'
+        assert loop.time() - start < 2
+        res = await client.get('/status/' + job_id + '?wait=nope')
+        assert res.status == 400
+        res = await client.get('/status/nope?wait=1')
+        assert res.status == 404
+        assert await server.app['redis'].pubsub_channels() == [b'rcomp:cancel']
+    serve(test, max_jobs=4)
+
+
+def test_server_sent_events(serve, monkeypatch):
+    monkeypatch.setenv('RCOMP_BENCH_RUNTIME', '0.5')
+
+    async def test(server, client):
+        job_id = (await (await client.post('/gr1c', json={'argv': ['-r', SPEC]})).json())['id']
+        res = await client.get('/status/' + job_id + '/events')
+        assert res.status == 200
+        assert res.headers['Content-Type'] == 'text/event-stream'
+        statuses = []
+        for block in (await res.text()).split('\n\n'):
+            lines = block.splitlines()
+            if len(lines) == 2 and lines[0] == 'event: status':
+                statuses.append(json.loads(lines[1][len('data: '):]))
+        assert statuses[0]['state'] == 'running'
+        assert statuses[-1]['done'] and statuses[-1]['status'] == 'success'
+        assert all(not msg['done'] for msg in statuses[:-1])
+        res = await client.get('/status/nope/events')
+        assert res.status == 404
+    serve(test, max_jobs=4)
@@ -0,0 +1,99 @@
+import asyncio
+
+import bench
+import fakeredis
+
+from rcompserv import jobqueue
+from rcompserv import records
+from rcompserv.worker import Worker
+
+def test_requeue_dead():
+    async def main():
+        redis = fakeredis.FakeAsyncRedis()
+        for job_id in ('a', 'b', 'c'):
+            await jobqueue.enqueue(redis, job_id, 'gr1c', ['-r', 'spec'])
+        await jobqueue.heartbeat(redis, 'dead', 10)
+        await jobqueue.heartbeat(redis, 'alive', 10)
+        assert await jobqueue.take(redis, 'dead') == 'a'
+        assert await jobqueue.take(redis, 'alive') == 'b'
+        # Partial run of the dead worker
+        await redis.append(records.output_key('a'), b'partial')
+        await redis.append(records.stderr_key('a'), b'partial')
+        await redis.hset('a', mapping={'state': 'running', 'worker': 'dead',
+                                       'output_size': 7, 'output_digest': 'x'})
+
+        assert await jobqueue.requeue_dead(redis) == []
+        await redis.delete(jobqueue.heartbeat_key('dead'))
+        assert await jobqueue.requeue_dead(redis) == ['a']
+
+        assert not await redis.exists(records.output_key('a'), records.stderr_key('a'))
+        record = await redis.hgetall('a')
+        assert record[b'state'] == b'queued'
+        assert record[b'attempts'] == b'1'
+        assert not {b'worker', b'output_size', b'output_digest'} & set(record)
+        assert await redis.smembers(jobqueue.WORKERS_KEY) == {b'alive'}
+        assert await redis.lrange(jobqueue.processing_key('dead'), 0, -1) == []
+        assert await redis.lrange(jobqueue.processing_key('alive'), 0, -1) == [b'b']
+        # The requeued job is taken before jobs that were queued later.
+        assert await jobqueue.take(redis, 'alive') == 'a'
+        assert await jobqueue.position(redis, 'c') == 1
+        assert await jobqueue.requeue_dead(redis) == []
+    asyncio.run(main())
+
+
+def test_worker(serve, monkeypatch):
+    shared = fakeredis.FakeServer()
+
+    async def start_redis(self, app):
+        app['redis'] = fakeredis.FakeAsyncRedis(server=shared)
+    # The API server and the worker share one Redis stand-in.
+    monkeypatch.setattr(bench.InMemoryServer, 'start_redis', start_redis)
+    monkeypatch.setattr(Worker, 'start_redis', start_redis)
+
+    async def test(server, client):
+        res = await client.post('/ltl2ba', json={'argv': ['-f', '[]<>p']})
+        assert res.status == 200
+        job_id = (await res.json())['id']
+        msg = await (await client.get('/status/' + job_id)).json()
+        assert msg['state'] == 'queued'
+
+        worker = Worker(worker_id='w', heartbeat_interval=0.1)
+        work = asyncio.ensure_future(worker.work())
+        msg = await (await client.get('/status/' + job_id + '?wait=10')).json()
+        assert msg['status'] == 'success'
+        assert msg['cmd'] == 'ltl2ba -f []<>p'
+        assert await server.app['redis'].smembers(jobqueue.WORKERS_KEY) == {b'w'}
+        worker._stopping.set()
+        await asyncio.wait_for(work, 5)
+        # The worker retired once it stopped.
+        assert await server.app['redis'].smembers(jobqueue.WORKERS_KEY) == set()
+    serve(test, dispatch='queue')
+
+
+def test_lost_heartbeat(serve, monkeypatch):
+    monkeypatch.setenv('RCOMP_BENCH_RUNTIME', '2')
+    shared = fakeredis.FakeServer()
+
+    async def start_redis(self, app):
+        app['redis'] = fakeredis.FakeAsyncRedis(server=shared)
+    monkeypatch.setattr(bench.InMemoryServer, 'start_redis', start_redis)
+    monkeypatch.setattr(Worker, 'start_redis', start_redis)
+
+    async def test(server, client):
+        redis = server.app['redis']
+        res = await client.post('/ltl2ba', json={'argv': ['-f', '<>q']})
+        job_id = (await res.json())['id']
+        worker = Worker(worker_id='w', heartbeat_interval=0.1, heartbeat_ttl=1)
+        work = asyncio.ensure_future(worker.work())
+        while worker.scheduler.running() == 0:
+            await asyncio.sleep(0.05)
+        worker.lose_heartbeat()
+        # The job is cancelled without writing its result, and it is
+        # left for other workers to requeue.
+        await asyncio.wait_for(work, 1)
+        assert await redis.hget(job_id, 'done') == b'0'
+        assert await redis.lrange(jobqueue.processing_key('w'), 0, -1) == [job_id.encode()]
+        await asyncio.sleep(1.1)
+        assert await jobqueue.requeue_dead(redis) == [job_id]
+        assert await redis.hget(job_id, 'state') == b'queued'
+    serve(test, dispatch='queue')
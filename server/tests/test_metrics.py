@@ -0,0 +1,81 @@
+import asyncio
+import base64
+import zlib
+
+import fakeredis
+
+from rcompserv import metrics
+
+
+def define(m):
+    m.counter('jobs_total', 'Jobs.')
+    m.gauge('running', 'Running jobs.')
+    m.histogram('seconds', 'Durations.', buckets=(1, float('inf')))
+    return m
+
+
+def series(text):
+    return dict(line.rsplit(' ', 1) for line in text.splitlines() if not line.startswith('#'))
+
+
+def test_totals():
+    async def main():
+        redis = fakeredis.FakeAsyncRedis()
+        a = define(metrics.Metrics())
+        b = define(metrics.Metrics())
+        a.inc('jobs_total', command='gr1c')
+        b.inc('jobs_total', 2, command='gr1c')
+        b.inc('jobs_total', command='ltl2ba')
+        a.observe('seconds', 0.5)
+        b.observe('seconds', 2)
+        await b.flush(redis)
+        values = series(await a.render(redis))
+        assert values['jobs_total{command="gr1c"}'] == '3'
+        assert values['jobs_total{command="ltl2ba"}'] == '1'
+        assert values['seconds_bucket{le="1"}'] == '1'
+        assert values['seconds_bucket{le="+Inf"}'] == '2'
+        assert values['seconds_sum'] == '2.5'
+        assert values['seconds_count'] == '2'
+    asyncio.run(main())
+
+
+def test_gauges_of_lost_processes_expire():
+    async def main():
+        redis = fakeredis.FakeAsyncRedis()
+        alive = define(metrics.Metrics(flush_interval=0.1))
+        lost = define(metrics.Metrics(flush_interval=0.1))
+        stopped = define(metrics.Metrics(flush_interval=0.1))
+        for m in (alive, lost, stopped):
+            m.inc('running', 2, command='gr1c')
+            await m.start(redis)
+        alive.inc('running', -1, command='gr1c')
+        await asyncio.sleep(0.15)
+        assert series(await alive.render(redis))['running{command="gr1c"}'] == '5'
+
+        await stopped.stop(redis)
+        # A process that died without decrementing its gauges
+        lost._flusher.cancel()
+        await asyncio.sleep(0.5)
+        assert series(await alive.render(redis))['running{command="gr1c"}'] == '1'
+        assert await redis.smembers(metrics.GAUGE_PROCESSES_KEY) == {
+            alive.process_id().encode('utf-8')}
+        await alive.stop(redis)
+        observer = define(metrics.Metrics())
+        assert 'running{command="gr1c"}' not in series(await observer.render(redis))
+    asyncio.run(main())
+
+
+def test_endpoint(serve):
+    async def test(server, client):
+        spec = str(base64.b64encode(zlib.compress(b'spec')), encoding='utf-8')
+        res = await client.post('/gr1c', json={'argv': ['-r', spec]})
+        job_id = (await res.json())['id']
+        await client.get('/status/' + job_id + '?wait=10')
+        res = await client.get('/metrics')
+        assert res.status == 200
+        values = series(await res.text())
+        assert values['rcomp_jobs_submitted_total{command="gr1c"}'] == '1'
+        assert values['rcomp_jobs_succeeded_total{command="gr1c"}'] == '1'
+        assert values['rcomp_running_jobs{command="gr1c"}'] == '0'
+        assert values['rcomp_job_duration_seconds_count{command="gr1c"}'] == '1'
+    serve(test)
@@ -0,0 +1,72 @@
+import base64
+import gzip
+import json
+import zlib
+
+import aiohttp
+import pytest
+
+from rcompserv import compression
+
+
+def form(job, files):
+    data = aiohttp.FormData()
+    data.add_field('job', json.dumps(job), content_type='application/json')
+    for contents in files:
+        data.add_field('file', contents, filename='spec',
+                       content_type='application/octet-stream')
+    return data
+
+
+ENCODE = {
+    'zlib': zlib.compress,
+    'gzip': gzip.compress,
+    'none': lambda data: data,
+}
+
+
+@pytest.mark.parametrize('codec', compression.SUPPORTED_CODECS)
+def test_multipart(serve, codec):
+    if codec == 'zstd':
+        import zstandard
+        encode = zstandard.ZstdCompressor().compress
+    else:
+        encode = ENCODE[codec]
+
+    async def test(server, client):
+        spec = b'spec ' + codec.encode('utf-8')
+        res = await client.post('/gr1c', data=form({'argv': ['-r', 'local.spc'], 'codec': codec},
+                                                   [encode(spec)]))
+        assert res.status == 200
+        msg = await (await client.get('/status/' + (await res.json())['id'] + '?wait=10')).json()
+        assert msg['status'] == 'success'
+        # The staged file is the same as the file sent in JSON.
+        encoded = str(base64.b64encode(zlib.compress(spec)), encoding='utf-8')
+        res = await client.post('/gr1c', json={'argv': ['-r', encoded]})
+        msg = await (await client.get('/status/' + (await res.json())['id'] + '?wait=10')).json()
+        assert msg['cache'] == 'hit'
+    serve(test)
+
+
+def test_multipart_malformed(serve):
+    async def test(server, client):
+        spec = zlib.compress(b'spec')
+        for job, files in (({'argv': ['-r', 'a.spc']}, []),
+                           ({'argv': ['-r', 'a.spc']}, [spec, spec]),
+                           ({'argv': ['-r', '']}, [spec]),
+                           ({'argv': ['-r', 'a.spc']}, [b'not zlib'])):
+            res = await client.post('/gr1c', data=form(job, files))
+            assert res.status == 400
+            assert 'err' in await res.json()
+
+        data = aiohttp.FormData()
+        data.add_field('file', spec, filename='spec')
+        res = await client.post('/gr1c', data=data)
+        assert res.status == 400
+
+        res = await client.post('/gr1c', data=form({'argv': ['-r', 'a.spc'], 'codec': 'lzma'},
+                                                   [spec]))
+        assert res.status == 415
+        msg = await res.json()
+        assert msg['codecs'] == compression.SUPPORTED_CODECS
+    serve(test)
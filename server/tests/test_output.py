@@ -0,0 +1,98 @@
+import base64
+import zlib
+
+import pytest
+
+from rcompserv import records
+from rcompserv.serv import parse_byte_range
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-9', (0, 10)),
+    ('bytes=5-', (5, 100)),
+    ('bytes=-10', (90, 100)),
+    ('bytes=90-200', (90, 100)),
+    ('bytes=-200', (0, 100)),
+    (' bytes=1-1 ', (1, 2)),
+])
+def test_parse_byte_range(header, expected):
+    assert parse_byte_range(header, 100) == expected
+
+
+@pytest.mark.parametrize('header', ['bytes=5-2', 'bytes=-', 'bytes=0-1,5-6', 'items=0-1', 'garbage'])
+def test_parse_byte_range_ignored(header):
+    assert parse_byte_range(header, 100) is None
+
+
+@pytest.mark.parametrize('header, size', [('bytes=100-', 100), ('bytes=0-', 0), ('bytes=-1', 0)])
+def test_parse_byte_range_unsatisfiable(header, size):
+    with pytest.raises(ValueError):
+        parse_byte_range(header, size)
+
+
+async def finished_job(client):
+    spec = str(base64.b64encode(zlib.compress(b'spec')), encoding='utf-8')
+    res = await client.post('/gr1c', json={'argv': ['-r', spec]})
+    assert res.status == 200
+    msg = await (await client.get('/status/' + (await res.json())['id'] + '?wait=10')).json()
+    assert msg['status'] == 'success'
+    return msg
+
+
+def test_send_output(serve):
+    async def test(server, client):
+        msg = await finished_job(client)
+        uri = '/status/' + msg['id'] + '/output'
+        etag = '"{}"'.format(msg['output_digest'])
+
+        res = await client.get(uri)
+        assert res.status == 200
+        assert res.headers['ETag'] == etag
+        output = await res.read()
+        assert len(output) == msg['output_size'] == 65
+
+        res = await client.get(uri, headers={'Range': 'bytes=10-19'})
+        assert res.status == 206
+        assert res.headers['Content-Range'] == 'bytes 10-19/65'
+        assert await res.read() == output[10:20]
+
+        res = await client.get(uri, headers={'Range': 'bytes=60-', 'If-Range': etag})
+        assert res.status == 206
+        assert await res.read() == output[60:]
+
+        # A range of all bytes is the whole output, which can be compressed.
+        res = await client.get(uri, headers={'Range': 'bytes=0-', 'Accept-Encoding': 'gzip'})
+        assert res.status == 200
+        assert 'Content-Range' not in res.headers
+        assert await res.read() == output
+
+        # The range is ignored if the output changed.
+        res = await client.get(uri, headers={'Range': 'bytes=10-19', 'If-Range': '"other"'})
+        assert res.status == 200
+        assert await res.read() == output
+
+        res = await client.get(uri, headers={'If-None-Match': etag})
+        assert res.status == 304
+        res = await client.get(uri, headers={'If-None-Match': '"other", ' + etag})
+        assert res.status == 304
+
+        res = await client.get(uri, headers={'Range': 'bytes=65-'})
+        assert res.status == 416
+        assert res.headers['Content-Range'] == 'bytes */65'
+    serve(test)
+
+
+def test_send_compressed_output(serve):
+    async def test(server, client):
+        msg = await finished_job(client)
+        uri = '/status/' + msg['id'] + '/output'
+        output = await (await client.get(uri)).read()
+        # Output that retention compressed is sent as it was written.
+        redis = server.app['redis']
+        await redis.set(records.output_key(msg['id']), zlib.compress(output))
+        await redis.hset(msg['id'], 'output_codec', 'zlib')
+        res = await client.get(uri, headers={'Range': 'bytes=10-19'})
+        assert res.status == 206
+        assert await res.read() == output[10:20]
+        assert await (await client.get(uri)).read() == output
+    serve(test)
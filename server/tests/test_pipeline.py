@@ -0,0 +1,105 @@
+import asyncio
+import base64
+import zlib
+
+
+SPEC = str(base64.b64encode(zlib.compress(b'spec')), encoding='utf-8')
+
+STEPS = [{'name': 's', 'command': 'gr1c', 'argv': ['-r', SPEC]},
+         {'name': 't', 'command': 'gr1c', 'argv': ['-r', {'step': 's'}]},
+         {'name': 'u', 'command': 'gr1c', 'argv': ['-r', {'step': 't'}]}]
+
+
+async def start(client, steps=STEPS):
+    res = await client.post('/pipeline', json={'steps': steps})
+    assert res.status == 200
+    return (await res.json())['id']
+
+
+async def steps(client, job_id):
+    return (await (await client.get('/status/' + job_id + '/steps')).json())['steps']
+
+
+async def wait(client, job_id):
+    return await (await client.get('/status/' + job_id + '?wait=10')).json()
+
+
+def events(trace):
+    return {event['event']: event['t'] for event in trace['events']}
+
+
+def check_idle(server):
+    assert server._waiting_steps == dict()
+    assert server._children == dict()
+    assert server._cancelled == set()
+
+
+def test_order(serve, monkeypatch):
+    monkeypatch.setenv('RCOMP_BENCH_RUNTIME', '0.3')
+
+    async def test(server, client):
+        job_id = await start(client)
+        await asyncio.sleep(0.1)
+        states = {name: step['state'] for name, step in (await steps(client, job_id)).items()}
+        assert states == {'s': 'running', 't': 'waiting', 'u': 'waiting'}
+
+        assert (await wait(client, job_id))['status'] == 'success'
+        traces = dict()
+        for name, step in (await steps(client, job_id)).items():
+            assert step['status'] == 'success'
+            traces[name] = events(await (await client.get('/status/' + step['id'] + '/trace')).json())
+        assert traces['s']['exited'] <= traces['t']['spawned']
+        assert traces['t']['exited'] <= traces['u']['spawned']
+        check_idle(server)
+    serve(test, max_jobs=4)
+
+
+def test_malformed(serve):
+    async def test(server, client):
+        for steps in ([],
+                      [{'name': 's', 'command': 'nope', 'argv': []}],
+                      [{'name': 's', 'command': 'gr1c', 'argv': ['-r', SPEC]}]*2,
+                      [{'name': 'a b', 'command': 'gr1c', 'argv': ['-r', SPEC]}],
+                      [STEPS[1]],
+                      [STEPS[0], dict(STEPS[1], command='ltl2ba', argv=['-f', {'step': 's'}])],
+                      [STEPS[0], dict(STEPS[1], argv=['-r', ''])]):
+            res = await client.post('/pipeline', json={'steps': steps})
+            assert res.status == 400
+            assert 'err' in await res.json()
+    serve(test)
+
+
+def test_cancel_waiting_step(serve, monkeypatch):
+    monkeypatch.setenv('RCOMP_BENCH_RUNTIME', '0.5')
+
+    async def test(server, client):
+        job_id = await start(client)
+        await asyncio.sleep(0.1)
+        res = await client.delete('/status/' + job_id + '.t')
+        assert res.status == 200
+        assert (await res.json())['status'] == 'cancelled'
+
+        msg = await wait(client, job_id)
+        assert msg['status'] == 'cancelled'
+        assert msg['failed_step'] == 't'
+        statuses = {name: step['status'] for name, step in (await steps(client, job_id)).items()}
+        assert statuses == {'s': 'success', 't': 'cancelled', 'u': 'skipped (dependency failed)'}
+        check_idle(server)
+    serve(test, max_jobs=4)
+
+
+def test_cancel_pipeline(serve, monkeypatch):
+    monkeypatch.setenv('RCOMP_BENCH_RUNTIME', '2')
+
+    async def test(server, client):
+        job_id = await start(client)
+        await asyncio.sleep(0.1)
+        res = await client.delete('/status/' + job_id)
+        assert res.status == 200
+        assert (await wait(client, job_id))['status'] == 'cancelled'
+        await asyncio.gather(*server._coordinators)
+        statuses = {name: step['status'] for name, step in (await steps(client, job_id)).items()}
+        assert statuses == {'s': 'cancelled', 't': 'cancelled', 'u': 'cancelled'}
+        assert server._processes == dict()
+        check_idle(server)
+    serve(test, max_jobs=4)
@@ -0,0 +1,86 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+from rcompserv import prefork
+
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SERVE = """
+import sys
+import bench
+from rcompserv import prefork
+
+sock = prefork.bind_unix(sys.argv[1])
+try:
+    prefork.run(bench.InMemoryServer(), 2, sock=sock)
+finally:
+    prefork.unbind(sock)
+"""
+
+
+def workers(pid):
+    with open('/proc/{}/task/{}/children'.format(pid, pid)) as fp:
+        return sorted(int(child) for child in fp.read().split())
+
+
+async def get_index(path):
+    async with aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=path)) as session:
+        async with session.get('http://localhost/') as res:
+            return res.status
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_bind_unix(tmp_path):
+    path = str(tmp_path / 'rcomp.sock')
+    # A stale socket is replaced.
+    open(path, 'w').close()
+    sock = prefork.bind_unix(path)
+    assert sock.getsockname() == path
+    prefork.unbind(sock)
+    assert not os.path.exists(path)
+
+
+def test_run(tmp_path):
+    path = str(tmp_path / 'rcomp.sock')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [os.path.join(TESTS_DIR, '..'), os.path.join(TESTS_DIR, '..', 'bench')]))
+    parent = subprocess.Popen([sys.executable, '-c', SERVE, path], env=env,
+                              stdout=subprocess.DEVNULL)
+    try:
+        wait_for(lambda: os.path.exists(path) and len(workers(parent.pid)) == 2)
+        wait_for(lambda: asyncio.run(get_index(path)) == 200)
+        for _ in range(4):
+            assert asyncio.run(get_index(path)) == 200
+
+        # A worker that exits is restarted.
+        crashed = workers(parent.pid)[0]
+        os.kill(crashed, signal.SIGKILL)
+        wait_for(lambda: len(workers(parent.pid)) == 2
+                 and crashed not in workers(parent.pid))
+        assert asyncio.run(get_index(path)) == 200
+        # Cancelling a command of fakeredis can be ignored, so workers
+        # are only stopped once their background tasks are idle.
+        time.sleep(0.5)
+
+        parent.send_signal(signal.SIGTERM)
+        assert parent.wait(10) == 0
+        assert not os.path.exists(path)
+    finally:
+        if parent.poll() is None:
+            for pid in workers(parent.pid):
+                os.kill(pid, signal.SIGKILL)
+            parent.kill()
+            parent.wait()
@@ -0,0 +1,98 @@
+import asyncio
+import os
+
+import fakeredis
+
+from rcompserv import probes
+
+
+def install(bin_dir, name, script, mtime=None):
+    path = bin_dir / name
+    path.write_text('#!/bin/sh\n' + script)
+    path.chmod(0o755)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+class Check:
+    """check that counts calls and returns `found`"""
+    def __init__(self, found):
+        self.found = found
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if isinstance(self.found, Exception):
+            raise self.found
+        return self.found
+
+
+def test_probe_all(tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', str(tmp_path) + os.pathsep + os.environ['PATH'])
+    path = install(tmp_path, 'tool', 'true\n', mtime=1000)
+
+    async def main():
+        redis = fakeredis.FakeAsyncRedis()
+        check = Check('tool 1.0')
+        probe = probes.Probe('tool', check, tool='tool')
+        assert await probes.probe_all([probe], redis) == [probe]
+        assert probe.available and probe.version == 'tool 1.0'
+        assert probe.result['path'] == str(path)
+
+        # Other processes on this host use the cached result.
+        other = probes.Probe('tool', check, tool='tool')
+        assert await probes.probe_all([other], redis) == [other]
+        assert other.version == 'tool 1.0'
+        assert check.calls == 1
+        assert await redis.ttl(probes.probes_key()) > 0
+
+        # The executable changed, so it is probed again.
+        check.found = 'tool 2.0'
+        os.utime(path, (2000, 2000))
+        assert await probes.probe_all([probe], redis) == [probe]
+        assert probe.version == 'tool 2.0'
+        assert check.calls == 2
+        assert await probes.probe_all([probe], redis) == []
+        assert check.calls == 2
+    asyncio.run(main())
+
+
+def test_probe_unavailable(tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', str(tmp_path))
+    install(tmp_path, 'broken', 'true\n')
+
+    async def main():
+        missing = probes.Probe('missing', Check(True), tool='missing')
+        broken = probes.Probe('broken', Check(OSError('broken')), tool='broken')
+        untooled = probes.Probe('untooled', Check(True))
+        await probes.probe_all([missing, broken, untooled])
+        # Checks are not run if the tool is not installed.
+        assert missing.check.calls == 0
+        assert not missing.available
+        assert not broken.available and broken.check.calls == 1
+        assert untooled.available and untooled.version is None
+        # Results of probes without a tool are never reused.
+        await probes.probe_all([untooled])
+        assert untooled.check.calls == 2
+    asyncio.run(main())
+
+
+def test_reprobe(serve, tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', str(tmp_path) + os.pathsep + os.environ['PATH'])
+    install(tmp_path, 'ltl2ba', 'echo broken\n', mtime=1000)
+
+    async def test(server, client):
+        res = await client.post('/ltl2ba', json={'argv': ['-f', 'p']})
+        assert res.status == 404
+        assert await res.json() == {'err': 'command not available: ltl2ba'}
+        assert 'ltl2ba' not in server.known_commands
+
+        # A tool that is fixed while the server runs is picked up.
+        install(tmp_path, 'ltl2ba', "echo 'never {'; echo '}'\n", mtime=2000)
+        await server.reprobe(server.app['redis'])
+        assert 'ltl2ba' in server.known_commands
+        res = await client.post('/ltl2ba', json={'argv': ['-f', 'p']})
+        msg = await (await client.get('/status/' + (await res.json())['id'] + '?wait=10')).json()
+        assert msg['status'] == 'success'
+    serve(test)
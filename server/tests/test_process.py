@@ -0,0 +1,34 @@
+import asyncio
+import sys
+
+import pytest
+
+from rcompserv import process
+
+
+async def run(cmd):
+    pr = await process.start(cmd)
+    await pr.stdout.read()
+    await pr.stderr.read()
+    assert await pr.wait() == 0
+    return pr.usage()
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='peak RSS is inherited on Linux')
+def test_peak_rss_not_inherited():
+    # Peak RSS of this process is far above that of the subprocesses.
+    ballast = bytearray(256*2**20)
+    for ii in range(0, len(ballast), 4096):
+        ballast[ii] = 1
+    usage = asyncio.run(run(['sleep', '0.2']))
+    assert 0 < usage['max_rss_bytes'] < 32*2**20
+    usage = asyncio.run(run([sys.executable, '-c',
+                             'import time; b = bytearray(96*2**20); time.sleep(0.5)']))
+    assert 96*2**20 < usage['max_rss_bytes'] < 192*2**20
+    assert len(ballast) > 0
+
+
+def test_usage():
+    usage = asyncio.run(run([sys.executable, '-c', 'sum(range(10**6))']))
+    assert usage['max_rss_bytes'] is None or usage['max_rss_bytes'] > 0
+    assert usage['user_seconds'] + usage['system_seconds'] > 0
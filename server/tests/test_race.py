@@ -0,0 +1,77 @@
+import asyncio
+import os
+
+import pytest
+
+
+# Options of the fake ltl2ba select how each variant ends.
+RACING_LTL2BA = """#!/bin/sh
+case "$1" in
+    -l) echo lost; exit 1;;
+    -p) sleep 10; echo late;;
+    -d) sleep 0.2; echo won;;
+    *) echo 'never { /* fake */'; echo '}';;
+esac
+"""
+
+
+@pytest.fixture
+def racing_tools(tmp_path, monkeypatch):
+    path = tmp_path / 'ltl2ba'
+    path.write_text(RACING_LTL2BA)
+    path.chmod(0o755)
+    monkeypatch.setenv('PATH', str(tmp_path) + os.pathsep + os.environ['PATH'])
+
+
+async def race(client, variants):
+    res = await client.post('/ltl2ba', json={'argv': ['-f', 'p'], 'variants': variants})
+    assert res.status == 200
+    msg = await res.json()
+    return await (await client.get('/status/' + msg['id'] + '?wait=10&output=inline')).json()
+
+
+def test_race(serve, racing_tools):
+    async def test(server, client):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        msg = await race(client, [['-l'], ['-p'], ['-d']])
+        # The variant that succeeds wins, although another one
+        # finished first, and the slow variant is cancelled.
+        assert loop.time() - start < 5
+        assert msg['status'] == 'success'
+        assert msg['winner'] == 2
+        assert msg['output'] == 'won\n'
+        assert len(msg['variants']) == 3
+        statuses = [await (await client.get('/status/' + child_id + '?wait=10')).json()
+                    for child_id in msg['variants']]
+        assert statuses[0]['ec'] == 1
+        assert statuses[1]['status'] == 'cancelled'
+        assert statuses[2]['status'] == 'success'
+    serve(test, max_jobs=3)
+
+
+def test_race_lost(serve, racing_tools):
+    async def test(server, client):
+        msg = await race(client, [['-l'], ['-l', '-d']])
+        # Without a winner, the race has the result of the variant
+        # that finished first.
+        assert 'winner' not in msg
+        assert msg['ec'] == 1
+        assert msg['output'] == 'lost\n'
+    serve(test, max_jobs=2)
+
+
+@pytest.mark.parametrize('variants', [
+    [['-d']],
+    {'a': ['-d']},
+    [['-d'], '-l'],
+    [['-d'], ['']],
+    [['-d'], [1]],
+    [['-d'], ['-F', 'file']],
+])
+def test_malformed_variants(serve, variants):
+    async def test(server, client):
+        res = await client.post('/ltl2ba', json={'argv': ['-f', 'p'], 'variants': variants})
+        assert res.status == 400
+        assert 'err' in await res.json()
+    serve(test)
@@ -0,0 +1,93 @@
+import asyncio
+
+import fakeredis
+
+from rcompserv import records
+from rcompserv.resultcache import INFLIGHT_PREFIX, ResultCache
+
+
+RESULT = {'state': 'done', 'done': 1, 'status': 'success', 'exitcode': 0,
+          'output_size': 2}
+
+
+def test_claim_complete():
+    async def main():
+        redis = fakeredis.FakeAsyncRedis()
+        cache = ResultCache()
+        assert await cache.claim(redis, 'd', 'leader') is None
+        assert await cache.claim(redis, 'd', 'second') == 'leader'
+        assert await cache.claim(redis, 'd', 'third') == 'leader'
+        assert await cache.is_shared(redis, 'd', 'leader')
+        assert await cache.detach(redis, 'd', 'third')
+
+        await redis.set(records.output_key('leader'), b'ok')
+        await redis.hset('leader', mapping=RESULT)
+        assert await cache.complete(redis, 'd', 'leader', RESULT) == ['second']
+        assert await redis.get(records.output_key('second')) == b'ok'
+        assert (await redis.hget('second', 'cache')) == b'shared'
+        assert (await redis.hget('second', 'status')) == b'success'
+        assert not await redis.exists(records.output_key('third'))
+        assert not await redis.exists(INFLIGHT_PREFIX + 'd', INFLIGHT_PREFIX + 'd:attached')
+        restored = await cache.restore(redis, 'd', 'later')
+        assert restored['status'] == b'success'
+        assert await redis.get(records.output_key('later')) == b'ok'
+
+        # The digest can be claimed again after the job completed.
+        assert await cache.claim(redis, 'd', 'next') is None
+    asyncio.run(main())
+
+
+def test_lost_claim_expires():
+    async def main():
+        redis = fakeredis.FakeAsyncRedis()
+        held = ResultCache(inflight_ttl=1)
+        lost = ResultCache(inflight_ttl=1)
+        assert await held.claim(redis, 'h', 'running') is None
+        assert await lost.claim(redis, 'l', 'lost') is None
+        assert await ResultCache().claim(redis, 'l', 'attached') == 'lost'
+        lost._claims.clear()
+        await held.start(redis)
+        try:
+            await asyncio.sleep(1.5)
+        finally:
+            await held.stop()
+        assert await ResultCache().claim(redis, 'h', 'other') == 'running'
+        # The next job that claims the digest is also given the attached job.
+        assert await ResultCache().claim(redis, 'l', 'new') is None
+        await redis.hset('new', mapping=RESULT)
+        assert await ResultCache().complete(redis, 'l', 'new', RESULT) == ['attached']
+    asyncio.run(main())
+
+
+def test_cache_hit(serve):
+    async def test(server, client):
+        ids = []
+        for ii in range(2):
+            res = await client.post('/ltl2ba', json={'argv': ['-f', '[]<>p']})
+            assert res.status == 200
+            ids.append((await res.json())['id'])
+            msg = await (await client.get('/status/' + ids[-1] + '?wait=10')).json()
+            assert msg['status'] == 'success'
+            assert msg['cmd'] == 'ltl2ba -f []<>p'
+        assert msg['cache'] == 'hit'
+        msg = await (await client.get('/status/' + ids[0])).json()
+        assert msg.get('cache') == 'miss'
+    serve(test)
+
+
+def test_attached(serve, monkeypatch):
+    monkeypatch.setenv('RCOMP_BENCH_RUNTIME', '1')
+
+    async def test(server, client):
+        ids = []
+        for ii in range(2):
+            res = await client.post('/ltl2ba', json={'argv': ['-f', '<>q']})
+            ids.append((await res.json())['id'])
+        msg = await (await client.get('/status/' + ids[1])).json()
+        assert msg['state'] == 'attached'
+        assert msg['cmd'] == 'ltl2ba -f <>q'
+        for job_id in ids:
+            msg = await (await client.get('/status/' + job_id + '?wait=10')).json()
+            assert msg['status'] == 'success'
+        assert msg['cache'] == 'shared'
+    serve(test)
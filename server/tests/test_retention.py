@@ -0,0 +1,100 @@
+import asyncio
+import base64
+import zlib
+
+import fakeredis
+
+from rcompserv import records
+from rcompserv.retention import BYTES_KEY, FINISHED_KEY, Retention
+
+
+async def finished(redis, job_id, output):
+    await redis.hset(job_id, mapping={'state': 'done', 'done': 1})
+    await redis.set(records.output_key(job_id), output)
+
+
+def test_finish():
+    async def main():
+        redis = fakeredis.FakeAsyncRedis()
+        retention = Retention(ttl=100, compress_threshold=10)
+        await finished(redis, 'small', b'x'*10)
+        await finished(redis, 'large', b'x'*1000)
+        await finished(redis, 'random', bytes(range(256)))
+        for job_id in ('small', 'large', 'random'):
+            await retention.finish(redis, job_id)
+
+        assert await redis.hget('small', 'output_codec') is None
+        assert await redis.hget('random', 'output_codec') is None
+        assert await redis.hget('large', 'output_codec') == b'zlib'
+        output = await redis.get(records.output_key('large'))
+        assert records.decode_output({'output_codec': b'zlib'}, output) == b'x'*1000
+        assert 0 < await redis.ttl('large') <= 100
+        assert 0 < await redis.ttl(records.output_key('large')) <= 100
+
+        stats = await retention.stats(redis)
+        assert stats['jobs'] == 3
+        assert stats['bytes'] == 10 + len(output) + 256
+        assert stats['compressed_bytes'] == 1000 - len(output)
+    asyncio.run(main())
+
+
+def test_sweep_expired():
+    async def main():
+        redis = fakeredis.FakeAsyncRedis()
+        retention = Retention(ttl=1, max_bytes=None)
+        await finished(redis, 'read', b'x'*10)
+        await finished(redis, 'unread', b'x'*20)
+        for job_id in ('read', 'unread'):
+            await retention.finish(redis, job_id)
+        await asyncio.sleep(0.5)
+        # Reading the status of a job resets its TTL.
+        await redis.expire('read', 1)
+        await asyncio.sleep(0.6)
+        await retention.sweep(redis)
+        assert await redis.zrange(FINISHED_KEY, 0, -1) == [b'read']
+        stats = await retention.stats(redis)
+        assert (stats['expired_jobs'], stats['expired_bytes'], stats['bytes']) == (1, 20, 10)
+    asyncio.run(main())
+
+
+def test_sweep_evicted():
+    async def main():
+        redis = fakeredis.FakeAsyncRedis()
+        retention = Retention(ttl=None, compress_threshold=None, max_bytes=25)
+        for job_id in ('a', 'b', 'c'):
+            await finished(redis, job_id, b'x'*10)
+            await retention.finish(redis, job_id)
+        await retention.sweep(redis)
+        # Jobs that finished first are evicted.
+        assert not await redis.exists('a', records.output_key('a'))
+        assert await redis.exists('b', 'c') == 2
+        assert int(await redis.get(BYTES_KEY)) == 20
+        stats = await retention.stats(redis)
+        assert (stats['evicted_jobs'], stats['evicted_bytes']) == (1, 10)
+    asyncio.run(main())
+
+
+def test_retention(serve):
+    async def test(server, client):
+        spec = str(base64.b64encode(zlib.compress(b'spec')), encoding='utf-8')
+        res = await client.post('/gr1c', json={'argv': ['-r', spec]})
+        job_id = (await res.json())['id']
+        msg = await (await client.get('/status/' + job_id + '?wait=10&output=inline')).json()
+        assert msg['output'] == 'x'*64 + '\n'
+        # The retention policy applies once the result is written.
+        await server.scheduler.join()
+        assert await server.app['redis'].hget(job_id, 'output_codec') == b'zlib'
+        msg = await (await client.get('/status/' + job_id + '?output=inline')).json()
+        assert msg['output'] == 'x'*64 + '\n'
+        stats = await (await client.get('/retention')).json()
+        assert stats['ttl'] == 3600
+        assert stats['jobs'] == 1
+        assert stats['compressed_bytes'] > 0
+    serve(test, retention=Retention(ttl=3600, compress_threshold=32))
+
+
+def test_no_retention(serve):
+    async def test(server, client):
+        res = await client.get('/retention')
+        assert 'err' in await res.json()
+    serve(test, retention=False)
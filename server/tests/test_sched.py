@@ -0,0 +1,198 @@
+import asyncio
+import base64
+import zlib
+
+import pytest
+
+from rcompserv.sched import QueueFull, Scheduler
+from rcompserv.serv import client_key_identity
+
+
+class Jobs:
+    """jobs that run until they are released"""
+    def __init__(self):
+        self.started = []
+        self._releases = dict()
+
+    def start(self, job_id):
+        async def run():
+            self.started.append(job_id)
+            self._releases[job_id] = asyncio.Event()
+            await self._releases[job_id].wait()
+        return run
+
+    async def release(self, job_id):
+        self._releases[job_id].set()
+        # Let the job finish and the scheduler start the next ones.
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+
+def test_capacity():
+    async def main():
+        jobs = Jobs()
+        s = Scheduler(max_jobs=2, max_jobs_per_command={'ltl2ba': 1}, max_queue=2)
+        assert s.submit('a', 'ltl2ba', jobs.start('a')) == 0
+        assert s.submit('b', 'ltl2ba', jobs.start('b')) == 1
+        # Jobs of other commands are not blocked by the limit of ltl2ba.
+        assert s.submit('c', 'gr1c', jobs.start('c')) == 0
+        assert s.submit('d', 'gr1c', jobs.start('d')) == 2
+        assert s.is_full()
+        with pytest.raises(QueueFull):
+            s.submit('e', 'gr1c', jobs.start('e'))
+        await asyncio.sleep(0)
+        assert jobs.started == ['a', 'c']
+        assert (s.running(), s.running('ltl2ba'), s.pending()) == (2, 1, 2)
+        assert s.positions(['a', 'b', 'd', 'e']) == [0, 1, 2, None]
+
+        await jobs.release('a')
+        assert jobs.started == ['a', 'c', 'b']
+        assert s.position('d') == 1
+        await jobs.release('c')
+        assert jobs.started == ['a', 'c', 'b', 'd']
+        await jobs.release('b')
+        await jobs.release('d')
+        await asyncio.wait_for(s.join(), 1)
+        assert (s.running(), s.pending()) == (0, 0)
+    asyncio.run(main())
+
+
+def test_cancel():
+    async def main():
+        jobs = Jobs()
+        s = Scheduler(max_jobs=1)
+        s.submit('a', 'gr1c', jobs.start('a'))
+        start = jobs.start('b')
+        s.submit('b', 'gr1c', start)
+        s.submit('c', 'gr1c', jobs.start('c'))
+        assert s.cancel('b') is start
+        assert s.cancel('b') is None
+        assert s.cancel('a') is None
+        assert s.position('c') == 1
+        assert sorted(s.job_ids()) == ['a', 'c']
+        await asyncio.sleep(0)
+        await jobs.release('a')
+        assert jobs.started == ['a', 'c']
+        await jobs.release('c')
+        await asyncio.wait_for(s.join(), 1)
+    asyncio.run(main())
+
+
+def test_wait_for_capacity():
+    async def main():
+        jobs = Jobs()
+        s = Scheduler(max_jobs=1)
+        s.submit('a', 'gr1c', jobs.start('a'))
+        waiter = asyncio.ensure_future(s.wait_for_capacity())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        await jobs.release('a')
+        await asyncio.wait_for(waiter, 1)
+    asyncio.run(main())
+
+
+def test_fair_queuing():
+    async def main():
+        jobs = Jobs()
+        s = Scheduler(max_jobs=1, max_queue=None)
+        s.submit('a0', 'gr1c', jobs.start('a0'), client='a')
+        for ii in range(1, 4):
+            s.submit('a' + str(ii), 'gr1c', jobs.start('a' + str(ii)), client='a')
+        s.submit('b0', 'gr1c', jobs.start('b0'), client='b')
+        s.submit('b1', 'gr1c', jobs.start('b1'), client='b', priority=1)
+        # Clients alternate, and the job of b with higher priority is
+        # first among its jobs although it was submitted later.
+        assert s.positions(['a1', 'b1', 'a2', 'b0', 'a3']) == [2, 1, 4, 3, 5]
+        await asyncio.sleep(0)
+        for ii in range(6):
+            await jobs.release(jobs.started[-1])
+        assert jobs.started == ['a0', 'b1', 'a1', 'b0', 'a2', 'a3']
+        await asyncio.wait_for(s.join(), 1)
+    asyncio.run(main())
+
+
+def test_client_weights():
+    async def main():
+        jobs = Jobs()
+        s = Scheduler(max_jobs=1, max_queue=None, client_weights={'a': 2})
+        s.submit('x', 'gr1c', jobs.start('x'), client='c')
+        for ii in range(4):
+            s.submit('a' + str(ii), 'gr1c', jobs.start('a' + str(ii)), client='a')
+            s.submit('b' + str(ii), 'gr1c', jobs.start('b' + str(ii)), client='b')
+        await asyncio.sleep(0)
+        for ii in range(9):
+            await jobs.release(jobs.started[-1])
+        # Client a, which has twice the weight of b, starts twice as
+        # many jobs while both have jobs queued.
+        assert jobs.started[1:7] == ['a0', 'b0', 'a1', 'b1', 'a2', 'a3']
+        await asyncio.wait_for(s.join(), 1)
+    asyncio.run(main())
+
+
+def test_max_jobs_per_client():
+    async def main():
+        jobs = Jobs()
+        s = Scheduler(max_jobs=3, max_jobs_per_client=2)
+        for ii in range(3):
+            s.submit('a' + str(ii), 'gr1c', jobs.start('a' + str(ii)), client='a')
+        s.submit('b0', 'gr1c', jobs.start('b0'), client='b')
+        await asyncio.sleep(0)
+        assert sorted(jobs.started) == ['a0', 'a1', 'b0']
+        assert s.share('a') == {'running': 2, 'queued': 1, 'share': 2/3, 'weight': 1}
+        await jobs.release('b0')
+        # Capacity that client b freed is not taken by client a.
+        assert s.running() == 2
+        await jobs.release('a0')
+        assert 'a2' in jobs.started
+        await jobs.release('a1')
+        await jobs.release('a2')
+        await asyncio.wait_for(s.join(), 1)
+    asyncio.run(main())
+
+
+def test_client_share(serve, monkeypatch):
+    monkeypatch.setenv('RCOMP_BENCH_RUNTIME', '1')
+
+    async def test(server, client):
+        ids = []
+        for spec, key in ((b'a', 'one'), (b'b', 'one'), (b'c', 'two')):
+            spec = str(base64.b64encode(zlib.compress(spec)), encoding='utf-8')
+            res = await client.post('/gr1c', json={'argv': ['-r', spec]},
+                                    headers={'X-Rcomp-Key': key})
+            assert res.status == 200
+            ids.append((await res.json())['id'])
+        msg = await (await client.get('/status/' + ids[0])).json()
+        assert msg['client'] == client_key_identity('one')
+        assert msg['client_share'] == {'running': 1, 'queued': 1, 'share': 1.0,
+                                       'weight': 2}
+        # The job of the other client starts before the second of the first.
+        msg = await (await client.get('/status/' + ids[2])).json()
+        assert msg['position'] == 1
+        res = await client.post('/gr1c', json={'argv': ['-r', 'x'], 'priority': 'high'})
+        assert res.status == 400
+        for job_id in ids:
+            msg = await (await client.get('/status/' + job_id + '?wait=10')).json()
+            assert msg['status'] == 'success'
+    serve(test, max_jobs=1, client_weights={'one': 2})
+
+
+def test_state_after_submission(serve, monkeypatch):
+    monkeypatch.setenv('RCOMP_BENCH_RUNTIME', '1')
+
+    async def test(server, client):
+        statuses = []
+        for spec in (b'a', b'b', b'c'):
+            spec = str(base64.b64encode(zlib.compress(spec)), encoding='utf-8')
+            res = await client.post('/gr1c', json={'argv': ['-r', spec]})
+            statuses.append((res.status, await res.json()))
+        assert statuses[0][0] == 200
+        assert statuses[0][1]['state'] == 'running'
+        assert statuses[1][0] == 200
+        assert statuses[1][1]['state'] == 'queued'
+        assert statuses[1][1]['position'] == 1
+        assert statuses[2][0] == 429
+        assert statuses[2][1] == {'err': 'job queue is full'}
+        for _, msg in statuses[:2]:
+            msg = await (await client.get('/status/' + msg['id'] + '?wait=10')).json()
+            assert msg['status'] == 'success'
+    serve(test, max_jobs=1, max_queue=1)
@@ -0,0 +1,173 @@
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+import subprocess
+import zlib
+
+import pytest
+
+from rcompserv import compression
+from rcompserv import staging
+from rcompserv.serv import Server
+
+
+def encode(data):
+    return str(base64.b64encode(zlib.compress(data)), encoding='utf-8')
+
+
+def test_decode():
+    data = bytes(range(256)) * 1000
+    staged_file = io.BytesIO()
+    limits = staging.SizeLimits()
+    compressed_size, size, digest = staging.decode(encode(data), limits, staged_file)
+    assert compressed_size == len(zlib.compress(data))
+    assert size == len(data) == limits.job_bytes
+    assert digest == hashlib.sha256(data).digest()
+    assert staged_file.getvalue() == data
+
+
+def test_decode_file_limit():
+    with pytest.raises(staging.InputTooLarge) as err:
+        staging.decode(encode(b'x' * 1001), staging.SizeLimits(max_file_bytes=1000))
+    assert err.value.limit == 1000
+    assert err.value.size == 1001
+    staging.decode(encode(b'x' * 1000), staging.SizeLimits(max_file_bytes=1000))
+
+
+def test_decode_job_limit():
+    limits = staging.SizeLimits(max_job_bytes=1500)
+    staging.decode(encode(b'x' * 1000), limits)
+    with pytest.raises(staging.InputTooLarge) as err:
+        staging.decode(encode(b'x' * 1000), limits)
+    assert err.value.limit == 1500
+    assert err.value.size == 2000
+
+
+def test_decode_bomb():
+    # Decompression stops at the limit instead of at the end of data.
+    data = str(base64.b64encode(zlib.compress(b'\0' * 2**28, 9)), encoding='utf-8')
+    staged_file = io.BytesIO()
+    with pytest.raises(staging.InputTooLarge):
+        staging.decode(data, staging.SizeLimits(max_file_bytes=2**20), staged_file)
+    assert len(staged_file.getvalue()) <= 2**20
+
+
+def test_decode_truncated():
+    compressed = zlib.compress(b'spec' * 1000)
+    data = str(base64.b64encode(compressed[:-8]), encoding='utf-8')
+    with pytest.raises(zlib.error):
+        staging.decode(data, staging.SizeLimits())
+
+
+@pytest.mark.parametrize('data', ['not base64!', str(base64.b64encode(b'not zlib'), 'utf-8')])
+def test_decode_malformed(data):
+    with pytest.raises((ValueError, zlib.error)):
+        staging.decode(data, staging.SizeLimits())
+
+
+def test_decode_pieces():
+    data = b'x' * (10 * staging.DECODED_CHUNK_SIZE)
+    limits = staging.SizeLimits()
+    pieces = staging.decode_pieces(encode(data), limits)
+    next(pieces)
+    assert 0 < limits.job_bytes <= staging.DECODED_CHUNK_SIZE
+    assert staging.run(pieces) == (len(zlib.compress(data)), len(data),
+                                   hashlib.sha256(data).digest())
+
+
+def test_zstd_decoder():
+    zstandard = pytest.importorskip('zstandard')
+    data = b'abc' * 100000
+    compressed = zstandard.ZstdCompressor().compress(data)
+    staged_file = io.BytesIO()
+    decoder = staging.Decoder(compression.decompressor('zstd'), staging.SizeLimits(),
+                              staged_file)
+    for start in range(0, len(compressed), 100):
+        decoder.feed(compressed[start:start+100])
+    assert decoder.finish() == hashlib.sha256(data).digest()
+    assert staged_file.getvalue() == data
+
+    decoder = staging.Decoder(compression.decompressor('zstd'),
+                              staging.SizeLimits(max_file_bytes=1000))
+    with pytest.raises(staging.InputTooLarge):
+        decoder.feed(compressed)
+
+    decoder = staging.Decoder(compression.decompressor('zstd'), staging.SizeLimits())
+    decoder.feed(compressed[:-4])
+    with pytest.raises(zlib.error):
+        decoder.finish()
+
+
+def test_too_large(serve):
+    async def test(server, client):
+        spec = encode(b'x' * 2000)
+        res = await client.post('/gr1c', json={'argv': ['-r', spec]})
+        assert res.status == 413
+        assert (await res.json())['limit'] == 1000
+        res = await client.post('/gr1c', json={'argv': ['-r', encode(b'x' * 600), encode(b'x' * 600)]})
+        assert res.status == 413
+        assert (await res.json())['limit'] == 1100
+        res = await client.post('/gr1c', json={'argv': ['-r', 'not base64!']})
+        assert res.status == 400
+        res = await client.post('/gr1c', json={'argv': ['-r', encode(b'x' * 1000)]})
+        assert res.status == 200
+    serve(test, max_input_bytes=1000, max_job_input_bytes=1100)
+
+
+def test_too_large_response():
+    err = staging.InputTooLarge('input file is larger than 10 bytes', 10, 12)
+    resp = Server().too_large(err)
+    assert resp.status == 413
+    assert json.loads(resp.text) == {'err': 'input file is larger than 10 bytes', 'limit': 10}
+
+
+def test_inputs_in_memory(tmp_path):
+    inputs = staging.Inputs(memory_threshold=10, directory=str(tmp_path))
+    path = inputs.write(b'small')
+    assert path.startswith('/dev/fd/')
+    assert not inputs.on_disk()
+    # Subprocesses of the job read files that are in memory.
+    output = subprocess.check_output(['cat', path], pass_fds=inputs.fds)
+    assert output == b'small'
+    inputs.remove()
+    assert inputs.fds == []
+
+
+def test_inputs_on_disk(tmp_path):
+    inputs = staging.Inputs(memory_threshold=10, directory=str(tmp_path))
+    staged_file = inputs.open()
+    staged_file.write(b'x'*8)
+    assert staged_file.in_memory
+    # The file is moved to disk once it exceeds the threshold.
+    staged_file.write(b'y'*8)
+    assert not staged_file.in_memory
+    path = staged_file.close()
+    assert path.startswith(str(tmp_path))
+    assert inputs.fds == []
+    with open(path, 'rb') as fp:
+        assert fp.read() == b'x'*8 + b'y'*8
+
+    always = staging.Inputs(memory_threshold=None, directory=str(tmp_path))
+    assert not always.write(b'').startswith('/dev/fd/')
+    always.remove()
+
+    # Files are removed once all jobs that share them are done.
+    inputs.share()
+    inputs.remove()
+    assert os.path.exists(path)
+    asyncio.run(staging.remove(inputs))
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_staged_jobs(serve, tmp_path):
+    async def test(server, client):
+        for spec in (b'small', b'large' * 100):
+            res = await client.post('/gr1c', json={'argv': ['-r', encode(spec)]})
+            msg = await (await client.get('/status/' + (await res.json())['id'] + '?wait=10')).json()
+            assert msg['status'] == 'success'
+        await server.scheduler.join()
+        assert os.listdir(str(tmp_path)) == []
+    serve(test, input_memory_threshold=100, staging_dir=str(tmp_path))
@@ -0,0 +1,49 @@
+import base64
+import zlib
+
+
+async def submit(client, spec):
+    spec = str(base64.b64encode(zlib.compress(spec)), encoding='utf-8')
+    res = await client.post('/gr1c', json={'argv': ['-r', spec]})
+    assert res.status == 200
+    return (await res.json())['id']
+
+
+def test_batch_status(serve, monkeypatch):
+    monkeypatch.setenv('RCOMP_BENCH_RUNTIME', '0.5')
+
+    async def test(server, client):
+        done = await submit(client, b'done')
+        msg = await (await client.get('/status/' + done + '?wait=10')).json()
+        assert msg['status'] == 'success'
+        running = await submit(client, b'running')
+        queued = await submit(client, b'queued')
+
+        ids = [done, running, queued, 'nope']
+        res = await client.post('/status', json={'ids': ids})
+        assert res.status == 200
+        jobs = (await res.json())['jobs']
+        assert sorted(jobs) == sorted(ids)
+        assert jobs['nope'] is None
+        # Statuses are the same as those of single jobs.
+        assert jobs[done] == msg
+        assert 'output' not in jobs[done]
+        assert jobs[running]['state'] == 'running'
+        assert jobs[queued]['state'] == 'queued'
+        assert jobs[queued]['position'] == 1
+
+        res = await client.post('/status', json={'ids': [done], 'output': 'inline'})
+        assert (await res.json())['jobs'][done]['output'] == 'x'*64 + '\n'
+        res = await client.post('/status', json={'ids': []})
+        assert (await res.json())['jobs'] == {}
+    serve(test, max_jobs=1)
+
+
+def test_batch_status_malformed(serve):
+    async def test(server, client):
+        for body in (b'not json', b'{}', b'{"ids": "a"}', b'{"ids": [1]}',
+                     b'{"ids": ["a", "b", "c"]}'):
+            res = await client.post('/status', data=body)
+            assert res.status == 400
+            assert 'err' in await res.json()
+    serve(test, max_batch=2)